@@ -0,0 +1,409 @@
+"""JSON HTTP API over the same DatabaseManager / business_logic code as the UI.
+
+Run it on its own with ``python api.py`` (see the Procfile), or inside the
+Streamlit process with API_IN_PROCESS=1. Clients log in once with
+``POST /api/login`` and send ``Authorization: Bearer <token>`` afterwards;
+everything is scoped to the caller's pantry, as in the UI.
+
+GET responses carry an ETag made from the pantry's data version (the change
+journal), so a client polling with If-None-Match gets a 304 for the price of
+one indexed lookup. Exports are streamed with chunked transfer encoding.
+
+    GET    /api/health
+    POST   /api/login                 {username, password} -> {token, user_id, pantry_id}
+    GET    /api/inventory
+    POST   /api/inventory/batch       {edits: [...]}  see DatabaseManager.apply_inventory_edits
+    POST   /api/inventory/lots        {lots: [{name, quantity, unit, expires_at?, price?}]}
+    POST   /api/inventory/receipt     {text, dry_run?}  see receipts.parse_text
+    GET    /api/recipes
+    GET    /api/recipes/<id>
+    POST   /api/recipes/batch         {recipes: [...], update_existing?}  see DatabaseManager.upsert_recipes
+    DELETE /api/recipes/<id>?version=<n>
+    GET    /api/feasibility?scale=<f>
+    GET    /api/shopping-list?recipe_id=<id>&...&scale=<f>
+    GET    /api/week?meals=<n>&scale=<f>
+    GET    /api/export/recipes.csv
+    GET    /api/export/backup
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from config import API_HOST, API_PORT, API_MAX_BODY_BYTES
+from database import DatabaseManager
+from security import issue_session_token, login_limiter, verify_session_token
+from utils import from_base, round_for_unit
+
+logger = logging.getLogger(__name__)
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class Stream:
+    """A response body produced piece by piece (sent with chunked transfer encoding)."""
+
+    def __init__(self, chunks: Iterable[bytes], content_type: str, filename: Optional[str] = None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.filename = filename
+
+class Request:
+    def __init__(self, method: str, path: str, query: Dict[str, List[str]], body: Any,
+                 user_id: Optional[int], pantry_id: Optional[int], version: Optional[int]):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.user_id = user_id
+        self.pantry_id = pantry_id
+        self.version = version
+
+    def arg(self, name: str, default: Any = None, kind: Callable[[str], Any] = str) -> Any:
+        values = self.query.get(name)
+        if not values:
+            return default
+        try:
+            return kind(values[0])
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Invalid value for '{name}'.")
+
+    def field(self, name: str, kind: type = list) -> Any:
+        value = self.body.get(name) if isinstance(self.body, dict) else None
+        if not isinstance(value, kind):
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Body must be a JSON object with a '{name}' {kind.__name__}.")
+        return value
+
+# The API's own executor: results are keyed by pantry and data
+# version, so identical concurrent requests compute once and repeats are cache hits.
+_jobs = None
+_jobs_lock = threading.Lock()
+
+def _job_executor():
+    global _jobs
+    with _jobs_lock:
+        if _jobs is None:
+            from jobs import JobExecutor
+            _jobs = JobExecutor()
+        return _jobs
+
+def _job(key: tuple, func: Callable[..., Any], *args: Any) -> Any:
+    result = _job_executor().run(key, func, *args, wait=None)
+    if result is None:
+        raise ApiError(HTTPStatus.INTERNAL_SERVER_ERROR, "Computation failed.")
+    return result
+
+def _feasibility(req: Request, scale: float) -> List[Dict[str, Any]]:
+    from jobs import feasibility_job
+    return _job(("feasibility", req.pantry_id, req.version, scale), feasibility_job, req.pantry_id, scale)
+
+def _row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {"name": row["Name"], "need": row["Need"], "have": row["Have"], "unit": row["Unit"],
+            "missing": row["Missing"], "missing_cost": row.get("missing_cost")}
+
+def _encode(payload: Any) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+# Handlers
+
+def health(req: Request) -> Any:
+    return {"ok": DatabaseManager.ping()}
+
+def login(req: Request) -> Any:
+    body = req.body if isinstance(req.body, dict) else {}
+    username, password = body.get("username"), body.get("password")
+    if not isinstance(username, str) or not isinstance(password, str):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "username and password are required.")
+    if not login_limiter.allow(username):
+        raise ApiError(HTTPStatus.TOO_MANY_REQUESTS, "Too many attempts.")
+    user_id = DatabaseManager.verify_login(username, password)
+    if not user_id:
+        raise ApiError(HTTPStatus.UNAUTHORIZED, "Invalid username or password.")
+    login_limiter.reset(username)
+    return {"token": issue_session_token(user_id), "user_id": user_id, "pantry_id": DatabaseManager.pantry_of(user_id)}
+
+def get_inventory(req: Request) -> Any:
+    from snapshots import user_inventory
+    return [item.as_dict() for item in user_inventory(req.pantry_id, req.version)]
+
+def inventory_batch(req: Request) -> Any:
+    edits = req.field("edits")
+    try:
+        result = DatabaseManager.apply_inventory_edits(req.pantry_id, edits)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Bad edit: {e}")
+    return (HTTPStatus.CONFLICT if result["conflicts"] and not result["applied"] else HTTPStatus.OK), result
+
+def inventory_lots(req: Request) -> Any:
+    lots = req.field("lots")
+    try:
+        return {"added": DatabaseManager.add_inventory_lots(req.pantry_id, lots)}
+    except (KeyError, TypeError, ValueError) as e:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Bad lot: {e}")
+
+def inventory_receipt(req: Request) -> Any:
+    """Parse a pasted list or receipt and add every item as one batch (just parse with ``dry_run``)."""
+    from receipts import lots, pantry_catalog, parse_text
+    parsed, unparsed = parse_text(req.field("text", str), pantry_catalog(req.pantry_id))
+    added = 0
+    if parsed and not req.body.get("dry_run"):
+        added = DatabaseManager.add_inventory_lots(req.pantry_id, lots(parsed))
+    return {"added": added, "unparsed": unparsed,
+            "items": [{"name": l.name, "quantity": l.quantity, "unit": l.unit, "price": l.price,
+                       "matched": l.matched, "text": l.text} for l in parsed]}
+
+def get_recipes(req: Request) -> Any:
+    from snapshots import user_recipes
+    return [recipe.as_dict() for recipe in user_recipes(req.pantry_id, req.version)]
+
+def get_recipe(req: Request, recipe_id: str) -> Any:
+    recipes = DatabaseManager.get_recipes(req.pantry_id, [int(recipe_id)])
+    if not recipes:
+        raise ApiError(HTTPStatus.NOT_FOUND, "No such recipe.")
+    return recipes[0].as_dict()
+
+def recipes_batch(req: Request) -> Any:
+    recipes = req.field("recipes")
+    if not all(isinstance(r, dict) for r in recipes):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Every recipe must be a JSON object.")
+    return {"results": DatabaseManager.upsert_recipes(req.pantry_id, recipes,
+                                                      update_existing=bool(req.body.get("update_existing")))}
+
+def delete_recipe(req: Request, recipe_id: str) -> Any:
+    if not DatabaseManager.get_recipes(req.pantry_id, [int(recipe_id)]):
+        raise ApiError(HTTPStatus.NOT_FOUND, "No such recipe.")
+    if not DatabaseManager.delete_recipe(int(recipe_id), expected_version=req.arg("version", kind=int)):
+        raise ApiError(HTTPStatus.CONFLICT, "The recipe changed since that version.")
+    return {"deleted": int(recipe_id)}
+
+def feasibility(req: Request) -> Any:
+    return [{
+        "recipe_id": r["recipe"]["id"],
+        "title": r["recipe"]["title"],
+        "feasible": r["feasible"],
+        "portions": r["portions"],
+        "missing_count": r["missing_count"],
+        "cost": r["cost"],
+        "shopping_cost": r["shopping_cost"],
+        "unpriced": r["unpriced"],
+        "missing": [_row(m) for m in r["missing"]],
+        "matched": [_row(m) for m in r["matched"]],
+    } for r in _feasibility(req, req.arg("scale", 1.0, float))]
+
+def shopping_list(req: Request) -> Any:
+    """Missing ingredients of the chosen recipes (all infeasible ones if none chosen), combined."""
+    wanted = {int(i) for i in req.query.get("recipe_id", []) if i.isdigit()}
+    totals: Dict[tuple, List[Any]] = {}
+    for r in _feasibility(req, req.arg("scale", 1.0, float)):
+        if wanted and r["recipe"]["id"] not in wanted:
+            continue
+        for m in r["missing"]:
+            entry = totals.setdefault(m["key"], [m["Name"], m["Unit"], 0.0, 0.0])
+            entry[2] += m["missing_base"]
+            entry[3] = None if entry[3] is None or m["missing_cost"] is None else entry[3] + m["missing_cost"]
+    return [{"name": name, "quantity": round_for_unit(from_base(qty, key[1], unit), unit), "unit": unit, "cost": cost}
+            for key, (name, unit, qty, cost) in sorted(totals.items())]
+
+def week(req: Request) -> Any:
+    from jobs import cheapest_week_job
+    meals, scale = req.arg("meals", 7, int), req.arg("scale", 1.0, float)
+    if not 1 <= meals <= 21:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "meals must be between 1 and 21.")
+    plan = _job(("week", req.pantry_id, req.version, meals, scale), cheapest_week_job, req.pantry_id, meals, scale)
+    return {"plan": [{"recipe_id": p["recipe"]["id"], "title": p["recipe"]["title"], "portions": p["portions"],
+                      "shopping_cost": p["shopping_cost"], "unpriced": p["unpriced"]} for p in plan["plan"]],
+            "shopping": [{"name": i["Name"], "quantity": i["Quantity"], "unit": i["Unit"], "cost": i["cost"]}
+                         for i in plan["shopping"]],
+            "total": plan["total"], "unpriced": plan["unpriced"]}
+
+def export_recipes_csv(req: Request) -> Any:
+    from backup import iter_recipes_csv
+    from snapshots import user_recipes
+    chunks = (chunk.encode("utf-8") for chunk in iter_recipes_csv(user_recipes(req.pantry_id, req.version)))
+    return Stream(chunks, "text/csv; charset=utf-8", "recipes.csv")
+
+def export_backup(req: Request) -> Any:
+    from backup import export_user_data
+    blob = export_user_data(req.pantry_id)
+    return Stream((blob[i:i + 65536] for i in range(0, len(blob), 65536)), "application/octet-stream",
+                  "ruaden-backup.bin")
+
+# (method, path pattern, handler, needs a signed-in user, answers conditional GETs)
+ROUTES: List[Tuple[str, "re.Pattern[str]", Callable[..., Any], bool, bool]] = [
+    (method, re.compile(pattern), handler, auth, versioned)
+    for method, pattern, handler, auth, versioned in (
+        ("GET", r"/api/health", health, False, False),
+        ("POST", r"/api/login", login, False, False),
+        ("GET", r"/api/inventory", get_inventory, True, True),
+        ("POST", r"/api/inventory/batch", inventory_batch, True, False),
+        ("POST", r"/api/inventory/lots", inventory_lots, True, False),
+        ("POST", r"/api/inventory/receipt", inventory_receipt, True, False),
+        ("GET", r"/api/recipes", get_recipes, True, True),
+        ("GET", r"/api/recipes/(\d+)", get_recipe, True, True),
+        ("POST", r"/api/recipes/batch", recipes_batch, True, False),
+        ("DELETE", r"/api/recipes/(\d+)", delete_recipe, True, False),
+        ("GET", r"/api/feasibility", feasibility, True, True),
+        ("GET", r"/api/shopping-list", shopping_list, True, True),
+        ("GET", r"/api/week", week, True, True),
+        ("GET", r"/api/export/recipes\.csv", export_recipes_csv, True, True),
+        ("GET", r"/api/export/backup", export_backup, True, True),
+    )
+]
+
+# Encoded bodies of versioned GETs by (path, query, pantry, version): the same
+# answer is requested by every poller of a pantry until its data changes.
+_BODY_CACHE_SIZE = 128
+_bodies: "OrderedDict[tuple, bytes]" = OrderedDict()
+_bodies_lock = threading.Lock()
+
+def _cached_body(key: tuple) -> Optional[bytes]:
+    with _bodies_lock:
+        body = _bodies.get(key)
+        if body is not None:
+            _bodies.move_to_end(key)
+        return body
+
+def _cache_body(key: tuple, body: bytes) -> None:
+    with _bodies_lock:
+        _bodies[key] = body
+        while len(_bodies) > _BODY_CACHE_SIZE:
+            _bodies.popitem(last=False)
+
+def _etag(pantry_id: int, version: int) -> str:
+    return f'"{pantry_id}-{version}"'
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so a client's requests share one connection
+    server_version = "RuaDenAPI/1"
+    # Headers and body go out in separate writes; with Nagle on, keep-alive clients wait ~40 ms on each
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def do_DELETE(self) -> None:
+        self._dispatch("DELETE")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        try:
+            body = self._read_body()
+            matches = [(route, m) for route in ROUTES for m in [route[1].fullmatch(url.path)] if m]
+            if not matches:
+                raise ApiError(HTTPStatus.NOT_FOUND, "Not found.")
+            allowed = [(route, m) for route, m in matches if route[0] == method]
+            if not allowed:
+                raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed.")
+            (_, _, handler, auth, versioned), match = allowed[0]
+            user_id = pantry_id = version = None
+            if auth:
+                header = self.headers.get("Authorization", "")
+                user_id = verify_session_token(header[7:] if header.startswith("Bearer ") else None)
+                if not user_id:
+                    raise ApiError(HTTPStatus.UNAUTHORIZED, "Log in first (POST /api/login).")
+                # Read before the data, so an ETag never claims newer data than the body holds
+                pantry_id, version = DatabaseManager.pantry_version(user_id)
+            headers = {}
+            if versioned:
+                headers["ETag"] = _etag(pantry_id, version)
+                headers["Cache-Control"] = "private, no-cache"
+                if headers["ETag"] in (t.strip() for t in self.headers.get("If-None-Match", "").split(",")):
+                    self._send(HTTPStatus.NOT_MODIFIED, None, headers)
+                    return
+            cache_key = (url.path, url.query, pantry_id, version) if versioned else None
+            cached = cache_key and _cached_body(cache_key)
+            if cached:
+                self._send(HTTPStatus.OK, cached, headers)
+                return
+            result = handler(Request(method, url.path, parse_qs(url.query), body, user_id, pantry_id, version),
+                             *match.groups())
+            status = HTTPStatus.OK
+            if isinstance(result, tuple):
+                status, result = result
+            if cache_key and status == HTTPStatus.OK and not isinstance(result, Stream):
+                result = _encode(result)
+                _cache_body(cache_key, result)
+            self._send(status, result, headers)
+        except ApiError as e:
+            self._send(e.status, {"error": str(e)})
+        except Exception as e:
+            logger.exception(f"api: {method} {url.path} failed: {e}")
+            self._send(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal error."})
+
+    def _read_body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > API_MAX_BODY_BYTES:
+            self.close_connection = True
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Body over {API_MAX_BODY_BYTES} bytes.")
+        if not length:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON.")
+
+    def _send(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if isinstance(payload, Stream):
+            self.send_header("Content-Type", payload.content_type)
+            if payload.filename:
+                self.send_header("Content-Disposition", f'attachment; filename="{payload.filename}"')
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in payload.chunks:
+                if chunk:
+                    self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        data = payload if isinstance(payload, bytes) else b"" if payload is None else _encode(payload)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def make_server(host: str = API_HOST, port: int = API_PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    return server
+
+def start_in_background(host: str = API_HOST, port: int = API_PORT) -> ThreadingHTTPServer:
+    """Serve the API from a daemon thread of the current process (e.g. next to Streamlit)."""
+    server = make_server(host, port)
+    threading.Thread(target=server.serve_forever, name="api", daemon=True).start()
+    logger.info(f"api: serving on http://{server.server_address[0]}:{server.server_address[1]}")
+    return server
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rua Den JSON API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args()
+    from bootstrap import bootstrap
+    bootstrap(warm=False)
+    server = make_server(args.host, args.port)
+    logger.info(f"api: serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from database import DatabaseManager
+from config import DB_READ_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# sqlite3 releases the GIL while a query runs and DatabaseManager opens a fresh
+# connection per call, so reads offloaded to this pool genuinely overlap.
+_executor = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix="db-read")
+
+Call = Tuple[Callable[..., Any], ...]
+
+class AsyncDatabaseManager:
+    """Awaitable versions of the DatabaseManager reads used while rendering pages."""
+
+    @staticmethod
+    async def run(func: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args))
+
+    @staticmethod
+    async def ping() -> bool:
+        return await AsyncDatabaseManager.run(DatabaseManager.ping)
+
+    @staticmethod
+    async def validate_user_id(user_id: int) -> bool:
+        return await AsyncDatabaseManager.run(DatabaseManager.validate_user_id, user_id)
+
+    @staticmethod
+    async def list_inventory(user_id: int) -> List[Dict[str, Any]]:
+        return await AsyncDatabaseManager.run(DatabaseManager.list_inventory, user_id)
+
+    @staticmethod
+    async def list_recipes(user_id: int) -> List[Dict[str, Any]]:
+        return await AsyncDatabaseManager.run(DatabaseManager.list_recipes, user_id)
+
+    @staticmethod
+    async def gather(calls: Dict[str, Call], return_exceptions: bool = False) -> Dict[str, Any]:
+        """Run every ``name -> (func, *args)`` call concurrently and return results by name."""
+        names = list(calls)
+        results = await asyncio.gather(
+            *(AsyncDatabaseManager.run(call[0], *call[1:]) for call in calls.values()),
+            return_exceptions=return_exceptions,
+        )
+        return dict(zip(names, results))
+
+def fetch_all(calls: Dict[str, Call], return_exceptions: bool = False) -> Dict[str, Any]:
+    """Synchronous counterpart of ``AsyncDatabaseManager.gather`` for Streamlit code.
+
+    The calls are submitted to the shared pool together, so the wall-clock cost is
+    close to the slowest one. Without ``return_exceptions`` the first failure is
+    re-raised once every call has finished.
+    """
+    if len(calls) == 1:
+        name, call = next(iter(calls.items()))
+        try:
+            return {name: call[0](*call[1:])}
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return {name: e}
+    futures = {name: _executor.submit(call[0], *call[1:]) for name, call in calls.items()}
+    results: Dict[str, Any] = {}
+    error: Optional[BaseException] = None
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            logger.error(f"fetch_all: '{name}' failed: {e}")
+            results[name] = e
+            error = error or e
+    if error is not None and not return_exceptions:
+        raise error
+    return results
@@ -0,0 +1,271 @@
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import struct
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+from config import DB_NAME, DB_BUSY_TIMEOUT_SECONDS
+from database import DatabaseManager, TRACKED_TABLES, retry_on_locked
+
+logger = logging.getLogger(__name__)
+
+# Container for exports and deltas: magic, format version, kind, CRC32 of the
+# compressed payload, then zlib-compressed JSON.
+MAGIC = b"RUADEN"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<6sBBI")
+KIND_USER_EXPORT = 1
+KIND_DELTA = 2
+
+def _pack(kind: int, payload: Dict[str, Any]) -> bytes:
+    body = zlib.compress(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 9)
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, kind, zlib.crc32(body)) + body
+
+def _unpack(blob: bytes, kind: int) -> Dict[str, Any]:
+    if len(blob) < _HEADER.size:
+        raise ValueError("Backup data is truncated.")
+    magic, version, blob_kind, crc = _HEADER.unpack_from(blob)
+    body = blob[_HEADER.size:]
+    if magic != MAGIC:
+        raise ValueError("Not a Rua Den backup.")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Backup format v{version} is newer than supported v{FORMAT_VERSION}.")
+    if blob_kind != kind:
+        raise ValueError("Backup is of the wrong kind.")
+    if zlib.crc32(body) != crc:
+        raise ValueError("Backup data is corrupted.")
+    return json.loads(zlib.decompress(body).decode("utf-8"))
+
+def _current_seq(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+def snapshot_database(dest_path: str, pages: int = 4096, source_path: str = DB_NAME) -> Dict[str, Any]:
+    """Copy the whole database with SQLite's online backup API.
+
+    The copy proceeds ``pages`` at a time, releasing the source lock between
+    steps so writers are not blocked for the duration. Returns the change-log
+    sequence the snapshot is consistent with, for later incremental backups.
+    """
+    start = time.perf_counter()
+    src = sqlite3.connect(source_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=pages)
+        seq = _current_seq(dst)
+    finally:
+        dst.close()
+        src.close()
+    report = {"path": dest_path, "seq": seq, "bytes": os.path.getsize(dest_path),
+              "seconds": time.perf_counter() - start}
+    logger.info(f"snapshot_database: {report}")
+    return report
+
+def vacuum_into(dest_path: str, source_path: str = DB_NAME) -> Dict[str, Any]:
+    """Write a compacted copy of the database (no free pages) with ``VACUUM INTO``."""
+    start = time.perf_counter()
+    conn = sqlite3.connect(source_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        conn.execute("VACUUM INTO ?", (dest_path,))
+    finally:
+        conn.close()
+    dst = sqlite3.connect(dest_path)
+    try:
+        seq = _current_seq(dst)
+    finally:
+        dst.close()
+    report = {"path": dest_path, "seq": seq, "bytes": os.path.getsize(dest_path),
+              "seconds": time.perf_counter() - start}
+    logger.info(f"vacuum_into: {report}")
+    return report
+
+def incremental_backup(dest_path: str, since_seq: int, source_path: str = DB_NAME) -> Dict[str, Any]:
+    """Write a delta with the current state of every row changed after ``since_seq``.
+
+    Rows changed several times are stored once; deleted rows become tombstones.
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(source_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    conn.row_factory = sqlite3.Row
+    try:
+        # One read transaction so the delta and its sequence number agree
+        conn.execute("BEGIN")
+        seq = _current_seq(conn)
+        tables: Dict[str, Dict[str, Any]] = {}
+        for table in TRACKED_TABLES:
+            ids = [r[0] for r in conn.execute(
+                "SELECT DISTINCT row_id FROM change_log WHERE entity = ? AND seq > ? AND seq <= ?",
+                (table, since_seq, seq))]
+            if not ids:
+                continue
+            rows, seen = [], set()
+            for chunk_start in range(0, len(ids), 500):
+                chunk = ids[chunk_start:chunk_start + 500]
+                marks = ",".join("?" * len(chunk))
+                for row in conn.execute(f"SELECT * FROM {table} WHERE id IN ({marks})", chunk):
+                    rows.append(dict(row))
+                    seen.add(row["id"])
+            tables[table] = {"rows": rows, "deleted": [i for i in ids if i not in seen]}
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    blob = _pack(KIND_DELTA, {"from_seq": since_seq, "to_seq": seq, "tables": tables})
+    with open(dest_path, "wb") as f:
+        f.write(blob)
+    report = {"path": dest_path, "from_seq": since_seq, "seq": seq, "bytes": len(blob),
+              "rows": sum(len(t["rows"]) + len(t["deleted"]) for t in tables.values()),
+              "seconds": time.perf_counter() - start}
+    logger.info(f"incremental_backup: {report}")
+    return report
+
+def _apply_delta(conn: sqlite3.Connection, delta: Dict[str, Any]) -> int:
+    applied = 0
+    DatabaseManager._begin_batch(conn.cursor(), None, "restore")
+    # Parents before children on upsert, children before parents on delete
+    order = list(TRACKED_TABLES)
+    for table in order:
+        data = delta["tables"].get(table)
+        if not data:
+            continue
+        for row in data["rows"]:
+            cols = list(row)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                [row[c] for c in cols])
+        applied += len(data["rows"])
+    for table in reversed(order):
+        data = delta["tables"].get(table)
+        if data and data["deleted"]:
+            conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(i,) for i in data["deleted"]])
+            applied += len(data["deleted"])
+    # Replayed lots also fire the rollup triggers, so recompute the affected totals
+    touched = {r["id"] for r in delta["tables"].get("inventory", {}).get("rows", [])}
+    touched.update(r["inventory_id"] for r in delta["tables"].get("inventory_lots", {}).get("rows", []))
+    if touched:
+        DatabaseManager.rebuild_inventory_rollup(conn.cursor(), sorted(touched))
+    return applied
+
+def restore_database(snapshot_path: str, deltas: Optional[List[str]] = None, target_path: str = DB_NAME,
+                     pages: int = -1) -> Dict[str, Any]:
+    """Restore ``target_path`` from a snapshot, then replay incremental deltas in order.
+
+    Returns timings for the copy and replay phases so cold-start cost can be tracked.
+    """
+    start = time.perf_counter()
+    src = sqlite3.connect(snapshot_path)
+    dst = sqlite3.connect(target_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        src.backup(dst, pages=pages)
+        copied = time.perf_counter()
+        seq = _current_seq(dst)
+        replayed = 0
+        for path in deltas or []:
+            with open(path, "rb") as f:
+                delta = _unpack(f.read(), KIND_DELTA)
+            if delta["from_seq"] > seq:
+                raise ValueError(f"Delta {path} starts at seq {delta['from_seq']}, database is at {seq}.")
+            with dst:
+                replayed += _apply_delta(dst, delta)
+            seq = max(seq, delta["to_seq"])
+    finally:
+        dst.close()
+        src.close()
+    end = time.perf_counter()
+    report = {"target": target_path, "bytes": os.path.getsize(target_path), "seq": seq,
+              "rows_replayed": replayed, "copy_seconds": copied - start,
+              "replay_seconds": end - copied, "seconds": end - start}
+    logger.info(f"restore_database: {report}")
+    return report
+
+def export_user_data(user_id: int) -> bytes:
+    """Serialize one user's recipes and inventory (no credentials) to the backup format."""
+    recipes = DatabaseManager.list_recipes(user_id)
+    inventory = DatabaseManager.list_inventory(user_id)
+    payload = {
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "recipes": [
+            {k: v for k, v in r.as_dict().items() if k != "id"} for r in recipes
+        ],
+        "inventory": [
+            {k: v for k, v in i.as_dict().items() if k != "id"} for i in inventory
+        ],
+    }
+    return _pack(KIND_USER_EXPORT, payload)
+
+@retry_on_locked
+def import_user_data(user_id: int, blob: bytes, replace: bool = False) -> Dict[str, int]:
+    """Load an ``export_user_data`` blob into ``user_id``'s account in one transaction.
+
+    With ``replace`` the user's existing recipes and inventory are removed first;
+    otherwise recipes whose title already exists are skipped and inventory
+    quantities are added to matching rows.
+    """
+    payload = _unpack(blob, KIND_USER_EXPORT)
+    counts = {"recipes": 0, "skipped_recipes": 0, "inventory": 0}
+    with DatabaseManager.get_db_conn(write=True) as conn:
+        cur = conn.cursor()
+        DatabaseManager._begin_batch(cur, user_id, "import")
+        if replace:
+            cur.execute("DELETE FROM ingredients WHERE recipe_id IN (SELECT id FROM recipes WHERE user_id = ?)", (user_id,))
+            cur.execute("DELETE FROM recipes WHERE user_id = ?", (user_id,))
+            cur.execute("DELETE FROM inventory WHERE user_id = ?", (user_id,))
+        # Exported sub-recipe ids are meaningless here: save plain lines, then relink by title
+        recipes = [dict(r, ingredients=[{k: v for k, v in i.items() if k != "sub_recipe_id"}
+                                        for i in r.get("ingredients", [])])
+                   for r in payload.get("recipes", [])]
+        outcomes = DatabaseManager._upsert_recipes(cur, user_id, recipes, update_existing=False)
+        sub_links = []
+        for recipe, outcome in zip(payload.get("recipes", []), outcomes):
+            if outcome["status"] != "created":
+                counts["skipped_recipes"] += 1
+                continue
+            counts["recipes"] += 1
+            sub_links.extend((outcome["id"], i["name"]) for i in recipe.get("ingredients", []) if i.get("sub_recipe_id"))
+        if sub_links:
+            title_ids = dict(cur.execute("SELECT title_key, id FROM recipes WHERE user_id = ?", (user_id,)))
+            cur.executemany("UPDATE ingredients SET sub_recipe_id = ? WHERE recipe_id = ? AND name = ?",
+                            [(title_ids[DatabaseManager.normalize_name(name)], recipe_id, name)
+                             for recipe_id, name in sub_links if DatabaseManager.normalize_name(name) in title_ids])
+        for item in payload.get("inventory", []):
+            DatabaseManager._add_lot_by_name(cur, user_id, item["name"], item["quantity"], item["unit"],
+                                             item.get("next_expires_at"))
+            counts["inventory"] += 1
+        conn.commit()
+    logger.info(f"import_user_data: user_id={user_id} {counts}")
+    return counts
+
+def recipes_to_csv(recipes: List[Dict[str, Any]]) -> str:
+    """All recipes with one row per ingredient, sorted by title, blank line between recipes."""
+    return "".join(iter_recipes_csv(recipes))
+
+def iter_recipes_csv(recipes: List[Dict[str, Any]], chunk_rows: int = 500) -> Iterator[str]:
+    """``recipes_to_csv`` in pieces of about ``chunk_rows`` rows, for streaming responses."""
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(["Recipe ID", "Title", "Category", "Instructions", "Ingredient Name", "Quantity", "Unit"])
+    rows = 1
+    for r in sorted(recipes, key=lambda x: x["title"].lower()):
+        for ing in r["ingredients"]:
+            writer.writerow([
+                r["id"],
+                r["title"],
+                r["category"] or "",
+                r["instructions"] or "",
+                ing["name"],
+                ing["quantity"],
+                ing["unit"]
+            ])
+        if r["ingredients"]:
+            writer.writerow([])
+        rows += len(r["ingredients"]) + 1
+        if rows >= chunk_rows:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+            rows = 0
+    if output.tell():
+        yield output.getvalue()
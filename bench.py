@@ -0,0 +1,438 @@
+"""Local benchmarks for Rua Den.
+
+Usage: python bench.py <benchmark> [options]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+def bench_hash(args):
+    from security import benchmark_scrypt
+    from config import SCRYPT_N, SCRYPT_R, SCRYPT_P
+    params = [(2 ** exp, 8, 1) for exp in range(12, 18)]
+    if (SCRYPT_N, SCRYPT_R, SCRYPT_P) not in params:
+        params.append((SCRYPT_N, SCRYPT_R, SCRYPT_P))
+    print(f"{'n':>8} {'r':>3} {'p':>3} {'mem MB':>8} {'median ms':>10} {'max ms':>8}")
+    for row in benchmark_scrypt(params, rounds=args.rounds):
+        marker = "  <- configured" if (row["n"], row["r"], row["p"]) == (SCRYPT_N, SCRYPT_R, SCRYPT_P) else ""
+        print(f"{row['n']:>8} {row['r']:>3} {row['p']:>3} {row['memory_mb']:>8.1f} "
+              f"{row['median_ms']:>10.1f} {row['max_ms']:>8.1f}{marker}")
+
+def _schema_copy(path):
+    """Create an empty database at ``path`` with the application schema."""
+    from database import DatabaseManager
+    from config import DB_NAME
+    DatabaseManager.init_db()
+    src = sqlite3.connect(DB_NAME)
+    statements = [r[0] for r in src.execute(
+        "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END")]
+    src.close()
+    dst = sqlite3.connect(path)
+    for sql in statements:
+        dst.execute(sql)
+    dst.commit()
+    return dst
+
+def _conn_path(conn):
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+def _fill(conn, target_bytes, user_id=1):
+    rng = random.Random(42)
+    words = ["ga", "bo", "heo", "tom", "ca", "rau", "hanh", "toi", "ot", "gung", "nuoc mam", "duong"]
+    batch = 0
+    while os.path.getsize(_conn_path(conn)) < target_bytes:
+        rows = []
+        for _ in range(2000):
+            cur = conn.execute("INSERT INTO recipes (user_id, title, category, instructions) VALUES (?, ?, ?, ?)",
+                               (user_id, f"recipe {batch}-{rng.random():.8f}", "Main", "x" * 400))
+            rows.extend((cur.lastrowid, rng.choice(words), rng.uniform(1, 500), "g") for _ in range(8))
+        conn.executemany("INSERT INTO ingredients (recipe_id, name, quantity, unit) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+        batch += 1
+
+def bench_restore(args):
+    from backup import snapshot_database, incremental_backup, restore_database
+    with tempfile.TemporaryDirectory() as tmp:
+        live = os.path.join(tmp, "live.db")
+        conn = _schema_copy(live)
+        start = time.perf_counter()
+        _fill(conn, args.size_mb * 1024 * 1024)
+        print(f"built {os.path.getsize(live) / 1e6:.1f} MB database in {time.perf_counter() - start:.1f}s")
+        snap = snapshot_database(os.path.join(tmp, "base.db"), source_path=live)
+        print(f"snapshot: {snap['seconds']:.2f}s")
+        conn.execute("UPDATE ingredients SET quantity = quantity + 1 WHERE id % 100 = 0")
+        conn.execute("DELETE FROM recipes WHERE id % 97 = 0")
+        conn.commit()
+        conn.close()
+        delta = incremental_backup(os.path.join(tmp, "delta.rdb"), snap["seq"], source_path=live)
+        print(f"incremental: {delta['rows']} rows, {delta['bytes'] / 1e3:.1f} kB in {delta['seconds']:.2f}s")
+        report = restore_database(snap["path"], [delta["path"]], target_path=os.path.join(tmp, "restored.db"))
+        print(f"restore: copy {report['copy_seconds']:.2f}s + replay {report['replay_seconds']:.2f}s "
+              f"= {report['seconds']:.2f}s for {report['bytes'] / 1e6:.1f} MB")
+
+def _synthetic_recipes(count, seed=7):
+    rng = random.Random(seed)
+    words = ["ga", "bo", "heo", "tom", "ca", "rau", "hanh", "toi", "ot", "gung", "nuoc mam", "duong"]
+    return [{"title": f"Recipe {i:05d}", "category": "Main", "instructions": "x" * 200, "servings": 2,
+             "ingredients": [{"name": w, "quantity": round(rng.uniform(1, 500), 1), "unit": "g"}
+                             for w in rng.sample(words, 8)]}
+            for i in range(count)]
+
+def bench_recipes(args):
+    """Batch recipe saves and imports, against saving recipes one at a time."""
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SQLITE_DB_PATH"] = os.path.join(tmp, "recipes.db")
+        from database import DatabaseManager
+        from backup import export_user_data, import_user_data
+        DatabaseManager.init_db()
+        users = []
+        for name in ("batch", "single", "import"):
+            DatabaseManager.create_user(name, "bench-password", "q", "a")
+            users.append(DatabaseManager.verify_login(name, "bench-password"))
+        batch_user, single_user, import_user = users
+        recipes = _synthetic_recipes(args.count)
+
+        start = time.perf_counter()
+        outcomes = DatabaseManager.upsert_recipes(batch_user, recipes)
+        elapsed = time.perf_counter() - start
+        created = sum(o["status"] == "created" for o in outcomes)
+        print(f"upsert_recipes        {args.count} recipes: {elapsed * 1000:8.1f} ms ({created} created)")
+
+        start = time.perf_counter()
+        outcomes = DatabaseManager.upsert_recipes(batch_user, recipes)
+        duplicates = sum(o["status"] == "duplicate" for o in outcomes)
+        print(f"upsert_recipes again  {args.count} recipes: {(time.perf_counter() - start) * 1000:8.1f} ms "
+              f"({duplicates} duplicates)")
+
+        start = time.perf_counter()
+        DatabaseManager.upsert_recipes(batch_user, recipes, update_existing=True)
+        print(f"upsert_recipes update {args.count} recipes: {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+        start = time.perf_counter()
+        for r in recipes:
+            DatabaseManager.create_recipe_from_table(single_user, r["title"], r["category"], r["instructions"],
+                                                     r["ingredients"], servings=r["servings"])
+        print(f"one at a time         {args.count} recipes: {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+        blob = export_user_data(batch_user)
+        start = time.perf_counter()
+        counts = import_user_data(import_user, blob)
+        print(f"import_user_data      {counts['recipes']} recipes: {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+def bench_memory(args):
+    """Per-session memory for recipes and inventory: private dict lists against shared snapshots."""
+    import gc
+    import tracemalloc
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SQLITE_DB_PATH"] = os.path.join(tmp, "memory.db")
+        from database import DatabaseManager
+        from snapshots import user_inventory, user_recipes, view
+        DatabaseManager.init_db()
+        DatabaseManager.create_user("memory", "bench-password", "q", "a")
+        user_id = DatabaseManager.verify_login("memory", "bench-password")
+        DatabaseManager.upsert_recipes(user_id, _synthetic_recipes(args.recipes))
+        for i in range(args.inventory):
+            DatabaseManager.upsert_inventory(user_id, f"item {i}", 1.0 + i, "g")
+        version = DatabaseManager.data_version(user_id)
+
+        def editor_rows(inventory):
+            return [{"Name": r["name"], "Quantity": r["quantity"], "Unit": r["unit"],
+                     "Expires": r.get("next_expires_at") or ""} for r in inventory]
+
+        def measure(make_session):
+            gc.collect()
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            first = make_session()
+            one = tracemalloc.get_traced_memory()[0] - base
+            rest = [make_session() for _ in range(args.sessions - 1)]
+            total = tracemalloc.get_traced_memory()[0] - base
+            tracemalloc.stop()
+            del first, rest
+            return one, total
+
+        def dict_session():
+            # As before: each session kept its own dict rows, plus editor rows built per render
+            recipes = [r.as_dict() for r in DatabaseManager.list_recipes(user_id)]
+            inventory = [i.as_dict() for i in DatabaseManager.list_inventory(user_id)]
+            return recipes, inventory, editor_rows(inventory)
+
+        def shared_session():
+            inventory = user_inventory(user_id, version)
+            return (user_recipes(user_id, version), inventory,
+                    view(inventory, "editor_rows", lambda: editor_rows(inventory)))
+
+        print(f"{args.recipes} recipes x 8 ingredients, {args.inventory} inventory rows, {args.sessions} sessions")
+        for label, make_session in (("dict rows", dict_session), ("shared snapshots", shared_session)):
+            one, total = measure(make_session)
+            extra = (total - one) / max(args.sessions - 1, 1)
+            print(f"{label:<17} first session {one / 1e6:7.2f} MB  each further session {extra / 1e3:9.1f} kB  "
+                  f"total {total / 1e6:7.2f} MB")
+
+def bench_nutrition(args):
+    """Cookbook nutrition cold, warm, after one recipe edit and after one nutrient-table edit."""
+    import csv
+    import metrics
+    from nutrition import cookbook_nutrition, reload_table
+    from config import NUTRITION_CSV
+    recipes = [dict(r, id=i, version=1) for i, r in enumerate(_synthetic_recipes(args.recipes), 1)]
+
+    def run(label):
+        before = metrics.snapshot()
+        start = time.perf_counter()
+        cookbook_nutrition(recipes)
+        elapsed = time.perf_counter() - start
+        computed = metrics.delta(before, metrics.snapshot()).get("nutrition.recipes", 0)
+        print(f"{label:<22} {elapsed * 1000:8.1f} ms  {computed:6d} recipes computed")
+
+    print(f"{args.recipes} recipes x 8 ingredients")
+    run("cold")
+    run("unchanged")
+    recipes[0] = dict(recipes[0], version=2, ingredients=recipes[0]["ingredients"][1:])
+    run("one recipe edited")
+    with open(NUTRITION_CSV, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        if row["name"] == args.ingredient:
+            row["kcal"] = str(float(row["kcal"]) + 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "nutrition.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        invalidated = reload_table(path)
+    print(f"table edit ({args.ingredient}): {invalidated} recipes invalidated")
+    run("after table edit")
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Receipt lines with the (name, quantity, unit, price) they must parse to, None if unparseable.
+# Names are resolved against a catalog of RECEIPT_PANTRY plus the nutrient table.
+RECEIPT_PANTRY = ["Gạo", "nước mắm", "Trứng gà", "chicken", "hành lá"]
+RECEIPT_CORPUS = [
+    ("2kg gạo", ("Gạo", 2.0, "kg", None)),
+    ("3 chén nước mắm", ("nước mắm", 3.0, "chén", None)),
+    ("6 trứng", ("Trứng gà", 6.0, "piece", None)),
+    ("Gạo ST25 2 x 5kg 250.000đ", ("Gạo", 10.0, "kg", 250000.0)),
+    ("- 1,5 kg ga 120k", ("chicken", 1.5, "kg", 120000.0)),
+    ("nuoc mam 500ml $3.50", ("nước mắm", 500.0, "ml", 3.5)),
+    ("1/2 cup sugar", ("sugar", 0.5, "cup", None)),
+    ("0.250 kg tom", ("tom", 0.25, "kg", None)),
+    ("muối 1 cai", ("muối", 1.0, "cai", None)),
+    ("2 lạng thịt bò 80.000 VND", ("thịt bò", 2.0, "lạng", 80000.0)),
+    ("hanh la 1 bó", None),
+    ("1 bó hành lá", ("bó hành lá", 1.0, "piece", None)),
+    ("3 tbsp of olive oil", ("olive oil", 3.0, "tbsp", None)),
+    ("TOTAL 120.000đ", None),
+    ("Cảm ơn quý khách", None),
+    ("2kg", None),
+    ("3 x 1/0 kg toi", None),
+]
+
+def bench_receipts(args):
+    """Receipt parser: corpus check, then lines per second with and without catalog lookups."""
+    from nutrition import table
+    from receipts import Catalog, parse_line, parse_text
+    current = table()
+    aliases = dict(current.aliases)
+    aliases.update((name, name) for name, _ in current.per_base)
+    catalog = Catalog(RECEIPT_PANTRY, aliases)
+    failures = 0
+    for text, expected in RECEIPT_CORPUS:
+        line = parse_line(text, catalog)
+        got = line and (line.name, line.quantity, line.unit, line.price)
+        if got != expected:
+            failures += 1
+            print(f"MISMATCH {text!r}: got {got}, expected {expected}")
+    print(f"corpus: {len(RECEIPT_CORPUS) - failures}/{len(RECEIPT_CORPUS)} lines as expected")
+
+    lines = [text for text, _ in RECEIPT_CORPUS] * (args.lines // len(RECEIPT_CORPUS) + 1)
+    text = "\n".join(lines[:args.lines])
+    for label, cat in (("no catalog", None), ("with catalog", catalog)):
+        samples = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            parsed, unparsed = parse_text(text, cat)
+            samples.append(time.perf_counter() - start)
+        best = min(samples)
+        print(f"{label:<13} {args.lines} lines: {best * 1000:8.1f} ms  {args.lines / best:10.0f} lines/s  "
+              f"({len(parsed)} parsed, {len(unparsed)} skipped)")
+    if failures:
+        sys.exit(1)
+
+def bench_api(args):
+    """Concurrent clients against the JSON API: conditional GETs, full GETs and batch writes."""
+    import http.client
+    import threading
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SQLITE_DB_PATH"] = os.path.join(tmp, "api.db")
+        from database import DatabaseManager
+        from api import make_server
+        DatabaseManager.init_db()
+        DatabaseManager.create_user("api", "bench-password", "q", "a")
+        user_id = DatabaseManager.verify_login("api", "bench-password")
+        DatabaseManager.upsert_recipes(user_id, _synthetic_recipes(args.recipes))
+        DatabaseManager.add_inventory_lots(user_id, [{"name": w, "quantity": 1000, "unit": "g"}
+                                                     for w in ("ga", "bo", "heo", "tom", "rau", "hanh")])
+        server = make_server("127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+
+        def call(conn, method, path, body=None, headers=None):
+            data = json.dumps(body).encode("utf-8") if body is not None else None
+            start = time.perf_counter()
+            conn.request(method, path, body=data, headers=headers or {})
+            response = conn.getresponse()
+            payload = response.read()
+            return time.perf_counter() - start, response, payload
+
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        _, _, payload = call(conn, "POST", "/api/login", {"username": "api", "password": "bench-password"})
+        auth = {"Authorization": f"Bearer {json.loads(payload)['token']}"}
+        _, response, _ = call(conn, "GET", "/api/feasibility", headers=auth)
+        etag = response.getheader("ETag")
+        conn.close()
+
+        def scenario(label, method, path, body=None, extra=None):
+            latencies, statuses, lock = [], {}, threading.Lock()
+
+            def client():
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+                mine, seen = [], {}
+                for _ in range(args.requests):
+                    elapsed, response, _ = call(conn, method, path, body, dict(auth, **(extra or {})))
+                    mine.append(elapsed)
+                    seen[response.status] = seen.get(response.status, 0) + 1
+                conn.close()
+                with lock:
+                    latencies.extend(mine)
+                    for status, n in seen.items():
+                        statuses[status] = statuses.get(status, 0) + n
+
+            threads = [threading.Thread(target=client) for _ in range(args.clients)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+            print(f"{label:<22} {len(latencies) / elapsed:8.0f} req/s  p50 {latencies[len(latencies) // 2] * 1000:7.2f} ms  "
+                  f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.2f} ms  {statuses}")
+
+        print(f"{args.recipes} recipes, {args.clients} clients x {args.requests} requests")
+        scenario("feasibility 304", "GET", "/api/feasibility", extra={"If-None-Match": etag})
+        scenario("feasibility 200", "GET", "/api/feasibility")
+        scenario("inventory 200", "GET", "/api/inventory")
+        scenario("inventory lots", "POST", "/api/inventory/lots",
+                 {"lots": [{"name": "rau", "quantity": 100, "unit": "g", "price": 2.5}]})
+        scenario("feasibility after", "GET", "/api/feasibility")
+        server.shutdown()
+        server.server_close()
+
+def _python(code, env, *flags):
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=_HERE, env=env,
+                          capture_output=True, text=True, check=True)
+
+def bench_startup(args):
+    """Cold-start cost in fresh interpreters, and per-rerun cost of main.py."""
+    try:
+        import streamlit  # noqa: F401
+        entry = "ui"
+    except ImportError:
+        print("streamlit is not installed: timing the modules below ui and skipping reruns")
+        entry = "jobs"
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SQLITE_DB_PATH=os.path.join(tmp, "startup.db"), LOG_LEVEL="WARNING")
+        for module in ("database", entry):
+            code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+            samples = [float(_python(code, env).stdout) * 1000 for _ in range(args.rounds)]
+            print(f"import {module:<10} median {statistics.median(samples):7.1f} ms  max {max(samples):7.1f} ms")
+        code = "import json; from bootstrap import bootstrap; print(json.dumps(bootstrap(warm=False)))"
+        first = json.loads(_python(code, env).stdout)
+        again = json.loads(_python(code, env).stdout)
+        print(f"bootstrap   new db {first['total_ms']:7.1f} ms  existing db {again['total_ms']:7.1f} ms")
+        # Largest self-time imports, the candidates for lazy loading
+        lines = _python(f"import {entry}", env, "-X", "importtime").stderr.splitlines()
+        rows = []
+        for line in lines[1:]:
+            parts = line.split("|")
+            if len(parts) == 3:
+                rows.append((int(parts[0].split(":")[1]), int(parts[1]), parts[2].strip()))
+        print(f"{'self ms':>8} {'cumul ms':>9}  module")
+        for self_us, cumulative_us, name in sorted(rows, reverse=True)[:args.top]:
+            print(f"{self_us / 1000:>8.1f} {cumulative_us / 1000:>9.1f}  {name}")
+        if entry == "ui":
+            os.environ.update(env)
+            from streamlit.testing.v1 import AppTest
+            app = AppTest.from_file(os.path.join(_HERE, "main.py"), default_timeout=30)
+            start = time.perf_counter()
+            app.run()
+            print(f"first run   {(time.perf_counter() - start) * 1000:7.1f} ms")
+            samples = []
+            for _ in range(args.reruns):
+                start = time.perf_counter()
+                app.run()
+                samples.append((time.perf_counter() - start) * 1000)
+            print(f"rerun       median {statistics.median(samples):7.1f} ms  max {max(samples):7.1f} ms")
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Rua Den benchmarks")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = sub.add_parser("hash", help="scrypt cost per login for candidate parameters")
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=bench_hash)
+
+    p = sub.add_parser("restore", help="snapshot, incremental backup and restore of a synthetic database")
+    p.add_argument("--size-mb", type=int, default=100, help="database size to build (1024 for the 1 GB target)")
+    p.set_defaults(func=bench_restore)
+
+    p = sub.add_parser("recipes", help="batch recipe upsert and import against single saves")
+    p.add_argument("--count", type=int, default=1000)
+    p.set_defaults(func=bench_recipes)
+
+    p = sub.add_parser("memory", help="per-session footprint of recipes and inventory")
+    p.add_argument("--recipes", type=int, default=1000)
+    p.add_argument("--inventory", type=int, default=300)
+    p.add_argument("--sessions", type=int, default=20)
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser("nutrition", help="cookbook nutrition and what an edit recomputes")
+    p.add_argument("--recipes", type=int, default=5000)
+    p.add_argument("--ingredient", default="chicken", help="nutrient-table entry to edit")
+    p.set_defaults(func=bench_nutrition)
+
+    p = sub.add_parser("receipts", help="receipt parser corpus check and lines per second")
+    p.add_argument("--lines", type=int, default=10000)
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=bench_receipts)
+
+    p = sub.add_parser("api", help="JSON API throughput and latency under concurrent clients")
+    p.add_argument("--recipes", type=int, default=500)
+    p.add_argument("--clients", type=int, default=8)
+    p.add_argument("--requests", type=int, default=200, help="requests per client per scenario")
+    p.set_defaults(func=bench_api)
+
+    p = sub.add_parser("startup", help="cold import, bootstrap and per-rerun time")
+    p.add_argument("--rounds", type=int, default=5, help="fresh interpreters per import timing")
+    p.add_argument("--reruns", type=int, default=20, help="main.py reruns to time (needs streamlit)")
+    p.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    p.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
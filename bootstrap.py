@@ -0,0 +1,50 @@
+"""One-time process start-up: logging, schema, and warm caches.
+
+The app runs ``bootstrap()`` through ``st.cache_resource`` so it happens once
+per process instead of on every rerun. Other entry points can call it directly.
+"""
+import logging
+import threading
+import time
+from typing import Dict
+from config import LOG_LEVEL
+
+logger = logging.getLogger(__name__)
+
+# Loaded in the background so the login screen does not wait on them
+WARM_MODULES = ("business_logic", "backup", "recommend", "snapshots", "jobs", "nutrition", "forecast")
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+    logging.basicConfig(level=getattr(logging, level.upper(), logging.INFO))
+
+def _warm() -> None:
+    start = time.perf_counter()
+    for name in WARM_MODULES:
+        __import__(name)
+    # The first login attempt for an unknown username would otherwise pay for this hash
+    from security import dummy_hash
+    dummy_hash()
+    from nutrition import table
+    table()
+    logger.info(f"bootstrap: warmed caches in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+def bootstrap(warm: bool = True, maintain: bool = True) -> Dict[str, float]:
+    """Configure logging, create or migrate the schema, start warming caches and
+    (with ``maintain``) the idle-time database maintenance scheduler.
+
+    Returns the duration of each synchronous step in milliseconds.
+    """
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    configure_logging()
+    from database import DatabaseManager
+    DatabaseManager.init_db()
+    timings["schema_ms"] = (time.perf_counter() - start) * 1000
+    if warm:
+        threading.Thread(target=_warm, name="bootstrap-warm", daemon=True).start()
+    if maintain:
+        from maintenance import start_scheduler
+        start_scheduler()
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    logger.info(f"bootstrap: {timings}")
+    return timings
@@ -1,7 +1,11 @@
 import logging
-from typing import Dict, List, Tuple, Optional
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Tuple, Optional
 from database import DatabaseManager
-from utils import to_base, from_base, same_dimension, fmt_qty
+from utils import to_base, from_base, same_dimension, fmt_qty, normalize_unit, round_for_unit
+from config import EXPIRY_SOON_DAYS, RECIPE_VECTOR_CACHE
 
 logger = logging.getLogger(__name__)
 
@@ -11,14 +15,264 @@ def inventory_as_base(user_id: Optional[int]) -> Dict[Tuple[str, str], float]:
         return {}
     inv = DatabaseManager.list_inventory(user_id)
     logger.info(f"inventory_as_base: Retrieved {len(inv)} inventory items for user_id={user_id}")
+    return inventory_base_map(inv)
+
+def inventory_base_map(inventory: List[Dict]) -> Dict[Tuple[str, str], float]:
+    """Aggregate already-loaded inventory rows to base units keyed by (normalized name, base unit)."""
     agg: Dict[Tuple[str, str], float] = {}
-    for row in inv:
-        key = (DatabaseManager.normalize_name(row["name"]), row["base_unit"])
-        agg[key] = agg.get(key, 0.0) + row["base_qty"]
-        logger.debug(f"inventory_as_base: {row['name']} -> {row['base_qty']} {row['base_unit']} (normalized key: {key})")
+    for row in inventory:
+        base_qty, base_unit = to_base(row["quantity"], row["unit"])
+        key = (DatabaseManager.normalize_name(row["name"]), base_unit)
+        agg[key] = agg.get(key, 0.0) + base_qty
     return agg
 
-def recipe_feasibility(recipe: Dict, user_id: Optional[int]) -> Tuple[bool, List[Dict]]:
+class RecipeVector(NamedTuple):
+    per_serving: Dict[Tuple[str, str], float]
+    labels: Dict[Tuple[str, str], Tuple[str, str]]  # key -> (display name, recipe unit)
+
+# recipe id -> (stamp of the recipe and every sub-recipe it expands, vector). Stamps
+# use the recipe's version column, so an entry survives reloads and is rebuilt only
+# when the recipe or something in its sub-recipe tree was edited. Bounded, so recipes of
+# idle users and deleted recipes age out.
+_vectors: "OrderedDict[int, Tuple[tuple, RecipeVector]]" = OrderedDict()
+_vectors_lock = threading.Lock()
+
+def recipe_servings(recipe: Dict) -> float:
+    servings = recipe.get("servings") or 1
+    return float(servings) if servings > 0 else 1.0
+
+def _stamp(recipe: Dict, by_id: Dict[int, Dict], memo: Dict[int, Optional[tuple]],
+           visiting: frozenset = frozenset()) -> Optional[tuple]:
+    """Cache key of a recipe tree, or None if it reaches a sub-recipe cycle.
+
+    Where a cycle is cut depends on which recipe the expansion started from,
+    so vectors of such trees are never cached.
+    """
+    rid = recipe["id"]
+    if rid in memo:
+        return memo[rid]
+    # Recipes without a version (built in code rather than loaded) are keyed by their content
+    own = recipe["version"] if "version" in recipe else tuple(
+        (ing["name"], ing["quantity"], ing["unit"], ing.get("sub_recipe_id")) for ing in recipe["ingredients"])
+    children = []
+    cyclic = False
+    for ing in recipe["ingredients"]:
+        sub = by_id.get(ing.get("sub_recipe_id"))
+        if sub is None:
+            continue
+        child = None if sub["id"] in visiting | {rid} else _stamp(sub, by_id, memo, visiting | {rid})
+        cyclic = cyclic or child is None
+        children.append(child)
+    memo[rid] = None if cyclic else (rid, own, recipe_servings(recipe), tuple(children))
+    return memo[rid]
+
+def recipe_vector(recipe: Dict, by_id: Optional[Dict[int, Dict]] = None,
+                  _memo: Optional[Dict[int, tuple]] = None, _visiting: frozenset = frozenset()) -> RecipeVector:
+    """Per-serving requirements in base units with sub-recipes expanded, memoized per recipe tree.
+
+    ``by_id`` maps recipe ids to loaded recipes and is needed to expand
+    sub-recipe lines; lines whose recipe is unknown (or that would recurse
+    into a cycle) are treated as plain ingredients.
+    """
+    by_id = by_id if by_id is not None else {recipe["id"]: recipe}
+    memo = _memo if _memo is not None else {}
+    stamp = _stamp(recipe, by_id, memo, _visiting)
+    if stamp is not None:
+        with _vectors_lock:
+            cached = _vectors.get(recipe["id"])
+            if cached and cached[0] == stamp:
+                _vectors.move_to_end(recipe["id"])
+                return cached[1]
+    servings = recipe_servings(recipe)
+    per_serving: Dict[Tuple[str, str], float] = {}
+    labels: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    for ing in recipe["ingredients"]:
+        sub = by_id.get(ing.get("sub_recipe_id"))
+        if sub is not None and sub["id"] in _visiting | {recipe["id"]}:
+            logger.error(f"recipe_vector: sub-recipe cycle through recipe id={sub['id']}, not expanding")
+            sub = None
+        if sub is not None:
+            portions = float(ing["quantity"])
+            child = recipe_vector(sub, by_id, memo, _visiting | {recipe["id"]})
+            for key, qty in child.per_serving.items():
+                per_serving[key] = per_serving.get(key, 0.0) + qty * portions / servings
+                labels.setdefault(key, child.labels[key])
+            continue
+        base_qty, base_unit = to_base(ing["quantity"], ing["unit"])
+        key = (DatabaseManager.normalize_name(ing["name"]), base_unit)
+        per_serving[key] = per_serving.get(key, 0.0) + base_qty / servings
+        labels.setdefault(key, (ing["name"], ing["unit"]))
+    vector = RecipeVector(per_serving, labels)
+    if stamp is not None:
+        with _vectors_lock:
+            _vectors[recipe["id"]] = (stamp, vector)
+            _vectors.move_to_end(recipe["id"])
+            while len(_vectors) > RECIPE_VECTOR_CACHE:
+                _vectors.popitem(last=False)
+    return vector
+
+def expand_ingredients(recipe: Dict, by_id: Dict[int, Dict], factor: float = 1.0,
+                       _path: frozenset = frozenset()) -> List[Dict]:
+    """Plain recursive expansion of sub-recipe lines (no caching); the reference for ``recipe_vector``."""
+    rows = []
+    for ing in recipe["ingredients"]:
+        sub = by_id.get(ing.get("sub_recipe_id"))
+        if sub is not None and sub["id"] not in _path | {recipe["id"]}:
+            portions = float(ing["quantity"]) * factor / recipe_servings(sub)
+            rows.extend(expand_ingredients(sub, by_id, portions, _path | {recipe["id"]}))
+        else:
+            rows.append({**ing, "quantity": float(ing["quantity"]) * factor})
+    return rows
+
+def resolve_sub_recipes(ingredients: List[Dict], recipes: List[Dict], exclude_id: Optional[int] = None) -> List[Dict]:
+    """Link lines measured in servings whose name is another recipe's title to that recipe."""
+    by_title = {DatabaseManager.normalize_name(r["title"]): r["id"] for r in recipes if r["id"] != exclude_id}
+    resolved = []
+    for ing in ingredients:
+        sub_id = None
+        if normalize_unit(ing["unit"])[0] == "serving":
+            sub_id = by_title.get(DatabaseManager.normalize_name(ing["name"]))
+        resolved.append({**ing, "sub_recipe_id": sub_id})
+    return resolved
+
+def scale_factor(recipe: Dict, servings: Optional[float] = None, factor: float = 1.0) -> float:
+    """Multiplier from the stored recipe to ``servings`` portions (or a plain ``factor``)."""
+    if servings:
+        return float(servings) / recipe_servings(recipe)
+    return float(factor)
+
+def scaled_requirements(recipe: Dict, servings: Optional[float] = None, factor: float = 1.0,
+                        by_id: Optional[Dict[int, Dict]] = None) -> List[Dict]:
+    """Base-ingredient list for a scaled recipe, in the recipe's units with measurable rounding."""
+    vector = recipe_vector(recipe, by_id)
+    portions = recipe_servings(recipe) * scale_factor(recipe, servings, factor)
+    rows = []
+    for key, per_serving in vector.per_serving.items():
+        name, unit = vector.labels[key]
+        qty = round_for_unit(from_base(per_serving * portions, key[1], unit), unit)
+        rows.append({"name": name, "quantity": qty, "unit": unit, "display": f"{fmt_qty(qty)} {unit}"})
+    return rows
+
+def feasibility_table(recipes: List[Dict], inventory: List[Dict], factor: float = 1.0,
+                      servings: Optional[float] = None,
+                      prices: Optional[Dict[Tuple[str, str], float]] = None) -> List[Dict]:
+    """Feasibility of every recipe at once from precomputed vectors.
+
+    Inventory is aggregated once and each recipe costs one pass over its
+    vector whatever the scale. Quantities are reported in the recipe's units.
+    With ``prices`` (per base unit, see ``DatabaseManager.current_prices``) the
+    same pass adds the recipe's cost and the cost of its missing ingredients;
+    ingredients without a price are counted in ``unpriced`` instead.
+    """
+    have = inventory_base_map(inventory)
+    prices = prices or {}
+    by_id = {r["id"]: r for r in recipes}
+    memo: Dict[int, tuple] = {}
+    results = []
+    for recipe in recipes:
+        vector = recipe_vector(recipe, by_id, memo)
+        portions = recipe_servings(recipe) * scale_factor(recipe, servings, factor)
+        matched, missing = [], []
+        cost = shopping_cost = 0.0
+        unpriced = 0
+        for key, per_serving in vector.per_serving.items():
+            need_base = per_serving * portions
+            have_base = have.get(key, 0.0)
+            name, unit = vector.labels[key]
+            price = prices.get(key)
+            row = {
+                "Name": name,
+                "Need": round_for_unit(from_base(need_base, key[1], unit), unit),
+                "Have": round(from_base(have_base, key[1], unit), 2),
+                "Unit": unit,
+                "Missing": 0.0,
+                "key": key,
+                "missing_base": 0.0,
+                "missing_cost": 0.0 if price is not None else None,
+            }
+            if price is None:
+                unpriced += 1
+            else:
+                cost += need_base * price
+            if have_base + 1e-9 < need_base:
+                row["missing_base"] = need_base - have_base
+                row["Missing"] = round_for_unit(from_base(need_base - have_base, key[1], unit), unit)
+                if price is not None:
+                    row["missing_cost"] = row["missing_base"] * price
+                    shopping_cost += row["missing_cost"]
+                missing.append(row)
+            else:
+                matched.append(row)
+        results.append({
+            "recipe": recipe,
+            "feasible": not missing,
+            "matched": matched,
+            "missing": missing,
+            "missing_count": len(missing),
+            "portions": portions,
+            "cost": cost,
+            "shopping_cost": shopping_cost,
+            "unpriced": unpriced,
+        })
+    return results
+
+def cheapest_week(recipes: List[Dict], inventory: List[Dict], prices: Dict[Tuple[str, str], float],
+                  meals: int = 7, factor: float = 1.0, repeat: bool = False) -> Dict:
+    """Pick ``meals`` recipes that are cheap to shop for, cooking from stock first.
+
+    Greedy: each step takes the recipe whose missing ingredients cost least
+    given what earlier picks already used up (recipes needing unpriced
+    ingredients come last), then deducts it from stock. Returns the plan, the
+    combined shopping list in recipe units and the estimated total.
+    """
+    stock = inventory_base_map(inventory)
+    by_id = {r["id"]: r for r in recipes}
+    memo: Dict[int, tuple] = {}
+    candidates = [(r, recipe_vector(r, by_id, memo), recipe_servings(r) * scale_factor(r, None, factor))
+                  for r in recipes]
+    plan, bought, labels = [], {}, {}
+    for _ in range(meals):
+        best = None
+        for recipe, vector, portions in candidates:
+            cost, unpriced = 0.0, 0
+            for key, per_serving in vector.per_serving.items():
+                short = per_serving * portions - stock.get(key, 0.0)
+                if short > 1e-9:
+                    price = prices.get(key)
+                    if price is None:
+                        unpriced += 1
+                    else:
+                        cost += short * price
+            if best is None or (unpriced, cost) < best[0]:
+                best = ((unpriced, cost), recipe, vector, portions)
+        if best is None:
+            break
+        (unpriced, cost), recipe, vector, portions = best
+        for key, per_serving in vector.per_serving.items():
+            need = per_serving * portions
+            used = min(need, stock.get(key, 0.0))
+            stock[key] = stock.get(key, 0.0) - used
+            if need - used > 1e-9:
+                bought[key] = bought.get(key, 0.0) + need - used
+                labels.setdefault(key, vector.labels[key])
+        plan.append({"recipe": recipe, "portions": portions, "shopping_cost": cost, "unpriced": unpriced})
+        if not repeat:
+            candidates = [c for c in candidates if c[0]["id"] != recipe["id"]]
+    shopping = []
+    for key, qty in sorted(bought.items()):
+        name, unit = labels[key]
+        price = prices.get(key)
+        shopping.append({"Name": name, "Quantity": round_for_unit(from_base(qty, key[1], unit), unit), "Unit": unit,
+                         "cost": qty * price if price is not None else None})
+    return {
+        "plan": plan,
+        "shopping": shopping,
+        "total": sum(item["cost"] or 0.0 for item in shopping),
+        "unpriced": sum(item["cost"] is None for item in shopping),
+    }
+
+def recipe_feasibility(recipe: Dict, user_id: Optional[int], factor: float = 1.0,
+                       by_id: Optional[Dict[int, Dict]] = None) -> Tuple[bool, List[Dict]]:
     if not user_id:
         logger.error("recipe_feasibility: No valid user_id")
         return False, []
@@ -26,9 +280,15 @@ def recipe_feasibility(recipe: Dict, user_id: Optional[int]) -> Tuple[bool, List
     logger.info(f"Checking feasibility for recipe: {recipe['title']} (id={recipe['id']})")
     shorts = []
     feasible = True
-    for r in recipe["ingredients"]:
-        name_normalized = DatabaseManager.normalize_name(r["name"])
-        needed_base, base_unit = to_base(r["quantity"], r["unit"])
+    ingredients = expand_ingredients(recipe, by_id) if by_id else recipe["ingredients"]
+    # Lines for the same ingredient draw on the same stock, so they are checked together
+    needs: Dict[Tuple[str, str], Tuple[Dict, float]] = {}
+    for r in ingredients:
+        needed_base, base_unit = to_base(float(r["quantity"]) * factor, r["unit"])
+        key = (DatabaseManager.normalize_name(r["name"]), base_unit)
+        first, total = needs.get(key, (r, 0.0))
+        needs[key] = (first, total + needed_base)
+    for (name_normalized, base_unit), (r, needed_base) in needs.items():
         have_base = inv.get((name_normalized, base_unit), 0.0)
         logger.debug(f"Ingredient: {r['name']} (normalized: {name_normalized}) | Need: {needed_base} {base_unit} | Have: {have_base} {base_unit}")
         if have_base + 1e-9 < needed_base:
@@ -38,7 +298,7 @@ def recipe_feasibility(recipe: Dict, user_id: Optional[int]) -> Tuple[bool, List
             shorts.append(
                 {
                     "name": r["name"],
-                    "needed_qty": r["quantity"],
+                    "needed_qty": from_base(needed_base, base_unit, r["unit"]),
                     "needed_unit": r["unit"],
                     "have_qty": from_base(have_base, base_unit, r["unit"]),
                     "have_unit": r["unit"],
@@ -51,13 +311,33 @@ def recipe_feasibility(recipe: Dict, user_id: Optional[int]) -> Tuple[bool, List
     logger.info(f"Recipe {recipe['title']} feasible: {feasible}, missing ingredients: {len(shorts)}")
     return feasible, shorts
 
-def consume_ingredients_for_recipe(recipe: Dict, user_id: Optional[int]) -> bool:
-    ok, _ = recipe_feasibility(recipe, user_id)
+def consume_ingredients_for_recipe(recipe: Dict, user_id: Optional[int], factor: float = 1.0,
+                                   by_id: Optional[Dict[int, Dict]] = None) -> bool:
+    ok, _ = recipe_feasibility(recipe, user_id, factor, by_id)
     if not ok:
         return False
     if not user_id:
         logger.error("consume_ingredients_for_recipe: No valid user_id")
         return False
-    for r in recipe["ingredients"]:
-        DatabaseManager.adjust_inventory(user_id, r["name"], -abs(float(r["quantity"])), r["unit"])
-    return True
\ No newline at end of file
+    # Single transaction; lots closest to expiry are used first
+    ingredients = expand_ingredients(recipe, by_id) if by_id else recipe["ingredients"]
+    # One requirement per ingredient, in base units, as recipe_feasibility checked them
+    needs: Dict[Tuple[str, str], Dict] = {}
+    for r in ingredients:
+        needed_base, base_unit = to_base(float(r["quantity"]) * factor, r["unit"])
+        key = (DatabaseManager.normalize_name(r["name"]), base_unit)
+        needs.setdefault(key, {"name": r["name"], "quantity": 0.0, "unit": base_unit})["quantity"] += needed_base
+    return DatabaseManager.consume_inventory(user_id, list(needs.values()))
+
+def expiring_soon(inventory: List[Dict], days: int = EXPIRY_SOON_DAYS) -> Dict[Tuple[str, str], str]:
+    """Earliest expiry date per (normalized name, base unit) for stock expiring within ``days``."""
+    cutoff = (date.today() + timedelta(days=days)).isoformat()
+    soon: Dict[Tuple[str, str], str] = {}
+    for row in inventory:
+        expires = row.get("next_expires_at")
+        if not expires or expires > cutoff:
+            continue
+        key = (DatabaseManager.normalize_name(row["name"]), normalize_unit(row["unit"])[0])
+        if key not in soon or expires < soon[key]:
+            soon[key] = expires
+    return soon
\ No newline at end of file
@@ -11,9 +11,84 @@ load_dotenv()
 # DB_PATH = os.getenv("SQLITE_DB_PATH", os.path.join(tempfile.gettempdir(), "ruaden.db"))
 
 
-# Database configuration
-DB_NAME = "ruaden.db"
+# Root log level, applied once by the app bootstrap
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Users whose recipe and inventory snapshots stay in memory, shared by their sessions
+SNAPSHOT_CACHE = int(os.getenv("SNAPSHOT_CACHE", "512"))
+# Expanded recipe requirement vectors kept in memory, least recently used dropped first
+RECIPE_VECTOR_CACHE = int(os.getenv("RECIPE_VECTOR_CACHE", "4096"))
+# Users whose ingredient index (similar recipes, use-it-up suggestions) stays in memory
+RECIPE_INDEX_CACHE = int(os.getenv("RECIPE_INDEX_CACHE", "256"))
+# Show the work counters (app/page runs, connections, jobs) in the sidebar
+SHOW_METRICS = os.getenv("SHOW_METRICS", "0") == "1"
+
+# Database configuration. When running several app processes, point every one of
+# them at the same file on persistent disk and give them the same SESSION_SECRET.
+DB_NAME = os.getenv("SQLITE_DB_PATH", "ruaden.db")
+# Seconds a connection waits on another process's lock before failing
+DB_BUSY_TIMEOUT_SECONDS = float(os.getenv("DB_BUSY_TIMEOUT_SECONDS", "5"))
+# Whole-write retries (with exponential backoff) when the database is still locked
+DB_WRITE_RETRIES = int(os.getenv("DB_WRITE_RETRIES", "5"))
+DB_RETRY_BASE_DELAY = float(os.getenv("DB_RETRY_BASE_DELAY", "0.05"))
 
 # Application titles
 APP_TITLE_EN = "What to Cook Today"
-APP_TITLE_VI = "Hôm Nay Nấu Gì"
\ No newline at end of file
+APP_TITLE_VI = "Hôm Nay Nấu Gì"
+# Worker threads used to overlap independent database reads
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "4"))
+
+# Credential hashing (scrypt) cost; see `python bench.py hash` before changing
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+
+# Signed session tokens; without SESSION_SECRET tokens only live as long as the process
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(12 * 3600)))
+
+# Login / password reset rate limiting (attempts per window, per username)
+AUTH_MAX_ATTEMPTS = int(os.getenv("AUTH_MAX_ATTEMPTS", "5"))
+AUTH_WINDOW_SECONDS = int(os.getenv("AUTH_WINDOW_SECONDS", "300"))
+
+# Hours a pantry invite code stays valid
+PANTRY_INVITE_HOURS = int(os.getenv("PANTRY_INVITE_HOURS", "48"))
+
+# Stock expiring within this many days is treated as "use soon"
+EXPIRY_SOON_DAYS = int(os.getenv("EXPIRY_SOON_DAYS", "3"))
+
+# Days of inventory history kept for "as of" views, consumption rates and undo
+INVENTORY_HISTORY_DAYS = int(os.getenv("INVENTORY_HISTORY_DAYS", "365"))
+
+# Forecasting (forecast.py): age in days at which a day's usage counts half in the smoothed
+# rate, suggest restocking what runs out within RESTOCK days, and buy enough for COVER days
+FORECAST_HALF_LIFE_DAYS = float(os.getenv("FORECAST_HALF_LIFE_DAYS", "14"))
+FORECAST_RESTOCK_DAYS = int(os.getenv("FORECAST_RESTOCK_DAYS", "7"))
+FORECAST_COVER_DAYS = int(os.getenv("FORECAST_COVER_DAYS", "14"))
+
+# Database maintenance (maintenance.py): run at most every INTERVAL hours (0 disables the
+# scheduler), once the process opened no connection for IDLE seconds; free pages given
+# back per run with incremental auto_vacuum (0: all)
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "24"))
+MAINTENANCE_IDLE_SECONDS = float(os.getenv("MAINTENANCE_IDLE_SECONDS", "300"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "0"))
+
+# Nutrient table (per canonical ingredient) used for calories and macros
+NUTRITION_CSV = os.getenv("NUTRITION_CSV", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition.csv"))
+
+# How prices are shown; amounts are stored as plain numbers in this currency
+CURRENCY = os.getenv("CURRENCY", "₫")
+CURRENCY_DECIMALS = int(os.getenv("CURRENCY_DECIMALS", "0"))
+
+# JSON API (api.py): bind address when run on its own, and the largest request body accepted.
+# With API_IN_PROCESS=1 the Streamlit app also serves it, from a thread, on API_PORT.
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8502"))
+API_MAX_BODY_BYTES = int(os.getenv("API_MAX_BODY_BYTES", str(5 * 1024 * 1024)))
+API_IN_PROCESS = os.getenv("API_IN_PROCESS", "0") == "1"
+
+# Background jobs: worker threads, finished results kept, and how long a page waits inline
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RESULT_CACHE = int(os.getenv("JOB_RESULT_CACHE", "256"))
+JOB_WAIT_SECONDS = float(os.getenv("JOB_WAIT_SECONDS", "0.3"))
+# A failed job is reported for this long, then submitting its key runs it again
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "30"))
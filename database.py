@@ -1,6 +1,42 @@
 import sqlite3
-from typing import Optional, List, Dict, Any
-from config import DB_NAME
+import functools
+import hashlib
+import logging
+import secrets
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple
+import metrics
+from models import Ingredient, InventoryItem, Recipe
+from config import (DB_NAME, DB_BUSY_TIMEOUT_SECONDS, DB_WRITE_RETRIES, DB_RETRY_BASE_DELAY, PANTRY_INVITE_HOURS,
+                    INVENTORY_HISTORY_DAYS, FORECAST_HALF_LIFE_DAYS)
+from utils import to_base, from_base, normalize_unit, same_dimension
+from security import hash_secret, verify_secret, burn_verify
+
+logger = logging.getLogger(__name__)
+
+def retry_on_locked(func):
+    """Re-run a write transaction when another process holds the lock past the busy timeout.
+
+    Safe because every write method runs in its own transaction, which is
+    rolled back when the error surfaces.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        delay = DB_RETRY_BASE_DELAY
+        for attempt in range(1, DB_WRITE_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                message = str(e).lower()
+                if ("locked" not in message and "busy" not in message) or attempt == DB_WRITE_RETRIES:
+                    raise
+                logger.warning(f"{func.__name__}: database busy (attempt {attempt}/{DB_WRITE_RETRIES}), retrying")
+                time.sleep(delay * (1 + random.random()))
+                delay *= 2
+    return wrapper
 
 class DatabaseManager:
     @staticmethod
@@ -8,11 +44,64 @@ class DatabaseManager:
         """Normalize inventory/recipe names for comparison."""
         return name.strip().lower() if isinstance(name, str) else ""
     @staticmethod
-    def get_db_conn():
-        conn = sqlite3.connect(DB_NAME)
+    @retry_on_locked
+    def init_db() -> bool:
+        """Create or migrate the schema once per process; returns whether this call ran it.
+
+        Called by the app bootstrap, or by the first connection of any other
+        entry point, rather than as a side effect of importing this module.
+        """
+        global _schema_ready
+        with _schema_lock:
+            if _schema_ready:
+                return False
+            conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_SECONDS)
+            try:
+                # Lets maintenance.run give free pages back without a full VACUUM. It only takes
+                # effect on a new file; existing ones are converted by maintenance.py --convert
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                # WAL lets readers in other processes run alongside a writer; the mode is stored in the file
+                conn.execute("PRAGMA journal_mode = WAL")
+                # One transaction, so processes starting together do not interleave trigger rebuilds
+                conn.execute("BEGIN IMMEDIATE")
+                _create_schema(conn.cursor())
+                conn.commit()
+            finally:
+                conn.close()
+            _schema_ready = True
+            logger.info(f"init_db: schema ready in {DB_NAME}")
+            return True
+
+    @staticmethod
+    def get_db_conn(write: bool = False):
+        """Open a connection; ``write`` takes the write lock up front with ``BEGIN IMMEDIATE``.
+
+        Write methods read before they write (find-or-insert, stock checks), so
+        holding the lock from the start keeps another process from changing the
+        rows in between, and lock waits happen under the busy timeout instead of
+        failing on upgrade.
+        """
+        if not _schema_ready:
+            DatabaseManager.init_db()
+        metrics.incr("db.connections")
+        conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_SECONDS)
         conn.row_factory = sqlite3.Row
+        # WAL is set once on the file at start-up; NORMAL sync is durable enough with it
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if write:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.Error:
+                conn.close()
+                raise
         return conn
 
+    @staticmethod
+    def ping() -> bool:
+        with DatabaseManager.get_db_conn() as conn:
+            conn.execute("SELECT 1;")
+            return True
+
     @staticmethod
     def validate_user_id(user_id: int) -> bool:
         with DatabaseManager.get_db_conn() as conn:
@@ -21,130 +110,1075 @@ class DatabaseManager:
             return cur.fetchone() is not None
 
     @staticmethod
+    @retry_on_locked
     def verify_login(username: str, password: str) -> Optional[int]:
         with DatabaseManager.get_db_conn() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, password))
+            cur.execute("SELECT id, password FROM users WHERE username = ?", (username,))
             result = cur.fetchone()
-            return result[0] if result else None
+            if not result:
+                burn_verify(password)
+                return None
+            ok, needs_upgrade = verify_secret(password, result["password"])
+            if not ok:
+                return None
+            if needs_upgrade:
+                cur.execute("UPDATE users SET password = ? WHERE id = ?", (hash_secret(password), result["id"]))
+                conn.commit()
+                logger.info(f"Upgraded password hash for user_id={result['id']}")
+            return result["id"]
 
     @staticmethod
+    @retry_on_locked
     def create_user(username: str, password: str, security_question: str, security_answer: str) -> tuple[bool, str]:
         try:
             with DatabaseManager.get_db_conn() as conn:
                 cur = conn.cursor()
                 cur.execute("INSERT INTO users (username, password, security_question, security_answer) VALUES (?, ?, ?, ?)",
-                            (username, password, security_question, security_answer))
+                            (username, hash_secret(password), security_question, hash_secret(security_answer)))
                 conn.commit()
                 return True, "User created successfully."
         except sqlite3.IntegrityError:
             return False, "Username already exists."
 
     @staticmethod
+    @retry_on_locked
     def reset_password(username: str, security_answer: str, new_password: str) -> bool:
         with DatabaseManager.get_db_conn() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT id FROM users WHERE username = ? AND security_answer = ?", (username, security_answer))
+            cur.execute("SELECT id, security_answer FROM users WHERE username = ?", (username,))
             user = cur.fetchone()
-            if user:
-                cur.execute("UPDATE users SET password = ? WHERE id = ?", (new_password, user[0]))
-                conn.commit()
-                return True
-            return False
+            if not user:
+                burn_verify(security_answer)
+                return False
+            ok, needs_upgrade = verify_secret(security_answer, user["security_answer"])
+            if not ok:
+                return False
+            if needs_upgrade:
+                cur.execute("UPDATE users SET security_answer = ? WHERE id = ?", (hash_secret(security_answer), user["id"]))
+            cur.execute("UPDATE users SET password = ? WHERE id = ?", (hash_secret(new_password), user["id"]))
+            conn.commit()
+            return True
+
+    # Pantries. Every account owns a pantry (its recipes, inventory and prices, all
+    # stored under its user id); a member account works on another account's pantry
+    # instead of its own, so the pantry id is the owning account's user id.
+
+    @staticmethod
+    def pantry_of(user_id: int) -> int:
+        """The pantry ``user_id`` works on: the one they joined, otherwise their own."""
+        with DatabaseManager.get_db_conn() as conn:
+            row = conn.execute("SELECT pantry_id FROM pantry_members WHERE user_id = ?", (user_id,)).fetchone()
+            return row[0] if row else user_id
+
+    @staticmethod
+    def pantry_version(user_id: int) -> Tuple[int, int]:
+        """``(pantry id, data version of that pantry)`` for ``user_id`` in one round trip."""
+        with DatabaseManager.get_db_conn() as conn:
+            row = conn.execute("SELECT pantry_id FROM pantry_members WHERE user_id = ?", (user_id,)).fetchone()
+            pantry_id = row[0] if row else user_id
+            row = conn.execute("SELECT MAX(seq) FROM change_log WHERE user_id = ?", (pantry_id,)).fetchone()
+            return pantry_id, row[0] or 0
+
+    @staticmethod
+    def get_username(user_id: int) -> Optional[str]:
+        with DatabaseManager.get_db_conn() as conn:
+            row = conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()
+            return row[0] if row else None
 
     @staticmethod
-    def list_inventory(user_id: int) -> List[Dict[str, Any]]:
+    def pantry_members(pantry_id: int) -> List[Dict[str, Any]]:
+        with DatabaseManager.get_db_conn() as conn:
+            rows = conn.execute("SELECT m.user_id, u.username, m.joined_at FROM pantry_members m "
+                                "JOIN users u ON u.id = m.user_id WHERE m.pantry_id = ? ORDER BY m.joined_at",
+                                (pantry_id,))
+            return [dict(r) for r in rows]
+
+    @staticmethod
+    def _invite_hash(code: str) -> str:
+        return hashlib.sha256(code.strip().encode("utf-8")).hexdigest()
+
+    @staticmethod
+    @retry_on_locked
+    def create_pantry_invite(user_id: int) -> Optional[str]:
+        """Single-use code letting another account join ``user_id``'s own pantry; None for members."""
+        code = secrets.token_urlsafe(9)
+        expires_at = (datetime.now(timezone.utc) + timedelta(hours=PANTRY_INVITE_HOURS)).isoformat()
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            if conn.execute("SELECT 1 FROM pantry_members WHERE user_id = ?", (user_id,)).fetchone():
+                return None
+            conn.execute("DELETE FROM pantry_invites WHERE expires_at < ?", (datetime.now(timezone.utc).isoformat(),))
+            conn.execute("INSERT INTO pantry_invites (code_hash, pantry_id, expires_at) VALUES (?, ?, ?)",
+                         (DatabaseManager._invite_hash(code), user_id, expires_at))
+            conn.commit()
+        return code
+
+    @staticmethod
+    @retry_on_locked
+    def join_pantry(user_id: int, code: str) -> tuple[bool, str]:
+        """Join the pantry an invite code was made for. The account's own data is kept, unused, until it leaves."""
+        now = datetime.now(timezone.utc).isoformat()
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            invite = conn.execute("SELECT pantry_id FROM pantry_invites WHERE code_hash = ? AND expires_at >= ?",
+                                  (DatabaseManager._invite_hash(code), now)).fetchone()
+            if not invite:
+                return False, "Invalid or expired invite code."
+            if invite[0] == user_id:
+                return False, "This is your own pantry."
+            if conn.execute("SELECT 1 FROM pantry_members WHERE user_id = ?", (user_id,)).fetchone():
+                return False, "Leave your current pantry first."
+            if conn.execute("SELECT 1 FROM pantry_members WHERE pantry_id = ?", (user_id,)).fetchone():
+                return False, "Others share your pantry, so you cannot join another one."
+            conn.execute("DELETE FROM pantry_invites WHERE code_hash = ?", (DatabaseManager._invite_hash(code),))
+            conn.execute("INSERT INTO pantry_members (user_id, pantry_id) VALUES (?, ?)", (user_id, invite[0]))
+            conn.commit()
+        logger.info(f"join_pantry: user_id={user_id} joined pantry_id={invite[0]}")
+        return True, "Joined pantry."
+
+    @staticmethod
+    @retry_on_locked
+    def leave_pantry(user_id: int, pantry_id: Optional[int] = None) -> bool:
+        """Take ``user_id`` out of the pantry they joined (only of ``pantry_id``, when given, e.g. by its owner)."""
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            cur = conn.execute("DELETE FROM pantry_members WHERE user_id = ? AND pantry_id = COALESCE(?, pantry_id)",
+                               (user_id, pantry_id))
+            conn.commit()
+            return cur.rowcount > 0
+
+    @staticmethod
+    def list_inventory(user_id: int) -> List[InventoryItem]:
         with DatabaseManager.get_db_conn() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT id, name, quantity, unit FROM inventory WHERE user_id = ?", (user_id,))
-            return [dict(row) for row in cur.fetchall()]
+            cur.execute("SELECT id, name, quantity, unit, next_expires_at, version FROM inventory WHERE user_id = ?",
+                        (user_id,))
+            return [InventoryItem.from_row(row) for row in cur.fetchall()]
 
     @staticmethod
-    def upsert_inventory(user_id: int, name: str, quantity: float, unit: str) -> bool:
+    def list_lots(user_id: int, expiring_before: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lots with stock left, earliest expiry first; optionally only those expiring before a date."""
+        sql = ("SELECT l.id, l.inventory_id, i.name, l.quantity, i.unit, l.purchased_at, l.expires_at "
+               "FROM inventory_lots l JOIN inventory i ON i.id = l.inventory_id "
+               "WHERE l.user_id = ? AND l.quantity > 0")
+        params: List[Any] = [user_id]
+        if expiring_before:
+            sql += " AND l.expires_at IS NOT NULL AND l.expires_at < ?"
+            params.append(expiring_before)
+        sql += " ORDER BY l.expires_at IS NULL, l.expires_at, l.id"
         with DatabaseManager.get_db_conn() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    @staticmethod
+    def rebuild_inventory_rollup(cur, inventory_ids: Optional[List[int]] = None) -> None:
+        """Recompute inventory totals and next expiry from lots (after bulk loads or restores)."""
+        sql = """
+            UPDATE inventory SET
+                quantity = (SELECT COALESCE(SUM(quantity), 0) FROM inventory_lots WHERE inventory_id = inventory.id),
+                next_expires_at = (SELECT MIN(expires_at) FROM inventory_lots
+                                   WHERE inventory_id = inventory.id AND quantity > 0)
+        """
+        if inventory_ids is None:
+            cur.execute(sql)
+        else:
+            cur.executemany(sql + " WHERE id = ?", [(i,) for i in inventory_ids])
+
+    @staticmethod
+    def _add_lot(cur, inventory_id: int, user_id: int, quantity: float,
+                 expires_at: Optional[str] = None, purchased_at: Optional[str] = None) -> None:
+        if quantity <= 0:
+            return
+        cur.execute("INSERT INTO inventory_lots (inventory_id, user_id, quantity, purchased_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (inventory_id, user_id, quantity, purchased_at or date.today().isoformat(), expires_at))
+
+    @staticmethod
+    def _consume_lots(cur, inventory_id: int, quantity: float) -> float:
+        """Take ``quantity`` from a row's lots, earliest expiry first; returns what could not be taken."""
+        remaining = quantity
+        lots = cur.execute("SELECT id, quantity FROM inventory_lots WHERE inventory_id = ? AND quantity > 0 "
+                           "ORDER BY expires_at IS NULL, expires_at, purchased_at, id", (inventory_id,)).fetchall()
+        for lot_id, lot_qty in lots:
+            if remaining <= 1e-9:
+                break
+            if lot_qty <= remaining + 1e-9:
+                cur.execute("DELETE FROM inventory_lots WHERE id = ?", (lot_id,))
+                remaining -= lot_qty
+            else:
+                cur.execute("UPDATE inventory_lots SET quantity = ? WHERE id = ?", (lot_qty - remaining, lot_id))
+                remaining = 0.0
+        return max(remaining, 0.0)
+
+    @staticmethod
+    def _set_inventory_quantity(cur, inventory_id: int, user_id: int, quantity: float,
+                                expires_at: Optional[str] = None) -> None:
+        """Move a row's total to ``quantity``: increases become a new lot, decreases consume FIFO."""
+        current = cur.execute("SELECT quantity FROM inventory WHERE id = ?", (inventory_id,)).fetchone()[0]
+        delta = float(quantity) - current
+        if delta > 1e-9:
+            DatabaseManager._add_lot(cur, inventory_id, user_id, delta, expires_at)
+        elif delta < -1e-9:
+            DatabaseManager._consume_lots(cur, inventory_id, -delta)
+
+    @staticmethod
+    @retry_on_locked
+    def upsert_inventory(user_id: int, name: str, quantity: float, unit: str, expires_at: Optional[str] = None) -> bool:
+        with DatabaseManager.get_db_conn(write=True) as conn:
             cur = conn.cursor()
+            DatabaseManager._begin_batch(cur, user_id, "set")
             cur.execute("SELECT id FROM inventory WHERE user_id = ? AND name = ? AND unit = ?", (user_id, name, unit))
             row = cur.fetchone()
             if row:
-                cur.execute("UPDATE inventory SET quantity = ? WHERE id = ?", (quantity, row[0]))
+                DatabaseManager._set_inventory_quantity(cur, row[0], user_id, quantity, expires_at)
             else:
-                cur.execute("INSERT INTO inventory (user_id, name, quantity, unit) VALUES (?, ?, ?, ?)",
-                            (user_id, name, quantity, unit))
+                cur.execute("INSERT INTO inventory (user_id, name, quantity, unit) VALUES (?, ?, 0, ?)",
+                            (user_id, name, unit))
+                DatabaseManager._add_lot(cur, cur.lastrowid, user_id, quantity, expires_at)
             conn.commit()
             return True
 
     @staticmethod
-    def update_inventory_item(item_id: int, name: str, quantity: float, unit: str) -> bool:
-        with DatabaseManager.get_db_conn() as conn:
+    @retry_on_locked
+    def add_inventory_lot(user_id: int, name: str, quantity: float, unit: str,
+                          expires_at: Optional[str] = None, purchased_at: Optional[str] = None) -> bool:
+        """Record a purchase: adds a lot to the matching row (converting units) or creates the row."""
+        with DatabaseManager.get_db_conn(write=True) as conn:
             cur = conn.cursor()
-            cur.execute("UPDATE inventory SET name = ?, quantity = ?, unit = ? WHERE id = ?",
-                        (name, quantity, unit, item_id))
+            DatabaseManager._begin_batch(cur, user_id, "purchase")
+            DatabaseManager._add_lot_by_name(cur, user_id, name, quantity, unit, expires_at, purchased_at)
             conn.commit()
-            return cur.rowcount > 0
+            return True
 
     @staticmethod
-    def delete_inventory(item_id: int) -> bool:
-        with DatabaseManager.get_db_conn() as conn:
+    @retry_on_locked
+    def add_inventory_lots(user_id: int, lots: List[Dict[str, Any]]) -> int:
+        """Record many purchases (``add_inventory_lot`` fields, plus an optional total ``price``)
+        in one transaction; returns how many were added. Nothing is written if one is invalid."""
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            cur = conn.cursor()
+            DatabaseManager._begin_batch(cur, user_id, "purchase")
+            for lot in lots:
+                DatabaseManager._add_lot_by_name(cur, user_id, lot["name"], float(lot["quantity"]), lot["unit"],
+                                                 lot.get("expires_at"), lot.get("purchased_at"))
+                if lot.get("price") is not None:
+                    DatabaseManager._record_price(cur, user_id, lot["name"], float(lot["price"]),
+                                                  float(lot["quantity"]), lot["unit"], lot.get("purchased_at"))
+            conn.commit()
+        return len(lots)
+
+    @staticmethod
+    def _add_lot_by_name(cur, user_id: int, name: str, quantity: float, unit: str,
+                         expires_at: Optional[str] = None, purchased_at: Optional[str] = None) -> int:
+        key = DatabaseManager.normalize_name(name)
+        base_qty, base_unit = to_base(quantity, unit)
+        rows = cur.execute("SELECT id, name, unit FROM inventory WHERE user_id = ?", (user_id,)).fetchall()
+        target = next((r for r in rows if DatabaseManager.normalize_name(r[1]) == key and r[2] == unit), None)
+        target = target or next((r for r in rows if DatabaseManager.normalize_name(r[1]) == key
+                                 and normalize_unit(r[2])[0] == base_unit), None)
+        if target:
+            inventory_id, row_unit = target[0], target[2]
+            qty = from_base(base_qty, base_unit, row_unit)
+        else:
+            cur.execute("INSERT INTO inventory (user_id, name, quantity, unit) VALUES (?, ?, 0, ?)",
+                        (user_id, name, unit))
+            inventory_id, qty = cur.lastrowid, quantity
+        DatabaseManager._add_lot(cur, inventory_id, user_id, qty, expires_at, purchased_at)
+        return inventory_id
+
+    @staticmethod
+    @retry_on_locked
+    def consume_inventory(user_id: int, requirements: List[Dict[str, Any]]) -> bool:
+        """Deduct ``{name, quantity, unit}`` requirements from stock in one transaction.
+
+        Each requirement draws on every row with the same ingredient and unit
+        dimension, lots with the earliest expiry first. Nothing is written
+        unless all requirements can be met.
+        """
+        conn = DatabaseManager.get_db_conn(write=True)
+        try:
+            cur = conn.cursor()
+            DatabaseManager._begin_batch(cur, user_id, "consume")
+            rows = cur.execute("SELECT id, name, unit, quantity, next_expires_at FROM inventory WHERE user_id = ?",
+                               (user_id,)).fetchall()
+            by_key: Dict[tuple, List[Any]] = {}
+            for r in rows:
+                by_key.setdefault((DatabaseManager.normalize_name(r["name"]), normalize_unit(r["unit"])[0]), []).append(r)
+            # Stock left per row in base units, so later requirements on the same key see earlier takes
+            left = {r["id"]: to_base(r["quantity"], r["unit"])[0] for r in rows}
+            for req in requirements:
+                need_base, base_unit = to_base(abs(float(req["quantity"])), req["unit"])
+                candidates = sorted(by_key.get((DatabaseManager.normalize_name(req["name"]), base_unit), []),
+                                    key=lambda r: (r["next_expires_at"] is None, r["next_expires_at"] or ""))
+                for r in candidates:
+                    if need_base <= 1e-9:
+                        break
+                    take_base = min(left[r["id"]], need_base)
+                    if take_base <= 1e-9:
+                        continue
+                    short = DatabaseManager._consume_lots(cur, r["id"], from_base(take_base, base_unit, r["unit"]))
+                    # Lots can hold less than the rolled-up total says; what they lacked is still needed
+                    taken_base = take_base - to_base(short, r["unit"])[0]
+                    left[r["id"]] = 0.0 if short > 1e-9 else left[r["id"]] - taken_base
+                    need_base -= taken_base
+                if need_base > 1e-6:
+                    conn.rollback()
+                    logger.info(f"consume_inventory: not enough {req['name']} for user_id={user_id}")
+                    return False
+            conn.commit()
+            return True
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    @retry_on_locked
+    def update_inventory_item(item_id: int, name: str, quantity: float, unit: str,
+                              expected_version: Optional[int] = None) -> bool:
+        """Set a row's name, unit and total; with ``expected_version``, only if nobody changed it since."""
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            cur = conn.cursor()
+            row = cur.execute("SELECT user_id, unit, version FROM inventory WHERE id = ?", (item_id,)).fetchone()
+            if not row or (expected_version is not None and row["version"] != expected_version):
+                return False
+            DatabaseManager._begin_batch(cur, row["user_id"], "edit")
+            DatabaseManager._update_inventory_row(cur, item_id, row["user_id"], row["unit"], name, quantity, unit)
+            conn.commit()
+            return True
+
+    @staticmethod
+    def _update_inventory_row(cur, item_id: int, user_id: int, old_unit: str, name: str, quantity: float,
+                              unit: str, expires_at: Optional[str] = None) -> None:
+        if old_unit != unit:
+            # Keep lots in the row's unit: rescale them, or restart stock if the dimension changes
+            if same_dimension(old_unit, unit):
+                factor = to_base(1.0, old_unit)[0] / to_base(1.0, unit)[0]
+                cur.execute("UPDATE inventory_lots SET quantity = quantity * ? WHERE inventory_id = ?", (factor, item_id))
+            else:
+                cur.execute("DELETE FROM inventory_lots WHERE inventory_id = ?", (item_id,))
+        cur.execute("UPDATE inventory SET name = ?, unit = ?, version = version + 1 WHERE id = ?", (name, unit, item_id))
+        DatabaseManager._set_inventory_quantity(cur, item_id, user_id, quantity, expires_at)
+
+    @staticmethod
+    @retry_on_locked
+    def delete_inventory(item_id: int, expected_version: Optional[int] = None) -> bool:
+        with DatabaseManager.get_db_conn(write=True) as conn:
             cur = conn.cursor()
+            row = cur.execute("SELECT user_id, version FROM inventory WHERE id = ?", (item_id,)).fetchone()
+            # Checked before opening a batch, so a stale delete leaves no empty batch behind
+            if row is None or (expected_version is not None and row["version"] != expected_version):
+                return False
+            DatabaseManager._begin_batch(cur, row["user_id"], "delete")
             cur.execute("DELETE FROM inventory WHERE id = ?", (item_id,))
             conn.commit()
-            return cur.rowcount > 0
+            return True
+
+    @staticmethod
+    @retry_on_locked
+    def apply_inventory_edits(user_id: int, edits: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Apply row edits made against a possibly stale view of the inventory, in one transaction.
+
+        Each edit is ``{id, version, name, quantity, unit}`` (plus ``delete``
+        to remove the row), or has no ``id`` for a new row. An edit to a row
+        that changed after ``version`` was read is skipped and reported,
+        unless it would leave the row as it already is; edits to other rows
+        still apply, so concurrent edits of different rows merge. Returns
+        ``{"applied": n, "conflicts": [{name, reason, current}]}`` where
+        ``reason`` is ``changed``, ``deleted`` or ``added`` (another edit
+        created the same ingredient) and ``current`` is the stored row.
+        """
+        applied, conflicts = 0, []
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            cur = conn.cursor()
+            DatabaseManager._begin_batch(cur, user_id, "edit")
+            for edit in edits:
+                reason, current = DatabaseManager._apply_inventory_edit(cur, user_id, edit)
+                if reason:
+                    conflicts.append({"name": edit.get("name"), "reason": reason, "current": current})
+                else:
+                    applied += 1
+            conn.commit()
+        if conflicts:
+            logger.info(f"apply_inventory_edits: user_id={user_id} {len(conflicts)} conflicting edits skipped")
+        return {"applied": applied, "conflicts": conflicts}
+
+    @staticmethod
+    def _apply_inventory_edit(cur, user_id: int, edit: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        columns = "id, name, quantity, unit, version"
+        if edit.get("id") is None:
+            key = DatabaseManager.normalize_name(edit["name"])
+            row = next((r for r in cur.execute(f"SELECT {columns} FROM inventory WHERE user_id = ? AND unit = ?",
+                                               (user_id, edit["unit"]))
+                        if DatabaseManager.normalize_name(r["name"]) == key), None)
+            if row is not None:
+                # The same row added by two people at once is not a conflict
+                return (None, None) if abs(row["quantity"] - float(edit["quantity"])) < 1e-9 else ("added", dict(row))
+            cur.execute("INSERT INTO inventory (user_id, name, quantity, unit) VALUES (?, ?, 0, ?)",
+                        (user_id, edit["name"], edit["unit"]))
+            DatabaseManager._add_lot(cur, cur.lastrowid, user_id, float(edit["quantity"]))
+            return None, None
+        row = cur.execute(f"SELECT {columns} FROM inventory WHERE id = ? AND user_id = ?",
+                          (edit["id"], user_id)).fetchone()
+        if edit.get("delete"):
+            if row is None:
+                return None, None
+            if row["version"] != edit["version"]:
+                return "changed", dict(row)
+            cur.execute("DELETE FROM inventory WHERE id = ?", (row["id"],))
+            return None, None
+        if row is None:
+            return "deleted", None
+        if row["version"] != edit["version"]:
+            if (row["name"], row["unit"]) == (edit["name"], edit["unit"]) and abs(row["quantity"] - float(edit["quantity"])) < 1e-9:
+                return None, None
+            return "changed", dict(row)
+        DatabaseManager._update_inventory_row(cur, row["id"], user_id, row["unit"], edit["name"], edit["quantity"],
+                                              edit["unit"])
+        return None, None
+
+    @staticmethod
+    def _begin_batch(cur, user_id: Optional[int], source: str) -> int:
+        """Open an inventory history batch; the history triggers file the transaction's changes under it."""
+        cur.execute("INSERT INTO inventory_batches (user_id, source) VALUES (?, ?)", (user_id, source))
+        return cur.lastrowid
+
+    @staticmethod
+    def _utc_stamp(moment: datetime) -> str:
+        """``moment`` in the format SQLite's ``strftime('%Y-%m-%dT%H:%M:%fZ')`` writes, so the two compare."""
+        return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+    @staticmethod
+    def _history_horizon(cur) -> str:
+        return cur.execute("SELECT created_at FROM inventory_batches WHERE source = 'horizon' "
+                           "ORDER BY id LIMIT 1").fetchone()[0]
+
+    @staticmethod
+    def _first_batch_after(cur, at: str) -> Optional[int]:
+        """Id of the first batch (of any user) created after ``at``; one probe of the created_at index,
+        as ids and creation times rise together."""
+        row = cur.execute("SELECT id FROM inventory_batches WHERE created_at > ? ORDER BY created_at, id LIMIT 1",
+                          (at,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def inventory_history(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        """The user's latest history batches, newest first, each with its ``changes``
+        (``old_*``/``new_*`` name, unit and quantity; ``None`` where the row did not exist)."""
+        with DatabaseManager.get_db_conn() as conn:
+            batches = {r["id"]: dict(r, changes=[]) for r in conn.execute(
+                "SELECT id, source, created_at, undone_by FROM inventory_batches b "
+                "WHERE user_id = ? AND source != 'horizon' "
+                "AND EXISTS (SELECT 1 FROM inventory_history WHERE batch_id = b.id AND user_id = b.user_id) "
+                "ORDER BY id DESC LIMIT ?", (user_id, limit))}
+            # All their rows in one query rather than one per batch. Triggers file rows under the
+            # newest batch of anyone, so rows of other users are filtered out as in undo and as-of
+            for r in conn.execute(
+                    "SELECT batch_id, inventory_id, old_name, old_unit, old_quantity, new_name, new_unit, new_quantity "
+                    f"FROM inventory_history WHERE user_id = ? AND batch_id IN ({','.join('?' * len(batches))}) "
+                    "ORDER BY batch_id, inventory_id", (user_id, *batches)):
+                batches[r["batch_id"]]["changes"].append({k: r[k] for k in r.keys() if k != "batch_id"})
+            return list(batches.values())
 
     @staticmethod
-    def list_recipes(user_id: int) -> List[Dict[str, Any]]:
+    def inventory_as_of(user_id: int, at: str) -> List[Dict[str, Any]]:
+        """The user's inventory rows (``id, name, quantity, unit``) as they were at UTC ISO time ``at``.
+
+        Each row is rewound to the state recorded before its first change
+        after ``at``; rows untouched since are read as they are now. Raises
+        ValueError for times before the history horizon (see
+        ``compact_inventory_history``).
+        """
         with DatabaseManager.get_db_conn() as conn:
+            if at < DatabaseManager._history_horizon(conn):
+                raise ValueError("Inventory history does not reach back that far.")
+            rows = {r["id"]: dict(r) for r in conn.execute(
+                "SELECT id, name, quantity, unit FROM inventory WHERE user_id = ?", (user_id,))}
+            first = DatabaseManager._first_batch_after(conn, at)
+            if first is None:
+                return list(rows.values())
+            rewound = set()
+            for h in conn.execute("SELECT inventory_id, old_name, old_unit, old_quantity FROM inventory_history "
+                                  "WHERE user_id = ? AND batch_id >= ? ORDER BY batch_id", (user_id, first)):
+                if h["inventory_id"] in rewound:
+                    continue
+                rewound.add(h["inventory_id"])
+                if h["old_name"] is None:
+                    rows.pop(h["inventory_id"], None)
+                else:
+                    rows[h["inventory_id"]] = {"id": h["inventory_id"], "name": h["old_name"],
+                                               "quantity": h["old_quantity"], "unit": h["old_unit"]}
+        return sorted(rows.values(), key=lambda r: r["id"])
+
+    @staticmethod
+    def consumption_rates(user_id: int, days: int = 30) -> List[Dict[str, Any]]:
+        """Stock used per day over the last ``days`` (or since the history horizon), per ingredient.
+
+        Counts decreases from cooking and from edits that lowered a row, in
+        base units: ``[{name, base_unit, consumed, per_day}]``, fastest first.
+        """
+        now = datetime.now(timezone.utc)
+        since = DatabaseManager._utc_stamp(now - timedelta(days=days))
+        totals: Dict[tuple, Dict[str, Any]] = {}
+        with DatabaseManager.get_db_conn() as conn:
+            since = max(since, DatabaseManager._history_horizon(conn))
+            first = DatabaseManager._first_batch_after(conn, since)
+            rows = conn.execute(
+                "SELECT h.old_unit, h.old_quantity, h.new_name, h.new_unit, h.new_quantity "
+                "FROM inventory_history h JOIN inventory_batches b ON b.id = h.batch_id "
+                "WHERE h.user_id = ? AND h.batch_id >= ? AND b.undone_by IS NULL "
+                f"AND b.source IN ({','.join('?' * len(CONSUMPTION_SOURCES))})",
+                (user_id, first or 0, *CONSUMPTION_SOURCES)).fetchall() if first else []
+        for found in filter(None, map(DatabaseManager._decrease, rows)):
+            key, name, amount = found
+            entry = totals.setdefault(key, {"name": name, "base_unit": key[1], "consumed": 0.0})
+            entry["consumed"] += amount
+        span = max((now - datetime.fromisoformat(since.replace("Z", "+00:00"))).total_seconds() / 86400, 1.0)
+        for entry in totals.values():
+            entry["per_day"] = entry["consumed"] / span
+        return sorted(totals.values(), key=lambda e: -e["per_day"])
+
+    @staticmethod
+    def _decrease(row) -> Optional[Tuple[tuple, str, float]]:
+        """``(key, name, base amount)`` a history row took off stock, or None if it did not lower it."""
+        if row["new_name"] is None or row["old_unit"] is None:
+            return None
+        old_base, old_unit = to_base(row["old_quantity"], row["old_unit"])
+        new_base, new_unit = to_base(row["new_quantity"], row["new_unit"])
+        if old_unit != new_unit or old_base - new_base <= 1e-9:
+            return None
+        return (DatabaseManager.normalize_name(row["new_name"]), new_unit), row["new_name"], old_base - new_base
+
+    @staticmethod
+    @retry_on_locked
+    def update_consumption_rollup(user_id: int, half_life_days: float = FORECAST_HALF_LIFE_DAYS) -> Dict[str, Any]:
+        """Bring the user's forecasting rollup up to date and return what it read and folded.
+
+        Reads only history batches after the rollup's cursor: decreases from
+        cooking and edits are added to per-day totals (an undo takes its
+        batch's decreases back out). Each day that is over is then folded
+        into every ingredient's exponentially weighted daily rate,
+        ``half_life_days`` being the age at which a day's usage counts half.
+        """
+        keep = 0.5 ** (1 / half_life_days)
+        today = datetime.now(timezone.utc).date()
+        sources = ",".join("?" * len(CONSUMPTION_SOURCES))
+        history = ("SELECT old_unit, old_quantity, new_name, new_unit, new_quantity FROM inventory_history "
+                   "WHERE batch_id = ? AND user_id = ?")
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            cur = conn.cursor()
+            state = cur.execute("SELECT batch_id, start_day, folded_day FROM consumption_rollup WHERE user_id = ?",
+                                (user_id,)).fetchone()
+            if state is None:
+                first = cur.execute("SELECT MIN(created_at) FROM inventory_batches WHERE user_id = ?",
+                                    (user_id,)).fetchone()[0]
+                start = date.fromisoformat(first[:10]) if first else today
+                state = {"batch_id": 0, "start_day": start.isoformat(),
+                         "folded_day": (start - timedelta(days=1)).isoformat()}
+            cursor, folded_day = state["batch_id"], state["folded_day"]
+            days: Dict[tuple, Dict[str, Any]] = {}
+
+            def add(batch_id: int, day: str, sign: float) -> None:
+                for row in cur.execute(history, (batch_id, user_id)).fetchall():
+                    found = DatabaseManager._decrease(row)
+                    if found:
+                        key, name, amount = found
+                        days.setdefault((*key, day), {"name": name, "consumed": 0.0})["consumed"] += sign * amount
+
+            batches = cur.execute(
+                f"SELECT id, source, created_at, undone_by, source IN ({sources}) AS consumes FROM inventory_batches "
+                "WHERE user_id = ? AND id > ? ORDER BY id", (*CONSUMPTION_SOURCES, user_id, cursor)).fetchall()
+            for batch in batches:
+                if batch["consumes"] and batch["undone_by"] is None:
+                    add(batch["id"], batch["created_at"][:10], 1.0)
+                elif batch["source"] == "undo":
+                    undone = cur.execute(f"SELECT id, created_at FROM inventory_batches WHERE undone_by = ? "
+                                         f"AND id <= ? AND source IN ({sources})",
+                                         (batch["id"], cursor, *CONSUMPTION_SOURCES)).fetchone()
+                    if undone:
+                        add(undone["id"], undone["created_at"][:10], -1.0)
+            cur.executemany(
+                "INSERT INTO consumption_days (user_id, name_key, base_unit, day, name, consumed) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, name_key, base_unit, day) "
+                "DO UPDATE SET consumed = consumed + excluded.consumed",
+                [(user_id, *key, entry["name"], entry["consumed"]) for key, entry in days.items()])
+            # Rates decay once per day passed; each finished day adds its usage at its age's weight.
+            # The sum is linear, so a day that was already folded (an undo of it, or a clock
+            # step) is folded in late at the right weight rather than reopened.
+            yesterday = today - timedelta(days=1)
+            if yesterday.isoformat() > folded_day:
+                cur.execute("UPDATE consumption_ewma SET rate = rate * ? WHERE user_id = ?",
+                            (keep ** (yesterday - date.fromisoformat(folded_day)).days, user_id))
+                folded_day = yesterday.isoformat()
+            ended = cur.execute("SELECT name_key, base_unit, day, name, consumed FROM consumption_days "
+                                "WHERE user_id = ? AND day <= ?", (user_id, folded_day)).fetchall()
+            cur.executemany(
+                "INSERT INTO consumption_ewma (user_id, name_key, base_unit, name, rate) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, name_key, base_unit) DO UPDATE SET rate = max(rate + excluded.rate, 0), "
+                "name = excluded.name",
+                [(user_id, r["name_key"], r["base_unit"], r["name"],
+                  (1 - keep) * r["consumed"] * keep ** (date.fromisoformat(folded_day) - date.fromisoformat(r["day"])).days)
+                 for r in ended])
+            cur.execute("DELETE FROM consumption_days WHERE user_id = ? AND day <= ?", (user_id, folded_day))
+            cursor = batches[-1]["id"] if batches else cursor
+            cur.execute("INSERT INTO consumption_rollup (user_id, batch_id, start_day, folded_day) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (user_id) DO UPDATE SET batch_id = excluded.batch_id, "
+                        "folded_day = excluded.folded_day", (user_id, cursor, state["start_day"], folded_day))
+            conn.commit()
+        return {"batches": len(batches), "days_added": len(days), "days_folded": len(ended), "cursor": cursor}
+
+    @staticmethod
+    def smoothed_consumption(user_id: int, half_life_days: float = FORECAST_HALF_LIFE_DAYS) -> Dict[tuple, Dict[str, Any]]:
+        """Exponentially weighted usage per day from the rollup, keyed by (normalized name, base unit).
+
+        Every ingredient's average starts at zero on the rollup's first day, so
+        dividing by the weight those days carry corrects the start-up bias
+        without treating a newly used ingredient as used every day before.
+        """
+        with DatabaseManager.get_db_conn() as conn:
+            state = conn.execute("SELECT start_day, folded_day FROM consumption_rollup WHERE user_id = ?",
+                                 (user_id,)).fetchone()
+            if state is None or state["folded_day"] < state["start_day"]:
+                return {}
+            observed = (date.fromisoformat(state["folded_day"]) - date.fromisoformat(state["start_day"])).days + 1
+            weight = 1 - 0.5 ** (observed / half_life_days)
+            return {(r["name_key"], r["base_unit"]): {"name": r["name"], "per_day": r["rate"] / weight}
+                    for r in conn.execute("SELECT name_key, base_unit, name, rate FROM consumption_ewma "
+                                          "WHERE user_id = ? AND rate > 1e-12", (user_id,))}
+
+    @staticmethod
+    @retry_on_locked
+    def undo_last_inventory_batch(user_id: int) -> Dict[str, Any]:
+        """Put back the rows changed by the user's latest inventory batch that is not undone yet.
+
+        The undo is itself a batch, so it shows in history and as-of views.
+        Nothing is written if a row changed again since (``conflicts`` lists
+        it, with its current state). Restored stock comes back as one lot per
+        row, dated by the row's earliest expiry at the time. Returns
+        ``{"batch", "source", "restored", "conflicts"}``; ``batch`` is None
+        when there is nothing to undo.
+        """
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            cur = conn.cursor()
+            target = cur.execute(
+                "SELECT id, source FROM inventory_batches b WHERE user_id = ? AND undone_by IS NULL "
+                "AND source NOT IN ('undo', 'horizon') "
+                "AND EXISTS (SELECT 1 FROM inventory_history WHERE batch_id = b.id) "
+                "ORDER BY id DESC LIMIT 1", (user_id,)).fetchone()
+            result = {"batch": None, "source": None, "restored": 0, "conflicts": []}
+            if target is None:
+                return result
+            result.update(batch=target["id"], source=target["source"])
+            changes = cur.execute("SELECT * FROM inventory_history WHERE batch_id = ? AND user_id = ? "
+                                  "AND (old_name IS NOT NULL OR new_name IS NOT NULL)",
+                                  (target["id"], user_id)).fetchall()
+            for h in changes:
+                row = cur.execute("SELECT id, name, quantity, unit, version FROM inventory WHERE id = ?",
+                                  (h["inventory_id"],)).fetchone()
+                if row is None:
+                    same = h["new_name"] is None
+                else:
+                    same = ((row["name"], row["unit"]) == (h["new_name"], h["new_unit"])
+                            and abs(row["quantity"] - h["new_quantity"]) < 1e-6)
+                if not same:
+                    result["conflicts"].append({"name": h["new_name"] or h["old_name"],
+                                                "current": dict(row) if row else None})
+            if result["conflicts"]:
+                conn.rollback()
+                return result
+            undo_id = DatabaseManager._begin_batch(cur, user_id, "undo")
+            for h in changes:
+                if h["old_name"] is None:
+                    cur.execute("DELETE FROM inventory WHERE id = ?", (h["inventory_id"],))
+                elif h["new_name"] is None:
+                    cur.execute("INSERT INTO inventory (id, user_id, name, quantity, unit) VALUES (?, ?, ?, 0, ?)",
+                                (h["inventory_id"], user_id, h["old_name"], h["old_unit"]))
+                    DatabaseManager._add_lot(cur, h["inventory_id"], user_id, h["old_quantity"], h["old_expires_at"])
+                else:
+                    DatabaseManager._update_inventory_row(cur, h["inventory_id"], user_id, h["new_unit"], h["old_name"],
+                                                          h["old_quantity"], h["old_unit"], h["old_expires_at"])
+                result["restored"] += 1
+            cur.execute("UPDATE inventory_batches SET undone_by = ? WHERE id = ?", (undo_id, target["id"]))
+            conn.commit()
+        logger.info(f"undo_last_inventory_batch: user_id={user_id} undid batch {target['id']} ({target['source']})")
+        return result
+
+    @staticmethod
+    @retry_on_locked
+    def compact_inventory_history(keep_days: int = INVENTORY_HISTORY_DAYS) -> int:
+        """Shrink inventory history and return the number of rows removed.
+
+        History older than ``keep_days`` is dropped and the horizon moved up
+        to it, as are changes that left a row as it was; batches left empty
+        go too, except the newest (the one unbatched writes attach to).
+        """
+        cutoff = DatabaseManager._utc_stamp(datetime.now(timezone.utc) - timedelta(days=keep_days))
+        with DatabaseManager.get_db_conn(write=True) as conn:
             cur = conn.cursor()
-            cur.execute("SELECT id, title, category, instructions FROM recipes WHERE user_id = ?", (user_id,))
-            recipes = [dict(row) for row in cur.fetchall()]
-            for recipe in recipes:
-                cur.execute("SELECT name, quantity, unit FROM ingredients WHERE recipe_id = ?", (recipe["id"],))
-                recipe["ingredients"] = [dict(row) for row in cur.fetchall()]
-            return recipes
+            cur.execute("DELETE FROM inventory_history WHERE batch_id IN "
+                        "(SELECT id FROM inventory_batches WHERE created_at < ?)", (cutoff,))
+            removed = cur.rowcount
+            cur.execute("""
+                DELETE FROM inventory_history WHERE (old_name IS NULL AND new_name IS NULL)
+                    OR (old_name = new_name AND old_unit = new_unit AND abs(old_quantity - new_quantity) < 1e-9)
+            """)
+            removed += cur.rowcount
+            cur.execute("UPDATE inventory_batches SET created_at = max(created_at, ?) WHERE source = 'horizon'",
+                        (cutoff,))
+            cur.execute("""
+                DELETE FROM inventory_batches WHERE source != 'horizon'
+                    AND id < (SELECT MAX(id) FROM inventory_batches)
+                    AND NOT EXISTS (SELECT 1 FROM inventory_history WHERE batch_id = inventory_batches.id)
+            """)
+            conn.commit()
+        logger.info(f"compact_inventory_history: removed {removed} rows before {cutoff}")
+        return removed
+
+    @staticmethod
+    def _recipes_with_ingredients(cur, where: str, params: tuple) -> List[Recipe]:
+        # Two queries for any number of recipes, instead of one per recipe
+        rows = cur.execute(f"SELECT id, title, category, instructions, servings, version FROM recipes WHERE {where}",
+                           params).fetchall()
+        ingredients: Dict[int, List[Ingredient]] = {row["id"]: [] for row in rows}
+        for ing in cur.execute("SELECT recipe_id, name, quantity, unit, sub_recipe_id FROM ingredients "
+                               f"WHERE recipe_id IN (SELECT id FROM recipes WHERE {where}) ORDER BY id", params):
+            ingredients[ing["recipe_id"]].append(Ingredient.from_row(ing))
+        return [Recipe.from_row(row, ingredients[row["id"]]) for row in rows]
 
     @staticmethod
-    def create_recipe_from_table(user_id: int, title: str, category: str, instructions: str, ingredients: List[Dict[str, Any]], recipe_id: Optional[int] = None) -> bool:
+    def list_recipes(user_id: int) -> List[Recipe]:
         with DatabaseManager.get_db_conn() as conn:
+            return DatabaseManager._recipes_with_ingredients(conn.cursor(), "user_id = ?", (user_id,))
+
+    @staticmethod
+    def get_recipes(user_id: int, recipe_ids: List[int]) -> List[Recipe]:
+        """Load specific recipes (with ingredients); ids that no longer exist are simply absent."""
+        if not recipe_ids:
+            return []
+        with DatabaseManager.get_db_conn() as conn:
+            marks = ",".join("?" * len(recipe_ids))
+            return DatabaseManager._recipes_with_ingredients(
+                conn.cursor(), f"user_id = ? AND id IN ({marks})", (user_id, *recipe_ids))
+
+    @staticmethod
+    @retry_on_locked
+    def create_recipe_from_table(user_id: int, title: str, category: str, instructions: str, ingredients: List[Dict[str, Any]], recipe_id: Optional[int] = None, servings: Optional[float] = None, expected_version: Optional[int] = None) -> bool:
+        """Create a recipe, or replace ``recipe_id`` (only if still at ``expected_version``, when given)."""
+        try:
+            return DatabaseManager._save_recipe(user_id, title, category, instructions, ingredients, recipe_id, servings,
+                                                expected_version)
+        except sqlite3.IntegrityError:
+            logger.warning(f"create_recipe_from_table: user_id={user_id} already has a recipe titled '{title}'")
+            return False
+
+    @staticmethod
+    def _save_recipe(user_id, title, category, instructions, ingredients, recipe_id, servings,
+                     expected_version=None) -> bool:
+        with DatabaseManager.get_db_conn(write=True) as conn:
             cur = conn.cursor()
+            sub_ids = {ing["sub_recipe_id"] for ing in ingredients if ing.get("sub_recipe_id")}
+            if sub_ids:
+                owned = {r[0] for r in cur.execute(
+                    f"SELECT id FROM recipes WHERE user_id = ? AND id IN ({','.join('?' * len(sub_ids))})",
+                    (user_id, *sub_ids))}
+                if owned != sub_ids or (recipe_id and DatabaseManager._reaches(cur, sub_ids, recipe_id)):
+                    logger.warning(f"create_recipe_from_table: rejected sub-recipes {sub_ids} for recipe_id={recipe_id}")
+                    return False
+            title_key = DatabaseManager.normalize_name(title)
             if recipe_id:
-                cur.execute("UPDATE recipes SET title = ?, category = ?, instructions = ? WHERE id = ? AND user_id = ?",
-                            (title, category, instructions, recipe_id, user_id))
+                cur.execute("UPDATE recipes SET title = ?, title_key = ?, category = ?, instructions = ?, servings = COALESCE(?, servings), version = version + 1 WHERE id = ? AND user_id = ? AND version = COALESCE(?, version)",
+                            (title, title_key, category, instructions, servings, recipe_id, user_id, expected_version))
                 if cur.rowcount == 0:
                     return False
-                cur.execute("DELETE FROM ingredients WHERE recipe_id = ?", (recipe_id,))
             else:
-                cur.execute("INSERT INTO recipes (user_id, title, category, instructions) VALUES (?, ?, ?, ?)",
-                            (user_id, title, category, instructions))
+                cur.execute("INSERT INTO recipes (user_id, title, title_key, category, instructions, servings) VALUES (?, ?, ?, ?, ?, ?)",
+                            (user_id, title, title_key, category, instructions, servings or 1))
                 recipe_id = cur.lastrowid
-            for ing in ingredients:
-                cur.execute("INSERT INTO ingredients (recipe_id, name, quantity, unit) VALUES (?, ?, ?, ?)",
-                            (recipe_id, ing["name"], ing["quantity"], ing["unit"]))
+            DatabaseManager._replace_ingredients(cur, {recipe_id: [
+                (ing["name"], ing["quantity"], ing["unit"], ing.get("sub_recipe_id")) for ing in ingredients]})
             conn.commit()
             return True
 
     @staticmethod
-    def delete_recipe(recipe_id: int) -> bool:
+    def _replace_ingredients(cur, rows_by_id: Dict[int, List[tuple]]) -> None:
+        """Make each recipe's ingredient lines ``(name, quantity, unit, sub_recipe_id)``, in order.
+
+        Lines are paired with the stored ones by position and only differences
+        are written: an edit updates rows in place instead of deleting and
+        reinserting every line, which churned rowids and left free pages.
+        """
+        ids = list(rows_by_id)
+        stored: Dict[int, list] = {recipe_id: [] for recipe_id in ids}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for row in cur.execute("SELECT id, recipe_id, name, quantity, unit, sub_recipe_id FROM ingredients "
+                                   f"WHERE recipe_id IN ({','.join('?' * len(chunk))}) ORDER BY id", chunk):
+                stored[row["recipe_id"]].append(row)
+        updates, deletes, inserts = [], [], []
+        for recipe_id, rows in rows_by_id.items():
+            old = stored[recipe_id]
+            updates.extend((*new, row["id"]) for row, new in zip(old, rows)
+                           if (row["name"], row["quantity"], row["unit"], row["sub_recipe_id"]) != tuple(new))
+            deletes.extend((row["id"],) for row in old[len(rows):])
+            inserts.extend((recipe_id, *new) for new in rows[len(old):])
+        cur.executemany("UPDATE ingredients SET name = ?, quantity = ?, unit = ?, sub_recipe_id = ? WHERE id = ?", updates)
+        cur.executemany("DELETE FROM ingredients WHERE id = ?", deletes)
+        cur.executemany("INSERT INTO ingredients (recipe_id, name, quantity, unit, sub_recipe_id) VALUES (?, ?, ?, ?, ?)",
+                        inserts)
+
+    @staticmethod
+    @retry_on_locked
+    def upsert_recipes(user_id: int, recipes: List[Dict[str, Any]], update_existing: bool = False) -> List[Dict[str, Any]]:
+        """Save many recipes (``title``, ``category``, ``instructions``, ``servings``,
+        ``ingredients``) in one transaction.
+
+        Returns one ``{title, status, id, reason}`` per input, in order. ``status``
+        is ``created``, ``updated``, ``duplicate`` (title already taken and
+        ``update_existing`` is off), ``conflict`` (a ``version`` was given and
+        the stored recipe has moved past it) or ``invalid`` (see ``reason``).
+        """
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            outcomes = DatabaseManager._upsert_recipes(conn.cursor(), user_id, recipes, update_existing)
+            conn.commit()
+        counts: Dict[str, int] = {}
+        for outcome in outcomes:
+            counts[outcome["status"]] = counts.get(outcome["status"], 0) + 1
+        logger.info(f"upsert_recipes: user_id={user_id} {counts}")
+        return outcomes
+
+    @staticmethod
+    def _upsert_recipes(cur, user_id: int, recipes: List[Dict[str, Any]], update_existing: bool) -> List[Dict[str, Any]]:
+        linked = {ing["sub_recipe_id"] for r in recipes for ing in r.get("ingredients") or [] if ing.get("sub_recipe_id")}
+        owned = set()
+        linked_list = list(linked)
+        for start in range(0, len(linked_list), 500):
+            chunk = linked_list[start:start + 500]
+            owned.update(r[0] for r in cur.execute(
+                f"SELECT id FROM recipes WHERE user_id = ? AND id IN ({','.join('?' * len(chunk))})", (user_id, *chunk)))
+        outcomes: List[Dict[str, Any]] = []
+        rows_by_id: Dict[int, list] = {}
+        links_by_id: Dict[int, set] = {}
+        for recipe in recipes:
+            title = (recipe.get("title") or "").strip()
+            outcome = {"title": title, "status": "invalid", "id": None, "reason": None}
+            outcomes.append(outcome)
+            try:
+                rows = [(ing["name"], float(ing["quantity"]), ing["unit"], ing.get("sub_recipe_id"))
+                        for ing in recipe.get("ingredients") or []]
+            except (KeyError, TypeError, ValueError) as e:
+                outcome["reason"] = f"bad ingredient: {e}"
+                continue
+            links = {row[3] for row in rows if row[3]}
+            if not title:
+                outcome["reason"] = "missing title"
+                continue
+            if links - owned:
+                outcome["reason"] = "unknown sub-recipe"
+                continue
+            title_key = DatabaseManager.normalize_name(title)
+            cur.execute("INSERT INTO recipes (user_id, title, title_key, category, instructions, servings) "
+                        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, title_key) DO NOTHING",
+                        (user_id, title, title_key, recipe.get("category"), recipe.get("instructions"),
+                         recipe.get("servings") or 1))
+            if cur.rowcount:
+                recipe_id = cur.lastrowid
+                outcome["status"] = "created"
+            else:
+                recipe_id = cur.execute("SELECT id FROM recipes WHERE user_id = ? AND title_key = ?",
+                                        (user_id, title_key)).fetchone()[0]
+                outcome["id"] = recipe_id
+                if not update_existing:
+                    outcome["status"] = "duplicate"
+                    continue
+                # Links given earlier in this batch count as well as stored ones
+                if links and DatabaseManager._reaches(cur, links, recipe_id, links_by_id):
+                    outcome["reason"] = "sub-recipe cycle"
+                    continue
+                cur.execute("UPDATE recipes SET title = ?, category = ?, instructions = ?, "
+                            "servings = COALESCE(?, servings), version = version + 1 WHERE id = ? AND version = COALESCE(?, version)",
+                            (title, recipe.get("category"), recipe.get("instructions"), recipe.get("servings"), recipe_id,
+                             recipe.get("version")))
+                if not cur.rowcount:
+                    outcome["status"] = "conflict"
+                    outcome["reason"] = f"changed since version {recipe.get('version')}"
+                    continue
+                outcome["status"] = "updated"
+            outcome["id"] = recipe_id
+            rows_by_id[recipe_id] = rows
+            links_by_id[recipe_id] = links
+        DatabaseManager._replace_ingredients(cur, rows_by_id)
+        return outcomes
+
+    @staticmethod
+    def _reaches(cur, start_ids, target_id: int, pending: Optional[Dict[int, set]] = None) -> bool:
+        """True if ``target_id`` is reachable from ``start_ids`` through sub-recipe links.
+
+        ``pending`` maps recipe ids to the sub-recipe links they are about to get,
+        overriding what is stored for them.
+        """
+        pending = pending or {}
+        seen, frontier = set(), set(start_ids)
+        while frontier:
+            if target_id in frontier:
+                return True
+            seen |= frontier
+            stored = [rid for rid in frontier if rid not in pending]
+            following = set().union(*(pending[rid] for rid in frontier if rid in pending))
+            if stored:
+                marks = ",".join("?" * len(stored))
+                following.update(r[0] for r in cur.execute(
+                    f"SELECT DISTINCT sub_recipe_id FROM ingredients WHERE sub_recipe_id IS NOT NULL AND recipe_id IN ({marks})",
+                    stored))
+            frontier = following - seen
+        return False
+
+    @staticmethod
+    def would_create_cycle(recipe_id: Optional[int], sub_recipe_ids: List[int]) -> bool:
+        if not recipe_id or not sub_recipe_ids:
+            return False
         with DatabaseManager.get_db_conn() as conn:
+            return DatabaseManager._reaches(conn.cursor(), set(sub_recipe_ids), recipe_id)
+
+    @staticmethod
+    @retry_on_locked
+    def delete_recipe(recipe_id: int, expected_version: Optional[int] = None) -> bool:
+        with DatabaseManager.get_db_conn(write=True) as conn:
             cur = conn.cursor()
+            if expected_version is not None:
+                row = cur.execute("SELECT version FROM recipes WHERE id = ?", (recipe_id,)).fetchone()
+                if not row or row[0] != expected_version:
+                    return False
             cur.execute("DELETE FROM ingredients WHERE recipe_id = ?", (recipe_id,))
+            # Recipes using this one keep the line as a plain ingredient
+            cur.execute("UPDATE recipes SET version = version + 1 WHERE id IN "
+                        "(SELECT recipe_id FROM ingredients WHERE sub_recipe_id = ?)", (recipe_id,))
+            cur.execute("UPDATE ingredients SET sub_recipe_id = NULL WHERE sub_recipe_id = ?", (recipe_id,))
             cur.execute("DELETE FROM recipes WHERE id = ?", (recipe_id,))
             conn.commit()
             return cur.rowcount > 0
 
     @staticmethod
-    def get_recipe_by_title(user_id: int, title: str) -> Optional[Dict[str, Any]]:
+    def get_recipe_by_title(user_id: int, title: str) -> Optional[Recipe]:
+        with DatabaseManager.get_db_conn() as conn:
+            recipes = DatabaseManager._recipes_with_ingredients(conn.cursor(), "user_id = ? AND title = ?", (user_id, title))
+            return recipes[0] if recipes else None
+
+    @staticmethod
+    @retry_on_locked
+    def record_price(user_id: int, name: str, price: float, quantity: float, unit: str,
+                     observed_at: Optional[str] = None) -> bool:
+        """Record that ``quantity`` ``unit`` of ``name`` cost ``price`` in total."""
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            recorded = DatabaseManager._record_price(conn.cursor(), user_id, name, price, quantity, unit, observed_at)
+            conn.commit()
+        return recorded
+
+    @staticmethod
+    def _record_price(cur, user_id: int, name: str, price: float, quantity: float, unit: str,
+                      observed_at: Optional[str] = None) -> bool:
+        base_qty, base_unit = to_base(quantity, unit)
+        if price < 0 or base_qty <= 0:
+            return False
+        cur.execute(
+            "INSERT INTO ingredient_prices (user_id, name_key, base_unit, unit_price, observed_at) "
+            "VALUES (?, ?, ?, ?, COALESCE(?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now')))",
+            (user_id, DatabaseManager.normalize_name(name), base_unit, float(price) / base_qty, observed_at))
+        return True
+
+    @staticmethod
+    def current_prices(user_id: int) -> Dict[tuple, float]:
+        """Latest price per base unit, keyed like inventory and recipe vectors: (normalized name, base unit)."""
+        with DatabaseManager.get_db_conn() as conn:
+            # SQLite returns the other columns from the row holding MAX(observed_at)
+            rows = conn.execute("SELECT name_key, base_unit, unit_price, MAX(observed_at) FROM ingredient_prices "
+                                "WHERE user_id = ? GROUP BY name_key, base_unit", (user_id,))
+            return {(r[0], r[1]): r[2] for r in rows}
+
+    @staticmethod
+    def price_history(user_id: int, name: str) -> List[Dict[str, Any]]:
+        with DatabaseManager.get_db_conn() as conn:
+            rows = conn.execute("SELECT base_unit, unit_price, observed_at FROM ingredient_prices "
+                                "WHERE user_id = ? AND name_key = ? ORDER BY observed_at",
+                                (user_id, DatabaseManager.normalize_name(name)))
+            return [dict(r) for r in rows]
+
+    @staticmethod
+    def current_seq() -> int:
+        """Highest change-journal sequence number handed out so far."""
         with DatabaseManager.get_db_conn() as conn:
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+            return row[0] if row else 0
+
+    @staticmethod
+    def data_version(user_id: int) -> int:
+        """Sequence of the user's latest change; equal values mean nothing of theirs changed."""
+        with DatabaseManager.get_db_conn() as conn:
+            row = conn.execute("SELECT MAX(seq) FROM change_log WHERE user_id = ?", (user_id,)).fetchone()
+            return row[0] or 0
+
+    @staticmethod
+    def oldest_seq() -> int:
+        """Lowest sequence still in the journal; cursors below ``oldest_seq() - 1`` missed compacted entries."""
+        with DatabaseManager.get_db_conn() as conn:
+            row = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()
+            return row[0] if row and row[0] is not None else DatabaseManager.current_seq() + 1
+
+    @staticmethod
+    def changes_since(seq: int, user_id: Optional[int] = None, entities: Optional[List[str]] = None,
+                      limit: int = 1000) -> List[Dict[str, Any]]:
+        """Journal entries after ``seq`` in order, optionally for one user and some entities."""
+        sql = "SELECT seq, entity, row_id, user_id, parent_id, op, changed_at FROM change_log WHERE seq > ?"
+        params: List[Any] = [seq]
+        if user_id is not None:
+            sql += " AND user_id = ?"
+            params.append(user_id)
+        if entities:
+            sql += f" AND entity IN ({','.join('?' * len(entities))})"
+            params.extend(entities)
+        sql += " ORDER BY seq LIMIT ?"
+        params.append(limit)
+        with DatabaseManager.get_db_conn() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    @staticmethod
+    def get_cursor(consumer: str) -> Optional[int]:
+        with DatabaseManager.get_db_conn() as conn:
+            row = conn.execute("SELECT seq FROM change_cursors WHERE consumer = ?", (consumer,)).fetchone()
+            return row[0] if row else None
+
+    @staticmethod
+    @retry_on_locked
+    def save_cursor(consumer: str, seq: int) -> None:
+        """Persist a consumer's position; compaction never drops entries it has not read."""
+        with DatabaseManager.get_db_conn(write=True) as conn:
+            conn.execute("INSERT INTO change_cursors (consumer, seq) VALUES (?, ?) "
+                         "ON CONFLICT(consumer) DO UPDATE SET seq = excluded.seq", (consumer, seq))
+            conn.commit()
+
+    @staticmethod
+    @retry_on_locked
+    def compact_change_log(before_seq: Optional[int] = None) -> int:
+        """Shrink the journal and return the number of entries removed.
+
+        Entries every registered consumer has read (or all entries up to
+        ``before_seq``) are dropped; among the rest, repeated changes to the
+        same row collapse to the newest one, which is all consumers act on.
+        Deletes stay distinguishable because the newest entry keeps its op.
+        """
+        with DatabaseManager.get_db_conn(write=True) as conn:
             cur = conn.cursor()
-            cur.execute(
-                "SELECT id, title, category, instructions FROM recipes WHERE user_id = ? AND title = ?",
-                (user_id, title)
-            )
-            recipe = cur.fetchone()
-            if recipe:
-                recipe_dict = dict(recipe)
-                cur.execute("SELECT name, quantity, unit FROM ingredients WHERE recipe_id = ?", (recipe_dict["id"],))
-                recipe_dict["ingredients"] = [dict(row) for row in cur.fetchall()]
-                return recipe_dict
-            return None
+            if before_seq is None:
+                row = cur.execute("SELECT MIN(seq) FROM change_cursors").fetchone()
+                before_seq = row[0] if row and row[0] is not None else 0
+            cur.execute("DELETE FROM change_log WHERE seq <= ?", (before_seq,))
+            removed = cur.rowcount
+            cur.execute("""
+                DELETE FROM change_log WHERE seq NOT IN (
+                    SELECT MAX(seq) FROM change_log GROUP BY entity, row_id
+                )
+            """)
+            removed += cur.rowcount
+            conn.commit()
+        logger.info(f"compact_change_log: removed {removed} entries up to seq {before_seq}")
+        return removed
 
     @staticmethod
     def validate_name(name: str) -> bool:
@@ -152,46 +1186,302 @@ class DatabaseManager:
     
     
 
-conn = sqlite3.connect("ruaden.db")
-cursor = conn.cursor()
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        security_question TEXT NOT NULL,
-        security_answer TEXT NOT NULL
-    )
-""")
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS recipes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        title TEXT NOT NULL,
-        category TEXT,
-        instructions TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )
-""")
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS ingredients (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        recipe_id INTEGER,
-        name TEXT NOT NULL,
-        quantity REAL NOT NULL,
-        unit TEXT NOT NULL,
-        FOREIGN KEY (recipe_id) REFERENCES recipes(id)
-    )
-""")
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS inventory (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        name TEXT NOT NULL,
-        quantity REAL NOT NULL,
-        unit TEXT NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )
-""")
-conn.commit()
-conn.close()
\ No newline at end of file
+def add_column_if_missing(cur, table: str, column: str, decl: str) -> None:
+    """Additive schema migration for databases created by older versions."""
+    if column not in {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+# Row changes are recorded by triggers so every writer, including ad-hoc SQL, is tracked.
+# Each table maps to the expressions yielding the owning user and the parent row
+# (the recipe, for ingredients, the inventory row, for lots) of a NEW/OLD row.
+# Listed parents before children.
+TRACKED_TABLES = {
+    "users": ("{row}.id", "NULL"),
+    "pantry_members": ("{row}.pantry_id", "NULL"),
+    "recipes": ("{row}.user_id", "NULL"),
+    "ingredients": ("(SELECT user_id FROM recipes WHERE id = {row}.recipe_id)", "{row}.recipe_id"),
+    "inventory": ("{row}.user_id", "NULL"),
+    "inventory_lots": ("{row}.user_id", "{row}.inventory_id"),
+    "ingredient_prices": ("{row}.user_id", "NULL"),
+}
+# Inventory history batch sources whose decreases count as using stock up
+CONSUMPTION_SOURCES = ("consume", "edit")
+_NEXT_EXPIRY = "(SELECT MIN(expires_at) FROM inventory_lots WHERE inventory_id = {row}.inventory_id AND quantity > 0)"
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def _create_schema(cursor) -> None:
+    """Create missing tables, apply additive migrations and (re)create triggers."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            security_question TEXT NOT NULL,
+            security_answer TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS recipes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT NOT NULL,
+            category TEXT,
+            instructions TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingredients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipe_id INTEGER,
+            name TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            unit TEXT NOT NULL,
+            FOREIGN KEY (recipe_id) REFERENCES recipes(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            unit TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            user_id INTEGER,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+        )
+    """)
+    add_column_if_missing(cursor, "change_log", "parent_id", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_log_user_seq ON change_log (user_id, seq)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_cursors (
+            consumer TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    """)
+    # Inventory is held as lots (one per purchase, with optional expiry) in the unit of
+    # their inventory row. inventory.quantity and inventory.next_expires_at are a rollup
+    # of the row's lots, kept current by the triggers below so totals stay a single read.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_lots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inventory_id INTEGER NOT NULL,
+            user_id INTEGER,
+            quantity REAL NOT NULL,
+            purchased_at TEXT,
+            expires_at TEXT,
+            FOREIGN KEY (inventory_id) REFERENCES inventory(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    add_column_if_missing(cursor, "inventory", "next_expires_at", "TEXT")
+    # Bumped by every write to the row (including its lots), for optimistic concurrency
+    # checks when several members of a pantry edit the inventory at once
+    add_column_if_missing(cursor, "inventory", "version", "INTEGER NOT NULL DEFAULT 1")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_lots_user_expiry ON inventory_lots (user_id, expires_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_lots_item_expiry ON inventory_lots (inventory_id, expires_at)")
+    for op, row, delta in (("INSERT", "NEW", "NEW.quantity"),
+                           ("UPDATE", "NEW", "NEW.quantity - OLD.quantity"),
+                           ("DELETE", "OLD", "-OLD.quantity")):
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_inventory_lots_{op.lower()}_rollup")
+        cursor.execute(f"""
+            CREATE TRIGGER trg_inventory_lots_{op.lower()}_rollup AFTER {op} ON inventory_lots
+            BEGIN
+                UPDATE inventory SET quantity = quantity + ({delta}),
+                                     next_expires_at = {_NEXT_EXPIRY.format(row=row)},
+                                     version = version + 1
+                WHERE id = {row}.inventory_id;
+            END
+        """)
+    cursor.execute("DROP TRIGGER IF EXISTS trg_inventory_delete_lots")
+    cursor.execute("""
+        CREATE TRIGGER trg_inventory_delete_lots AFTER DELETE ON inventory
+        BEGIN
+            DELETE FROM inventory_lots WHERE inventory_id = OLD.id;
+        END
+    """)
+    # Inventory history: every transaction that changes stock opens a batch (its source says
+    # why), and triggers keep one row per batch and inventory row holding the row's state
+    # before the batch's first change and after its last, so history costs one small write
+    # per row touched. Writes outside DatabaseManager join the newest batch. The oldest
+    # 'horizon' batch marks how far back history reaches (moved up by compaction).
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            source TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+            undone_by INTEGER
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_batches_user ON inventory_batches (user_id, id)")
+    # As-of views, usage rates and compaction find their starting batch by time
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_batches_created ON inventory_batches (created_at)")
+    cursor.execute("INSERT INTO inventory_batches (source) SELECT 'horizon' "
+                   "WHERE NOT EXISTS (SELECT 1 FROM inventory_batches WHERE source = 'horizon')")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_history (
+            batch_id INTEGER NOT NULL,
+            inventory_id INTEGER NOT NULL,
+            user_id INTEGER,
+            old_name TEXT,
+            old_unit TEXT,
+            old_quantity REAL,
+            old_expires_at TEXT,
+            new_name TEXT,
+            new_unit TEXT,
+            new_quantity REAL,
+            PRIMARY KEY (batch_id, inventory_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_history_user ON inventory_history (user_id, batch_id)")
+    for op, when, old, new in (
+            ("INSERT", "", "NULL, NULL, NULL, NULL", "NEW.name, NEW.unit, NEW.quantity"),
+            ("UPDATE", "WHEN OLD.quantity IS NOT NEW.quantity OR OLD.name IS NOT NEW.name OR OLD.unit IS NOT NEW.unit",
+             "OLD.name, OLD.unit, OLD.quantity, OLD.next_expires_at", "NEW.name, NEW.unit, NEW.quantity"),
+            ("DELETE", "", "OLD.name, OLD.unit, OLD.quantity, OLD.next_expires_at", "NULL, NULL, NULL")):
+        row = "OLD" if op == "DELETE" else "NEW"
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_inventory_{op.lower()}_history")
+        cursor.execute(f"""
+            CREATE TRIGGER trg_inventory_{op.lower()}_history AFTER {op} ON inventory {when}
+            BEGIN
+                INSERT INTO inventory_history (batch_id, inventory_id, user_id, old_name, old_unit, old_quantity,
+                                               old_expires_at, new_name, new_unit, new_quantity)
+                VALUES ((SELECT MAX(id) FROM inventory_batches), {row}.id, {row}.user_id, {old}, {new})
+                ON CONFLICT (batch_id, inventory_id) DO UPDATE SET
+                    new_name = excluded.new_name, new_unit = excluded.new_unit, new_quantity = excluded.new_quantity;
+            END
+        """)
+    # Forecasting rollup (DatabaseManager.update_consumption_rollup): usage per ingredient and
+    # day in base units, folded into an exponentially weighted daily rate once the day is
+    # over, plus each user's position in the inventory history so updates never rescan it
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS consumption_rollup (
+            user_id INTEGER PRIMARY KEY,
+            batch_id INTEGER NOT NULL,
+            start_day TEXT NOT NULL,
+            folded_day TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS consumption_days (
+            user_id INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            base_unit TEXT NOT NULL,
+            day TEXT NOT NULL,
+            name TEXT NOT NULL,
+            consumed REAL NOT NULL,
+            PRIMARY KEY (user_id, name_key, base_unit, day)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS consumption_ewma (
+            user_id INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            base_unit TEXT NOT NULL,
+            name TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (user_id, name_key, base_unit)
+        ) WITHOUT ROWID
+    """)
+    # maintenance.py: one row per run with its report (JSON); NULL while a claimed run is going
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            seconds REAL,
+            report TEXT
+        )
+    """)
+    add_column_if_missing(cursor, "recipes", "servings", "REAL NOT NULL DEFAULT 1")
+    # Bumped on every edit so derived caches (e.g. flattened sub-recipe trees) can tell stale entries apart
+    add_column_if_missing(cursor, "recipes", "version", "INTEGER NOT NULL DEFAULT 1")
+    # An ingredient may stand for `quantity` servings of another recipe of the same user
+    add_column_if_missing(cursor, "ingredients", "sub_recipe_id", "INTEGER REFERENCES recipes(id)")
+    # Normalized title (DatabaseManager.normalize_name) for duplicate detection. It is kept
+    # in a column because SQLite's lower() only folds ASCII, so "ĐẬU" and "đậu" would differ.
+    add_column_if_missing(cursor, "recipes", "title_key", "TEXT")
+    unkeyed = cursor.execute("SELECT id, user_id, title FROM recipes WHERE title_key IS NULL ORDER BY id").fetchall()
+    if unkeyed:
+        taken = set(cursor.execute("SELECT user_id, title_key FROM recipes WHERE title_key IS NOT NULL"))
+        keys = []
+        for recipe_id, user_id, title in unkeyed:
+            key = (user_id, DatabaseManager.normalize_name(title))
+            if key in taken:
+                # Older duplicates keep a NULL key (allowed by the index) until renamed
+                logger.warning(f"init_db: recipe id={recipe_id} duplicates title '{title}' of user_id={user_id}")
+                continue
+            taken.add(key)
+            keys.append((key[1], recipe_id))
+        cursor.executemany("UPDATE recipes SET title_key = ? WHERE id = ?", keys)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_recipes_user_title_key ON recipes (user_id, title_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingredients_recipe ON ingredients (recipe_id)")
+    # Price history: one row per purchase or manual entry, as currency per base unit
+    # (g, ml, piece, ...) so any unit of the same dimension can be costed.
+    # The newest row per ingredient is its current price.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingredient_prices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            base_unit TEXT NOT NULL,
+            unit_price REAL NOT NULL,
+            observed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingredient_prices_lookup "
+                   "ON ingredient_prices (user_id, name_key, base_unit, observed_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingredients_sub_recipe ON ingredients (sub_recipe_id)")
+    # An account joining another's pantry (see DatabaseManager.pantry_of); at most one each
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pantry_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE,
+            pantry_id INTEGER NOT NULL,
+            joined_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (pantry_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pantry_members_pantry ON pantry_members (pantry_id)")
+    # Only a hash of each invite code is stored
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pantry_invites (
+            code_hash TEXT PRIMARY KEY,
+            pantry_id INTEGER NOT NULL,
+            expires_at TEXT NOT NULL,
+            FOREIGN KEY (pantry_id) REFERENCES users(id)
+        )
+    """)
+    for table, (owner, parent) in TRACKED_TABLES.items():
+        for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            # Recreated on start-up so trigger bodies follow the code
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{op.lower()}_log")
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{table}_{op.lower()}_log AFTER {op} ON {table}
+                BEGIN
+                    INSERT INTO change_log (entity, row_id, user_id, parent_id, op)
+                    VALUES ('{table}', {row}.id, {owner.format(row=row)}, {parent.format(row=row)}, '{op[0]}');
+                END
+            """)
+    # Rows from before lots existed (or written by raw SQL) get one undated lot for their stock
+    legacy = [r[0] for r in cursor.execute(
+        "SELECT id FROM inventory WHERE quantity > 0 AND NOT EXISTS "
+        "(SELECT 1 FROM inventory_lots WHERE inventory_id = inventory.id)")]
+    if legacy:
+        cursor.executemany(
+            "INSERT INTO inventory_lots (inventory_id, user_id, quantity) "
+            "SELECT id, user_id, quantity FROM inventory WHERE id = ?", [(i,) for i in legacy])
+        DatabaseManager.rebuild_inventory_rollup(cursor, legacy)
@@ -0,0 +1,306 @@
+"""Differential checks of the optimized engines against the plain reference code.
+
+Random pantries (mixed units and aliases, name spellings that normalize
+together, duplicate lines, nested sub-recipes, stock exactly at the need) are
+saved to a scratch database, then every engine is run on them and compared
+with ``business_logic.recipe_feasibility``, which expands each recipe with
+``expand_ingredients`` and converts with ``utils.to_base`` on every call:
+
+- ``table``: ``feasibility_table`` from a cold vector cache
+- ``incremental``: ``feasibility_table`` again after random recipe edits, on a warm cache
+- ``cycle``: both of the above on recipes with an injected sub-recipe cycle
+- ``job``: ``jobs.feasibility_job``, reading through the shared snapshots
+- ``consume``: ``consume_ingredients_for_recipe`` succeeds exactly when feasible, takes
+  exactly the reference requirement from each ingredient's stock, and changes nothing when it fails
+- ``nutrition``: cached ``recipe_nutrition`` against a direct sum over expanded lines
+- ``units``: ``to_base``/``from_base`` round trips for every unit alias
+
+Feasibility flags must be identical and shortfalls (per ingredient and base
+unit) equal within tolerance. Run ``python differential.py --cases 200`` after
+touching any of these paths; a failure prints the seed that reproduces it.
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+NAMES = ["chicken", "Chicken ", "gạo", "Gạo", "nước mắm", "egg", "salt", "tỏi", "sugar", "milk", "bơ", "hành lá"]
+UNITS = {
+    "g": ["g", "kg", "lạng", "gram"],
+    "ml": ["ml", "l", "tsp", "tbsp", "cup", "chén", "bát"],
+    "piece": ["piece", "pcs", "cái"],
+}
+SERVING_UNITS = ["serving", "servings", "portion", "phần"]
+FACTORS = [0.5, 1.0, 2.0, 3.0, 1 / 3, 1.7]
+REL_TOL = 1e-9
+ABS_TOL = 1e-9
+
+Outcome = Tuple[bool, Dict[Tuple[str, str], float]]  # feasible, shortfall in base units per key
+
+def _quantity(rng: random.Random) -> float:
+    return rng.choice([round(rng.uniform(0.1, 500), 1), float(rng.randint(1, 12)), rng.uniform(0.01, 3), 0.1 * 3])
+
+def _line(rng: random.Random) -> Dict[str, Any]:
+    return {"name": rng.choice(NAMES), "quantity": _quantity(rng), "unit": rng.choice(UNITS[rng.choice(list(UNITS))])}
+
+def random_pantry(rng: random.Random, recipes: int = 12) -> Tuple[List[List[Dict]], List[Dict]]:
+    """Recipes in layers (each may use recipes of earlier layers) and inventory lots."""
+    layers: List[List[Dict]] = []
+    made = 0
+    while made < recipes:
+        layer = []
+        for _ in range(min(rng.randint(1, 5), recipes - made)):
+            lines = [_line(rng) for _ in range(rng.randint(1, 6))]
+            if rng.random() < 0.3:
+                lines.append(dict(rng.choice(lines)))  # the same ingredient twice
+            layer.append({"title": f"Recipe {made}", "servings": rng.choice([1, 2, 3, 4, 0.5, 1.5]),
+                          "ingredients": lines, "sub_titles": []})
+            if layers and rng.random() < 0.5:
+                layer[-1]["sub_titles"] = [rng.choice(rng.choice(layers))["title"] for _ in range(rng.randint(1, 2))]
+            made += 1
+        layers.append(layer)
+    lots = [_line(rng) for _ in range(rng.randint(0, 15))]
+    for layer in layers:
+        for recipe in layer:
+            # Stock exactly at a line's quantity, under another alias of the unit, probes the comparisons' edges
+            if rng.random() < 0.4:
+                line = rng.choice(recipe["ingredients"])
+                lots.append(dict(line, unit=rng.choice(next(u for u in UNITS.values() if line["unit"] in u))))
+            # and a well-stocked recipe now and then gives feasible results to compare
+            if rng.random() < 0.3:
+                lots.extend(dict(line, quantity=line["quantity"] * rng.choice([1, 4, 20])) for line in recipe["ingredients"])
+    return layers, lots
+
+def _close(a: float, b: float) -> bool:
+    return math.isclose(a, b, rel_tol=REL_TOL, abs_tol=ABS_TOL)
+
+def compare(expected: Dict[int, Outcome], actual: Dict[int, Outcome], engine: str) -> List[str]:
+    problems = []
+    for rid, (feasible, shortfall) in expected.items():
+        if rid not in actual:
+            problems.append(f"{engine}: recipe {rid} missing")
+            continue
+        got_feasible, got_shortfall = actual[rid]
+        if got_feasible != feasible:
+            problems.append(f"{engine}: recipe {rid} feasible={got_feasible}, reference says {feasible}")
+        for key in shortfall.keys() | got_shortfall.keys():
+            want, got = shortfall.get(key, 0.0), got_shortfall.get(key, 0.0)
+            if not _close(want, got):
+                problems.append(f"{engine}: recipe {rid} {key} short {got!r}, reference says {want!r}")
+    return problems
+
+def reference_outcomes(recipes: List[Dict], user_id: int, factor: float,
+                       by_id: Optional[Dict[int, Dict]] = None) -> Dict[int, Outcome]:
+    from business_logic import recipe_feasibility
+    from database import DatabaseManager
+    by_id = by_id if by_id is not None else {r["id"]: r for r in recipes}
+    outcomes = {}
+    for recipe in recipes:
+        feasible, shorts = recipe_feasibility(recipe, user_id, factor, by_id)
+        shortfall: Dict[Tuple[str, str], float] = {}
+        for s in shorts:
+            key = (DatabaseManager.normalize_name(s["name"]), s["base_unit"])
+            shortfall[key] = shortfall.get(key, 0.0) + s["missing_base"]
+        outcomes[recipe["id"]] = (feasible, shortfall)
+    return outcomes
+
+def reference_requirement(recipe: Dict, by_id: Dict[int, Dict], factor: float) -> Dict[Tuple[str, str], float]:
+    """What cooking ``recipe`` should take from stock, in base units per key."""
+    from business_logic import expand_ingredients
+    from database import DatabaseManager
+    from utils import to_base
+    need: Dict[Tuple[str, str], float] = {}
+    for line in expand_ingredients(recipe, by_id):
+        base_qty, base_unit = to_base(float(line["quantity"]) * factor, line["unit"])
+        key = (DatabaseManager.normalize_name(line["name"]), base_unit)
+        need[key] = need.get(key, 0.0) + base_qty
+    return need
+
+def table_outcomes(results: List[Dict]) -> Dict[int, Outcome]:
+    return {r["recipe"]["id"]: (r["feasible"], {m["key"]: m["missing_base"] for m in r["missing"]}) for r in results}
+
+def _save(user_id: int, layers: List[List[Dict]]) -> None:
+    from database import DatabaseManager
+    ids: Dict[str, int] = {}
+    for layer in layers:
+        batch = []
+        for recipe in layer:
+            subs = [{"name": title, "quantity": round(random.Random(title).uniform(0.5, 3), 2),
+                     "unit": SERVING_UNITS[len(title) % len(SERVING_UNITS)], "sub_recipe_id": ids[title]}
+                    for title in recipe["sub_titles"]]
+            batch.append({"title": recipe["title"], "servings": recipe["servings"],
+                          "ingredients": recipe["ingredients"] + subs})
+        for recipe, outcome in zip(layer, DatabaseManager.upsert_recipes(user_id, batch)):
+            ids[recipe["title"]] = outcome["id"]
+
+def _edit(rng: random.Random, user_id: int, recipes: List[Dict]) -> None:
+    """Change a few recipes in the database (new versions), keeping their sub-recipe links."""
+    from database import DatabaseManager
+    edited = []
+    for recipe in rng.sample(recipes, max(1, len(recipes) // 4)):
+        lines = [dict(ing) for ing in recipe["ingredients"]]
+        plain = [ing for ing in lines if not ing.get("sub_recipe_id")]
+        if plain:
+            rng.choice(plain)["quantity"] = _quantity(rng)
+        if rng.random() < 0.5:
+            lines.append(_line(rng))
+        edited.append({"title": recipe["title"], "servings": recipe["servings"], "ingredients": lines})
+    DatabaseManager.upsert_recipes(user_id, edited, update_existing=True)
+
+def _with_cycle(rng: random.Random, recipes: List[Dict]) -> Optional[List[Dict]]:
+    """Copies of ``recipes`` where a sub-recipe also uses its parent (the database refuses to store this)."""
+    parents = [r for r in recipes if any(i.get("sub_recipe_id") for i in r["ingredients"])]
+    if not parents:
+        return None
+    parent = rng.choice(parents)
+    child_id = rng.choice([i["sub_recipe_id"] for i in parent["ingredients"] if i.get("sub_recipe_id")])
+    copies = []
+    for r in recipes:
+        # Without a version, vectors are cached by ingredient-list content, as for recipes built in code
+        copy = {k: v for k, v in r.items() if k != "version"}
+        copy["ingredients"] = [dict(i) for i in r["ingredients"]]
+        if r["id"] == child_id:
+            copy["ingredients"].append({"name": parent["title"], "quantity": 1.0, "unit": "serving",
+                                        "sub_recipe_id": parent["id"]})
+        copies.append(copy)
+    return copies
+
+def check_feasibility(rng: random.Random, user_id: int, layers: List[List[Dict]], lots: List[Dict]) -> List[str]:
+    import business_logic
+    from business_logic import consume_ingredients_for_recipe, feasibility_table, inventory_as_base
+    from database import DatabaseManager
+    from jobs import feasibility_job
+    _save(user_id, layers)
+    if lots:
+        DatabaseManager.add_inventory_lots(user_id, lots)
+    problems = []
+    factor = rng.choice(FACTORS)
+    recipes = [r.as_dict() for r in DatabaseManager.list_recipes(user_id)]
+    inventory = [i.as_dict() for i in DatabaseManager.list_inventory(user_id)]
+    business_logic._vectors.clear()
+    expected = reference_outcomes(recipes, user_id, factor)
+    problems += compare(expected, table_outcomes(feasibility_table(recipes, inventory, factor)), "table")
+    problems += compare(expected, table_outcomes(feasibility_job(user_id, factor)), "job")
+
+    cyclic = _with_cycle(rng, recipes)
+    if cyclic is not None:
+        # Cycles are logged as errors when cut; expected here
+        log = logging.getLogger("business_logic")
+        level = log.level
+        log.setLevel(logging.CRITICAL)
+        try:
+            want = reference_outcomes(cyclic, user_id, factor)
+            for label in ("cycle", "cycle warm"):
+                problems += compare(want, table_outcomes(feasibility_table(cyclic, inventory, factor)), label)
+        finally:
+            log.setLevel(level)
+
+    _edit(rng, user_id, recipes)
+    recipes = [r.as_dict() for r in DatabaseManager.list_recipes(user_id)]
+    expected = reference_outcomes(recipes, user_id, factor)
+    problems += compare(expected, table_outcomes(feasibility_table(recipes, inventory, factor)), "incremental")
+
+    # Last, as a successful cook changes the stock
+    recipe = rng.choice(recipes)
+    by_id = {r["id"]: r for r in recipes}
+    need = reference_requirement(recipe, by_id, factor)
+    feasible = expected[recipe["id"]][0]
+    if rng.random() < 0.5:
+        # Make it cookable with each ingredient split over two rows: one merged by name, one set
+        # under another spelling as the inventory editor does, which a cook has to draw on together
+        DatabaseManager.add_inventory_lots(user_id, [{"name": name, "quantity": qty / 2, "unit": unit}
+                                                     for (name, unit), qty in need.items()])
+        for (name, unit), qty in need.items():
+            DatabaseManager.upsert_inventory(user_id, name.upper(), qty / 2, unit)
+        feasible = reference_outcomes([recipe], user_id, factor, by_id)[recipe["id"]][0]
+    before = inventory_as_base(user_id)
+    cooked = consume_ingredients_for_recipe(recipe, user_id, factor, by_id)
+    after = inventory_as_base(user_id)
+    if cooked != feasible:
+        problems.append(f"consume: recipe {recipe['id']} cooked={cooked}, reference feasible={feasible}")
+    need = need if cooked else {}
+    for key in sorted(set(before) | set(after) | set(need)):
+        taken = before.get(key, 0.0) - after.get(key, 0.0)
+        if not math.isclose(taken, need.get(key, 0.0), rel_tol=1e-9, abs_tol=1e-6):
+            problems.append(f"consume: recipe {recipe['id']} cooked={cooked} took {taken!r} {key[1]} of {key[0]!r}, "
+                            f"reference says {need.get(key, 0.0)!r}")
+    return problems
+
+def check_nutrition(user_id: int) -> List[str]:
+    from business_logic import expand_ingredients, recipe_servings
+    from database import DatabaseManager
+    from nutrition import NUTRIENTS, cookbook_nutrition, table
+    from utils import to_base
+    recipes = [r.as_dict() for r in DatabaseManager.list_recipes(user_id)]
+    by_id = {r["id"]: r for r in recipes}
+    current = table()
+    problems = []
+    for label in ("nutrition", "nutrition warm"):
+        cached = cookbook_nutrition(recipes)
+        for recipe in recipes:
+            totals = dict.fromkeys(NUTRIENTS, 0.0)
+            for line in expand_ingredients(recipe, by_id):
+                base_qty, base_unit = to_base(line["quantity"], line["unit"])
+                values = current.lookup((DatabaseManager.normalize_name(line["name"]), base_unit))
+                for name, value in zip(NUTRIENTS, values or ()):
+                    totals[name] += base_qty * value / recipe_servings(recipe)
+            for name in NUTRIENTS:
+                if not math.isclose(totals[name], cached[recipe["id"]].values[name], rel_tol=1e-9, abs_tol=1e-6):
+                    problems.append(f"{label}: recipe {recipe['id']} {name} {cached[recipe['id']].values[name]!r}, "
+                                    f"reference says {totals[name]!r}")
+    return problems
+
+def check_units(rng: random.Random, rounds: int = 200) -> List[str]:
+    from utils import UNIT_ALIASES, from_base, to_base
+    problems = []
+    aliases = [alias for category in UNIT_ALIASES.values() for alias in category]
+    for _ in range(rounds):
+        unit, other = rng.choice(aliases), rng.choice(aliases)
+        qty = _quantity(rng)
+        base_qty, base_unit = to_base(qty, unit)
+        # Aliases are matched case- and space-insensitively
+        if to_base(qty, f" {unit.upper()} ") != (base_qty, base_unit):
+            problems.append(f"units: {unit!r} depends on case or spacing")
+        if not _close(from_base(base_qty, base_unit, unit), qty):
+            problems.append(f"units: {qty!r} {unit} -> {base_qty!r} {base_unit} does not round-trip")
+        if to_base(1, other)[1] == base_unit:
+            there = from_base(base_qty, base_unit, other)
+            if not _close(to_base(there, other)[0], base_qty):
+                problems.append(f"units: {qty!r} {unit} -> {there!r} {other} changes the amount")
+    return problems
+
+def run(cases: int = 100, seed: int = 0, recipes: int = 12) -> List[str]:
+    """Check ``cases`` random pantries in a scratch database; returns the problems found."""
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["SQLITE_DB_PATH"] = os.path.join(tmp, "differential.db")
+        from database import DatabaseManager
+        DatabaseManager.init_db()
+        problems = check_units(random.Random(seed))
+        for case in range(cases):
+            rng = random.Random(f"{seed}-{case}")
+            DatabaseManager.create_user(f"case{case}", "differential-pw", "q", "a")
+            user_id = DatabaseManager.verify_login(f"case{case}", "differential-pw")
+            layers, lots = random_pantry(rng, recipes)
+            found = check_feasibility(rng, user_id, layers, lots) + check_nutrition(user_id)
+            problems.extend(f"seed {seed} case {case}: {p}" for p in found)
+    return problems
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare optimized engines with the reference implementations")
+    parser.add_argument("--cases", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recipes", type=int, default=12, help="recipes per random pantry")
+    parser.add_argument("--show", type=int, default=20, help="problems to print")
+    args = parser.parse_args()
+    problems = run(args.cases, args.seed, args.recipes)
+    for p in problems[:args.show]:
+        print(p)
+    print(f"{args.cases} cases, seed {args.seed}: {len(problems)} problems")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
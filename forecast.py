@@ -0,0 +1,50 @@
+"""Run-out dates and restock suggestions from how fast each ingredient is used.
+
+Usage comes from the inventory history (cooking and edits that lowered
+stock), kept as a per-day rollup and an exponentially weighted daily rate by
+``DatabaseManager.update_consumption_rollup``, which only reads history added
+since its last run. Stock and rates are compared in base units; quantities to
+buy are converted back to the pantry's own unit for the ingredient with
+``from_base``.
+"""
+from datetime import date, timedelta
+from typing import Any, Dict, List
+from business_logic import inventory_base_map
+from config import FORECAST_COVER_DAYS, FORECAST_RESTOCK_DAYS
+from database import DatabaseManager
+from utils import from_base, normalize_unit, round_for_unit
+
+def forecast(user_id: int, inventory: List[Dict], restock_days: int = FORECAST_RESTOCK_DAYS,
+             cover_days: int = FORECAST_COVER_DAYS) -> Dict[str, Any]:
+    """Per-ingredient usage and run-out dates, and what to buy.
+
+    ``ingredients`` lists everything used lately, soonest to run out first:
+    ``{name, per_day, stock, unit, days_left, runs_out}`` with amounts in
+    ``unit``. ``restock`` holds shopping-list rows (``Name, Quantity, Unit``)
+    for whatever runs out within ``restock_days``, enough to last
+    ``cover_days`` from today.
+    """
+    rates = DatabaseManager.smoothed_consumption(user_id)
+    stock = inventory_base_map(inventory)
+    units: Dict[tuple, str] = {}
+    for row in inventory:
+        units.setdefault((DatabaseManager.normalize_name(row["name"]), normalize_unit(row["unit"])[0]), row["unit"])
+    today = date.today()
+    ingredients, restock = [], []
+    for key, rate in rates.items():
+        have, per_day = stock.get(key, 0.0), rate["per_day"]
+        unit = units.get(key, key[1])
+        days_left = have / per_day
+        ingredients.append({
+            "name": rate["name"], "unit": unit,
+            "per_day": from_base(per_day, key[1], unit), "stock": from_base(have, key[1], unit),
+            "days_left": days_left,
+            "runs_out": (today + timedelta(days=int(days_left))).isoformat() if days_left < 3650 else None,
+        })
+        short = per_day * cover_days - have
+        if days_left < restock_days and short > 1e-9:
+            restock.append({"Name": rate["name"], "Quantity": round_for_unit(from_base(short, key[1], unit), unit),
+                            "Unit": unit})
+    ingredients.sort(key=lambda i: i["days_left"])
+    restock.sort(key=lambda i: i["Name"].lower())
+    return {"ingredients": ingredients, "restock": restock}
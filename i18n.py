@@ -0,0 +1,337 @@
+import logging
+import re
+import sys
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping
+from config import APP_TITLE_EN, APP_TITLE_VI
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = "English"
+
+TEXT = {
+    "English": {
+        "app_title": APP_TITLE_EN,
+        "login": "🔐 Login",
+        "username": "Username",
+        "password": "Password",
+        "login_button": "Login",
+        "register": "🆕 Register",
+        "sec_question": "Security Question (for password reset)",
+        "sec_answer": "Security Answer",
+        "create_account": "Create Account",
+        "reset_password": "♻️ Reset Password",
+        "new_password": "New Password",
+        "reset_button": "Reset Password",
+        "inventory": "📦 Inventory",
+        "your_stock": "Your Stock",
+        "no_ingredients": "No ingredients yet.",
+        "add_ingredient": "Add Ingredient",
+        "ingredient_name": "Ingredient Name",
+        "quantity": "Quantity",
+        "unit": "Unit",
+        "duplicate_ingredient": "Duplicate ingredient",
+        "expires_on": "Expires on (optional)",
+        "next_expiry": "Next expiry",
+        "prefer_expiring": "Prefer recipes that use soon-to-expire stock",
+        "uses_expiring": "Uses stock expiring {date}",
+        "cooked": "Cooked '{title}'; inventory updated.",
+        "similar_recipes": "Similar recipes: {titles}",
+        "use_expiring": "Use up expiring stock with: {titles}",
+        "cook_failed": "Not enough stock to cook '{title}'.",
+        "price_paid": "Price paid (optional)",
+        "paste_receipt": "Paste a shopping list or receipt",
+        "receipt_text": "One item per line or separated by commas, e.g. 2kg gạo, 3 chén nước mắm, 6 trứng",
+        "parse_receipt": "Read items",
+        "receipt_preview": "Check the items, then add them all at once. Ticked names match an ingredient you already use.",
+        "receipt_unparsed": "Skipped (no quantity found): {lines}",
+        "receipt_add_all": "Add {count} items to inventory",
+        "receipt_added": "Added {count} items to inventory.",
+        "receipt_failed": "Nothing was added: {error}",
+        "inventory_history": "History and undo",
+        "undo_last_change": "Undo last change",
+        "nothing_to_undo": "There is nothing to undo.",
+        "undo_done": "Undid the last change ({source}, {count} items).",
+        "undo_conflict": "Cannot undo: {names} changed again since. Edit them directly instead.",
+        "recent_changes": "Recent changes",
+        "consumption_rates": "Used per day over the last {days} days",
+        "stock_as_of": "Stock at the end of",
+        "history_unavailable": "History does not reach back to that day.",
+        "household": "🏠 Household",
+        "pantry_member_of": "You are sharing {owner}'s pantry: recipes and inventory are theirs and every member's.",
+        "leave_pantry": "Leave pantry",
+        "pantry_members": "People sharing your pantry",
+        "no_pantry_members": "Nobody else shares your pantry yet.",
+        "remove_member": "Remove",
+        "create_invite": "Create invite code",
+        "invite_code": "Invite code (single use, valid {hours} hours): {code}",
+        "join_pantry": "Invite code to join another pantry",
+        "join_button": "Join",
+        "conflict_changed": "{name} was changed by someone else (now {current}); your edit was not saved.",
+        "conflict_deleted": "{name} was removed by someone else; your edit was not saved.",
+        "conflict_added": "{name} was just added by someone else ({current}); your row was not saved.",
+        "recipe_conflict": "'{title}' was changed by someone else and has been reloaded; please make your edit again.",
+        "nutrition_per_serving": "Per serving: {kcal} kcal · protein {protein_g} g · fat {fat_g} g · carbs {carbs_g} g",
+        "nutrition_plan": "Plan total: {kcal} kcal · protein {protein_g} g · fat {fat_g} g · carbs {carbs_g} g",
+        "nutrition_unknown": "No nutrition data for: {names}",
+        "recipe_cost": "Cost {cost}, to buy {shopping}",
+        "unpriced": "{count} ingredient(s) without a price",
+        "sort_by": "Sort by",
+        "sort_least_missing": "Least missing",
+        "sort_cheapest": "Cheapest to shop for",
+        "cheapest_week": "Cheapest week",
+        "restock": "Running low soon",
+        "restock_empty": "Nothing is used up fast enough to need restocking yet.",
+        "restock_caption": "From how fast you have used stock lately: what runs out within {days} days, and enough to last {cover} days.",
+        "send_restock_to_shopping": "Send restock list to Shopping List",
+        "meals": "Meals",
+        "week_total": "Estimated shopping: {total}",
+        "send_week_to_shopping": "Send this plan to Shopping List",
+        "estimated_total": "Estimated total: {total}",
+        "add_recipe": "Add Recipe",
+        "recipe_title": "Recipe Title",
+        "category": "Category",
+        "servings": "Servings",
+        "sub_recipe_tip": "To use another recipe as an ingredient (e.g. a sauce or broth), enter its title as the name and 'serving' as the unit.",
+        "sub_recipe_cycle": "A recipe cannot include itself, directly or through its sub-recipes.",
+        "scale": "Scale recipes",
+        "scaled_servings": "Scaled to {servings} servings",
+        "instructions": "Instructions",
+        "download_all_csv": "Download all recipes (CSV)",
+        "backup_restore": "Backup & Restore",
+        "preparing": "Preparing…",
+        "job_failed": "This could not be prepared. It will be retried shortly.",
+        "refresh": "Refresh",
+        "download_backup": "Download backup",
+        "restore_backup": "Restore from backup",
+        "restore_success": "Restored {recipes} recipes ({skipped_recipes} already existed) and {inventory} inventory items.",
+        "restore_failed": "Could not restore backup",
+        "recipes": "📖 Recipes",
+        "your_recipes": "Your Recipes",
+        "no_recipes": "No recipes yet.",
+        "feasibility": "✅ Feasibility & Shopping",
+        "create_recipes_first": "Create recipes first.",
+        "you_can_cook": "Recipe Feasibility and Shopping List",
+        "none_yet": "None yet.",
+        "all_available": "All ingredients available.",
+        "cook": "Cook",
+        "missing_something": "Missing Ingredients",
+        "all_feasible": "All recipes are feasible 🎉",
+        "add_to_shopping": "Add missing to Shopping List for",
+        "shopping_list": "🛒 Shopping List",
+        "empty_list": "Your shopping list is empty.",
+        "update_inventory": "Update Inventory from Shopping List",
+        "logout": "Logout",
+        "unit_tips": "Unit tips: use g, kg, ml, l, tsp, tbsp, cup, piece, cái, pcs, lạng, chén, bát.",
+        "language": "Language",
+        "error_title_required": "Recipe title is required.",
+        "error_ingredients_required": "At least one ingredient is required.",
+        "duplicate_recipe": "A recipe with this title already exists.",
+        "error_invalid_name": "Invalid ingredient name",
+        "error_invalid_unit": "Invalid unit",
+        "error_negative_qty": "Quantity must be positive.",
+        "save_recipe": "Save Recipe",
+        "update_recipe": "Update Recipe",
+        "delete_recipe": "Delete Recipe",
+        "update_success": "Recipe '{title}' updated successfully.",
+        "delete_success": "Recipe '{title}' deleted successfully.",
+        "update_failed": "Failed to update recipe '{title}'.",
+        "delete_failed": "Failed to delete recipe '{title}'.",
+        "deleting": "Deleting recipe '{title}'",
+        "purchased": "Inventory updated with purchased items.",
+        "not_logged_in": "You must be logged in to access this page.",
+        "too_many_attempts": "Too many attempts. Please wait a few minutes and try again.",
+    },
+    "Vietnamese": {
+        "app_title": APP_TITLE_VI,
+        "login": "🔐 Đăng nhập",
+        "username": "Tên người dùng",
+        "password": "Mật khẩu",
+        "login_button": "Đăng nhập",
+        "register": "🆕 Đăng ký",
+        "sec_question": "Câu hỏi bảo mật (để đặt lại mật khẩu)",
+        "sec_answer": "Câu trả lời bảo mật",
+        "create_account": "Tạo tài khoản",
+        "reset_password": "♻️ Đặt lại mật khẩu",
+        "new_password": "Mật khẩu mới",
+        "reset_button": "Đặt lại mật khẩu",
+        "inventory": "📦 Kho hàng",
+        "your_stock": "Kho của bạn",
+        "no_ingredients": "Chưa có nguyên liệu.",
+        "add_ingredient": "Thêm nguyên liệu",
+        "ingredient_name": "Tên nguyên liệu",
+        "quantity": "Số lượng",
+        "unit": "Đơn vị",
+        "duplicate_ingredient": "Nguyên liệu bị trùng",
+        "expires_on": "Hạn sử dụng (không bắt buộc)",
+        "next_expiry": "Hết hạn sớm nhất",
+        "prefer_expiring": "Ưu tiên công thức dùng nguyên liệu sắp hết hạn",
+        "uses_expiring": "Dùng nguyên liệu hết hạn ngày {date}",
+        "cooked": "Đã nấu '{title}'; kho đã được cập nhật.",
+        "similar_recipes": "Công thức tương tự: {titles}",
+        "use_expiring": "Dùng hết nguyên liệu sắp hết hạn với: {titles}",
+        "cook_failed": "Không đủ nguyên liệu để nấu '{title}'.",
+        "price_paid": "Giá đã trả (không bắt buộc)",
+        "paste_receipt": "Dán danh sách mua sắm hoặc hóa đơn",
+        "receipt_text": "Mỗi món một dòng hoặc cách nhau bằng dấu phẩy, ví dụ: 2kg gạo, 3 chén nước mắm, 6 trứng",
+        "parse_receipt": "Đọc danh sách",
+        "receipt_preview": "Kiểm tra các món rồi thêm tất cả một lần. Tên được đánh dấu trùng với nguyên liệu bạn đã dùng.",
+        "receipt_unparsed": "Bỏ qua (không thấy số lượng): {lines}",
+        "receipt_add_all": "Thêm {count} món vào kho",
+        "receipt_added": "Đã thêm {count} món vào kho.",
+        "receipt_failed": "Chưa thêm gì: {error}",
+        "inventory_history": "Lịch sử và hoàn tác",
+        "undo_last_change": "Hoàn tác thay đổi gần nhất",
+        "nothing_to_undo": "Không có gì để hoàn tác.",
+        "undo_done": "Đã hoàn tác thay đổi gần nhất ({source}, {count} món).",
+        "undo_conflict": "Không thể hoàn tác: {names} đã thay đổi sau đó. Hãy sửa trực tiếp.",
+        "recent_changes": "Thay đổi gần đây",
+        "consumption_rates": "Lượng dùng mỗi ngày trong {days} ngày qua",
+        "stock_as_of": "Tồn kho vào cuối ngày",
+        "history_unavailable": "Lịch sử không lưu tới ngày đó.",
+        "household": "🏠 Gia đình",
+        "pantry_member_of": "Bạn đang dùng chung kho của {owner}: công thức và kho là của mọi thành viên.",
+        "leave_pantry": "Rời kho chung",
+        "pantry_members": "Người dùng chung kho của bạn",
+        "no_pantry_members": "Chưa có ai dùng chung kho của bạn.",
+        "remove_member": "Xóa",
+        "create_invite": "Tạo mã mời",
+        "invite_code": "Mã mời (dùng một lần, hiệu lực {hours} giờ): {code}",
+        "join_pantry": "Mã mời để tham gia kho khác",
+        "join_button": "Tham gia",
+        "conflict_changed": "{name} vừa được người khác sửa (hiện là {current}); thay đổi của bạn chưa được lưu.",
+        "conflict_deleted": "{name} vừa bị người khác xóa; thay đổi của bạn chưa được lưu.",
+        "conflict_added": "{name} vừa được người khác thêm ({current}); dòng của bạn chưa được lưu.",
+        "recipe_conflict": "'{title}' vừa được người khác sửa và đã được tải lại; vui lòng sửa lại.",
+        "nutrition_per_serving": "Mỗi phần: {kcal} kcal · đạm {protein_g} g · béo {fat_g} g · tinh bột {carbs_g} g",
+        "nutrition_plan": "Tổng kế hoạch: {kcal} kcal · đạm {protein_g} g · béo {fat_g} g · tinh bột {carbs_g} g",
+        "nutrition_unknown": "Chưa có dữ liệu dinh dưỡng cho: {names}",
+        "recipe_cost": "Chi phí {cost}, cần mua {shopping}",
+        "unpriced": "{count} nguyên liệu chưa có giá",
+        "sort_by": "Sắp xếp theo",
+        "sort_least_missing": "Thiếu ít nhất",
+        "sort_cheapest": "Mua rẻ nhất",
+        "cheapest_week": "Tuần rẻ nhất",
+        "restock": "Sắp hết",
+        "restock_empty": "Chưa có nguyên liệu nào dùng nhanh tới mức cần mua thêm.",
+        "restock_caption": "Theo tốc độ dùng gần đây: những gì sẽ hết trong {days} ngày, và lượng đủ dùng {cover} ngày.",
+        "send_restock_to_shopping": "Gửi danh sách cần mua sang Danh sách mua sắm",
+        "meals": "Số bữa",
+        "week_total": "Ước tính tiền mua: {total}",
+        "send_week_to_shopping": "Gửi kế hoạch này sang Danh sách mua sắm",
+        "estimated_total": "Tổng ước tính: {total}",
+        "add_recipe": "Thêm công thức",
+        "recipe_title": "Tên công thức",
+        "category": "Danh mục",
+        "servings": "Số khẩu phần",
+        "sub_recipe_tip": "Để dùng một công thức khác làm nguyên liệu (ví dụ nước chấm, nước dùng), nhập tên công thức và đơn vị 'phần'.",
+        "sub_recipe_cycle": "Công thức không thể chứa chính nó, trực tiếp hoặc qua công thức con.",
+        "scale": "Nhân công thức",
+        "scaled_servings": "Điều chỉnh cho {servings} khẩu phần",
+        "instructions": "Hướng dẫn",
+        "download_all_csv": "Tải tất cả công thức (CSV)",
+        "backup_restore": "Sao lưu & Khôi phục",
+        "preparing": "Đang chuẩn bị…",
+        "job_failed": "Không thể chuẩn bị dữ liệu này. Sẽ thử lại sau giây lát.",
+        "refresh": "Làm mới",
+        "download_backup": "Tải bản sao lưu",
+        "restore_backup": "Khôi phục từ bản sao lưu",
+        "restore_success": "Đã khôi phục {recipes} công thức ({skipped_recipes} đã tồn tại) và {inventory} nguyên liệu trong kho.",
+        "restore_failed": "Không thể khôi phục bản sao lưu",
+        "recipes": "📖 Công thức",
+        "your_recipes": "Công thức của bạn",
+        "no_recipes": "Chưa có công thức.",
+        "feasibility": "✅ Tính khả thi & Mua sắm",
+        "create_recipes_first": "Hãy tạo công thức trước.",
+        "you_can_cook": "Tính khả thi công thức và Danh sách mua sắm",
+        "none_yet": "Chưa có.",
+        "all_available": "Tất cả nguyên liệu đều có sẵn.",
+        "cook": "Nấu ăn",
+        "missing_something": "Thiếu nguyên liệu",
+        "all_feasible": "Tất cả công thức đều khả thi 🎉",
+        "add_to_shopping": "Thêm nguyên liệu thiếu vào Danh sách mua sắm cho",
+        "shopping_list": "🛒 Danh sách mua sắm",
+        "empty_list": "Danh sách mua sắm của bạn trống.",
+        "update_inventory": "Cập nhật kho từ Danh sách mua sắm",
+        "logout": "Đăng xuất",
+        "unit_tips": "Mẹo đơn vị: sử dụng g, kg, ml, l, tsp, tbsp, cup, piece, cái, pcs, lạng, chén, bát.",
+        "language": "Ngôn ngữ",
+        "error_title_required": "Tiêu đề công thức là bắt buộc.",
+        "error_ingredients_required": "Cần ít nhất một nguyên liệu.",
+        "duplicate_recipe": "Công thức với tiêu đề này đã tồn tại.",
+        "error_invalid_name": "Tên nguyên liệu không hợp lệ",
+        "error_invalid_unit": "Đơn vị không hợp lệ",
+        "error_negative_qty": "Số lượng phải dương.",
+        "save_recipe": "Lưu công thức",
+        "update_recipe": "Cập nhật công thức",
+        "delete_recipe": "Xóa công thức",
+        "update_success": "Công thức '{title}' được cập nhật thành công.",
+        "delete_success": "Công thức '{title}' đã xóa thành công.",
+        "update_failed": "Không thể cập nhật công thức '{title}'.",
+        "delete_failed": "Không thể xóa công thức '{title}'.",
+        "deleting": "Đang xóa công thức '{title}'",
+        "purchased": "Kho được cập nhật với các mặt hàng đã mua.",
+        "not_logged_in": "Bạn phải đăng nhập để truy cập trang này.",
+        "too_many_attempts": "Quá nhiều lần thử. Vui lòng đợi vài phút rồi thử lại.",
+    }
+}
+
+# Languages consulted, in order, when a key is missing from a language's own table
+FALLBACKS: Dict[str, List[str]] = {
+    "Vietnamese": ["English"],
+}
+
+LANGUAGES = list(TEXT)
+
+class _Table(dict):
+    # Unknown keys render as the key itself, matching the old get_text behaviour
+    def __missing__(self, key):
+        return key
+
+def _resolve_chain(lang: str) -> List[str]:
+    chain, seen = [], set()
+    for candidate in [lang] + FALLBACKS.get(lang, []) + [DEFAULT_LANGUAGE]:
+        if candidate in TEXT and candidate not in seen:
+            chain.append(candidate)
+            seen.add(candidate)
+    return chain
+
+def _compile(lang: str) -> Mapping[str, str]:
+    table = _Table()
+    for source in reversed(_resolve_chain(lang)):
+        table.update(TEXT[source])
+    return MappingProxyType(table)
+
+# Frozen, fully-resolved tables built once at import
+COMPILED: Dict[str, Mapping[str, str]] = {lang: _compile(lang) for lang in TEXT}
+_TRANSLATORS: Dict[str, Callable[[str], str]] = {lang: table.__getitem__ for lang, table in COMPILED.items()}
+
+def translator(lang: str) -> Callable[[str], str]:
+    """Return the bound lookup for ``lang``; unknown languages get the default table."""
+    return _TRANSLATORS.get(lang) or _TRANSLATORS[DEFAULT_LANGUAGE]
+
+def missing_keys() -> Dict[str, List[str]]:
+    """Keys each language leaves to its fallback chain (untranslated strings)."""
+    reference = set(TEXT[DEFAULT_LANGUAGE])
+    return {lang: sorted(reference - set(TEXT[lang])) for lang in TEXT if reference - set(TEXT[lang])}
+
+def undefined_keys(paths: List[str]) -> List[str]:
+    """Literal ``get_text("...")`` keys in ``paths`` that no language defines."""
+    pattern = re.compile(r"""get_text\(\s*["'](\w+)["']\s*\)""")
+    known = set().union(*(TEXT[lang] for lang in TEXT))
+    used = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            used.update(pattern.findall(f.read()))
+    return sorted(used - known)
+
+if __name__ == "__main__":
+    # Build-time check: python i18n.py [files...] (defaults to ui.py and main.py)
+    files = sys.argv[1:] or ["ui.py", "main.py"]
+    undefined = undefined_keys(files)
+    for lang, keys in missing_keys().items():
+        print(f"{lang}: {len(keys)} untranslated key(s), falling back: {', '.join(keys)}")
+    if undefined:
+        print(f"Undefined text keys: {', '.join(undefined)}")
+        sys.exit(1)
+    print("All text keys defined.")
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import metrics
+from async_database import fetch_all
+from backup import export_user_data, recipes_to_csv
+from business_logic import cheapest_week, feasibility_table
+from config import JOB_WORKERS, JOB_RESULT_CACHE, JOB_RETRY_SECONDS
+from database import DatabaseManager
+from forecast import forecast
+from recommend import get_index
+from snapshots import user_inventory, user_prices, user_recipes
+
+logger = logging.getLogger(__name__)
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+class JobExecutor:
+    """Thread pool for recomputation that should not run on the Streamlit script thread.
+
+    Jobs are identified by a hashable key that should include everything the
+    result depends on (user, data version, parameters). Submitting a key that
+    is already queued, running or finished does not start a second job, and
+    finished results stay readable from a bounded cache. Failures are kept
+    for ``retry_seconds`` so pages can report them, then the key runs again.
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, max_results: int = JOB_RESULT_CACHE,
+                 retry_seconds: float = JOB_RETRY_SECONDS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._running: Dict[Hashable, Future] = {}
+        self._results: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._max_results = max_results
+        self._retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Future:
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and entry["status"] == FAILED \
+                    and time.monotonic() - entry["failed_at"] >= self._retry_seconds:
+                del self._results[key]
+            if key in self._results:
+                future: Future = Future()
+                entry = self._results[key]
+                if entry["status"] == DONE:
+                    future.set_result(entry["value"])
+                else:
+                    future.set_exception(entry["error"])
+                return future
+            if key in self._running:
+                return self._running[key]
+            metrics.incr(f"jobs.{key[0] if isinstance(key, tuple) else key}")
+            future = self._pool.submit(self._run, key, func, *args)
+            self._running[key] = future
+            return future
+
+    def _run(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            value = func(*args)
+        except Exception as e:
+            logger.error(f"Job {key} failed: {e}")
+            self._store(key, {"status": FAILED, "error": e, "seconds": time.perf_counter() - start,
+                              "failed_at": time.monotonic()})
+            raise
+        self._store(key, {"status": DONE, "value": value, "seconds": time.perf_counter() - start})
+        return value
+
+    def _store(self, key: Hashable, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._running.pop(key, None)
+            self._results[key] = entry
+            self._results.move_to_end(key)
+            while len(self._results) > self._max_results:
+                self._results.popitem(last=False)
+
+    def status(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            if key in self._results:
+                return self._results[key]["status"]
+            return PENDING if key in self._running else None
+
+    def result(self, key: Hashable, default: Any = None) -> Any:
+        """Finished value for ``key``, or ``default`` if not ready or failed."""
+        with self._lock:
+            entry = self._results.get(key)
+        return entry["value"] if entry and entry["status"] == DONE else default
+
+    def run(self, key: Hashable, func: Callable[..., Any], *args: Any, wait: float = 0.0) -> Any:
+        """Submit (deduplicated) and give the job up to ``wait`` seconds; None if still running."""
+        future = self.submit(key, func, *args)
+        try:
+            return future.result(timeout=wait)
+        except Exception:
+            # Still running (timed out) or failed; status() tells which
+            return None
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# Job bodies. They read from the database themselves so they never touch session state.
+
+def feasibility_job(user_id: int, factor: float = 1.0) -> List[Dict[str, Any]]:
+    # The snapshots the user's sessions already hold, when they are current
+    data = fetch_all({"inventory": (user_inventory, user_id),
+                      "recipes": (user_recipes, user_id),
+                      "prices": (user_prices, user_id)})
+    return feasibility_table(data["recipes"], data["inventory"], factor=factor, prices=data["prices"])
+
+def cheapest_week_job(user_id: int, meals: int, factor: float = 1.0) -> Dict[str, Any]:
+    data = fetch_all({"inventory": (user_inventory, user_id),
+                      "recipes": (user_recipes, user_id),
+                      "prices": (user_prices, user_id)})
+    return cheapest_week(data["recipes"], data["inventory"], data["prices"], meals=meals, factor=factor)
+
+def recipes_csv_job(user_id: int) -> str:
+    return recipes_to_csv(user_recipes(user_id))
+
+def backup_export_job(user_id: int) -> bytes:
+    return export_user_data(user_id)
+
+def index_refresh_job(user_id: int) -> int:
+    return get_index(user_id, refresh=False).refresh()
+
+def forecast_job(user_id: int) -> Dict[str, Any]:
+    # Catch the rollup up with history written since the last run, then project from it
+    DatabaseManager.update_consumption_rollup(user_id)
+    return forecast(user_id, user_inventory(user_id))
+
+def inventory_history_job(user_id: int) -> Dict[str, Any]:
+    return {"batches": DatabaseManager.inventory_history(user_id, limit=20),
+            "rates": DatabaseManager.consumption_rates(user_id, days=30)}
+
+def inventory_as_of_job(user_id: int, at: str) -> Dict[str, Any]:
+    try:
+        return {"rows": DatabaseManager.inventory_as_of(user_id, at)}
+    except ValueError:  # before the history horizon
+        return {"rows": None}
@@ -0,0 +1,52 @@
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+class ChangeFeed:
+    """Cursor over the change journal for one incremental consumer.
+
+    Named consumers persist their position in ``change_cursors`` (which also
+    protects unread entries from compaction); anonymous feeds keep it in memory.
+    """
+
+    def __init__(self, consumer: Optional[str] = None, user_id: Optional[int] = None,
+                 entities: Optional[List[str]] = None, start_seq: Optional[int] = None):
+        self.consumer = consumer
+        self.user_id = user_id
+        self.entities = entities
+        if start_seq is None and consumer:
+            start_seq = DatabaseManager.get_cursor(consumer)
+        self.seq = start_seq if start_seq is not None else DatabaseManager.current_seq()
+
+    def poll(self, limit: int = 1000) -> Tuple[List[Dict[str, Any]], bool]:
+        """Return ``(changes, needs_reload)`` since the last poll and advance the cursor.
+
+        ``needs_reload`` means entries after the cursor were compacted away, so
+        the consumer must rebuild from a full read instead of applying changes.
+        """
+        needs_reload = self.seq < DatabaseManager.oldest_seq() - 1
+        changes: List[Dict[str, Any]] = []
+        while True:
+            batch = DatabaseManager.changes_since(self.seq, self.user_id, self.entities, limit)
+            changes.extend(batch)
+            if batch:
+                self.seq = batch[-1]["seq"]
+            if len(batch) < limit:
+                break
+        if needs_reload:
+            logger.info(f"ChangeFeed {self.consumer or '<anonymous>'}: cursor fell behind compaction, reload needed")
+            self.seq = max(self.seq, DatabaseManager.current_seq())
+        if self.consumer and (changes or needs_reload):
+            DatabaseManager.save_cursor(self.consumer, self.seq)
+        return changes, needs_reload
+
+def changed_ids(changes: List[Dict[str, Any]], entity: str) -> Set[int]:
+    return {c["row_id"] for c in changes if c["entity"] == entity}
+
+def affected_recipe_ids(changes: List[Dict[str, Any]]) -> Set[int]:
+    """Recipes whose header or ingredient list changed in ``changes``."""
+    ids = changed_ids(changes, "recipes")
+    ids.update(c["parent_id"] for c in changes if c["entity"] == "ingredients" and c["parent_id"] is not None)
+    return ids
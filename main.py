@@ -1,45 +1,69 @@
 import streamlit as st
 import sqlite3
 from database import DatabaseManager
-from ui import inject_css, auth_gate_tabs, topbar_account, inventory_page, recipes_page
-from config import APP_TITLE_EN
-from ui import shopping_list_page, feasibility_page
+from async_database import fetch_all
+from security import issue_session_token, verify_session_token
+from ui import inject_css, auth_gate_tabs, topbar_account, sync_data_version
+from config import APP_TITLE_EN, SHOW_METRICS, API_IN_PROCESS
+from ui import page_nav, metrics_panel
+from bootstrap import bootstrap
+import metrics
 
 st.set_page_config(page_title=APP_TITLE_EN, page_icon="🍳", layout="wide")
 
+@st.cache_resource
+def app_bootstrap():
+    """Schema, logging and warm caches, once per process rather than per rerun."""
+    timings = bootstrap()
+    if API_IN_PROCESS:
+        from api import start_in_background
+        start_in_background()
+    return timings
+
 def ensure_auth_state():
     if "user_id" not in st.session_state:
         st.session_state.user_id = None
     if "username" not in st.session_state:
         st.session_state.username = None
+    if "session_token" not in st.session_state:
+        st.session_state.session_token = None
     if "language" not in st.session_state:
         st.session_state.language = "English"
 
 def main():
+    metrics.incr("app_runs")
+    app_bootstrap()
     inject_css()
     ensure_auth_state()
+    user_id = st.session_state.user_id
+    # A verified session token proves the user exists without a users lookup;
+    # older sessions without one fall back to the database check once.
+    has_session = bool(user_id) and verify_session_token(st.session_state.get("session_token")) == user_id
+    calls = {"ping": (DatabaseManager.ping,)}
+    if user_id and not has_session:
+        calls["valid_user"] = (DatabaseManager.validate_user_id, user_id)
+    if user_id:
+        calls["pantry"] = (DatabaseManager.pantry_version, user_id)
     try:
-        with DatabaseManager.get_db_conn() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT 1;")
-        # Remove this line, as DatabaseManager does not have an init_db method
-        # DatabaseManager.init_db()
+        checks = fetch_all(calls)
     except sqlite3.Error as e:
         st.error(f"Database connection test failed: {e}")
         st.stop()
-    if not st.session_state.user_id or not DatabaseManager.validate_user_id(st.session_state.user_id):
+    if user_id and checks.get("valid_user"):
+        st.session_state.session_token = issue_session_token(user_id)
+        has_session = True
+    if not has_session:
         auth_gate_tabs()
         return
+    # Joining or leaving a pantry takes effect on the next full run
+    pantry_id, version = checks["pantry"]
+    st.session_state.pantry_id = pantry_id
+    # Writes from other sessions, pantry members or app processes invalidate this session's cached lists
+    sync_data_version(pantry_id, version)
     topbar_account()
-    tabs = st.tabs(["Inventory", "Recipes", "Shopping List", "Feasibility & Shopping"])
-    with tabs[0]:
-        inventory_page()
-    with tabs[1]:
-        recipes_page()
-    with tabs[2]:
-        shopping_list_page()
-    with tabs[3]:
-        feasibility_page()
+    page_nav()
+    if SHOW_METRICS:
+        metrics_panel()
 
 if __name__ == "__main__":
 
@@ -0,0 +1,243 @@
+"""Routine database upkeep: statistics, free-page reclaim, WAL checkpoints and orphan purges.
+
+Recipe and inventory deletes leave free pages behind and the planner's
+statistics drift as tables grow. ``run`` does one pass of every task and
+returns a report with the file size, free-page ratio and each task's timing;
+``start_scheduler`` runs it from a daemon thread once the process has been
+idle for a while and the last run (by any process on the same file) is older
+than MAINTENANCE_INTERVAL_HOURS.
+
+Free pages are only given back to the file system with
+``auto_vacuum = INCREMENTAL``, which new databases get from ``init_db``.
+Older files need one full ``VACUUM`` to switch (``python maintenance.py
+--convert``), which rewrites the whole file and blocks writers meanwhile.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+import metrics
+from config import (DB_NAME, DB_BUSY_TIMEOUT_SECONDS, MAINTENANCE_IDLE_SECONDS, MAINTENANCE_INTERVAL_HOURS,
+                    MAINTENANCE_VACUUM_PAGES)
+from database import DatabaseManager, retry_on_locked
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+RUNS_KEPT = 100
+
+def file_stats(path: str = DB_NAME) -> Dict[str, Any]:
+    """Size of the database and its WAL, and how much of the file is free pages."""
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+    wal = path + "-wal"
+    return {
+        "bytes": os.path.getsize(path),
+        "wal_bytes": os.path.getsize(wal) if os.path.exists(wal) else 0,
+        "page_size": page_size,
+        "pages": page_count,
+        "free_pages": freelist,
+        "fragmentation": freelist / page_count if page_count else 0.0,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+    }
+
+@retry_on_locked
+def purge_orphans() -> Dict[str, int]:
+    """Delete ingredient lines and lots whose recipe or inventory row is gone, and unlink
+    sub-recipe references to deleted recipes (left by raw SQL or older versions)."""
+    with DatabaseManager.get_db_conn(write=True) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM ingredients WHERE recipe_id IS NULL "
+                    "OR NOT EXISTS (SELECT 1 FROM recipes WHERE id = ingredients.recipe_id)")
+        counts = {"ingredients": cur.rowcount}
+        cur.execute("UPDATE ingredients SET sub_recipe_id = NULL WHERE sub_recipe_id IS NOT NULL "
+                    "AND NOT EXISTS (SELECT 1 FROM recipes WHERE id = ingredients.sub_recipe_id)")
+        counts["sub_recipe_links"] = cur.rowcount
+        cur.execute("DELETE FROM inventory_lots "
+                    "WHERE NOT EXISTS (SELECT 1 FROM inventory WHERE id = inventory_lots.inventory_id)")
+        counts["inventory_lots"] = cur.rowcount
+        conn.commit()
+    return counts
+
+def _timed(report: Dict[str, Any], name: str, func, *args) -> Any:
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+    except sqlite3.Error as e:
+        # One failing task (usually a lock held too long) should not stop the others
+        logger.warning(f"maintenance: {name} failed: {e}")
+        result = {"error": str(e)}
+    report["tasks"][name] = {"result": result, "ms": (time.perf_counter() - start) * 1000}
+    return result
+
+def _pragma(sql: str) -> None:
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        conn.execute(sql)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _incremental_vacuum(pages: int) -> int:
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # The pragma frees one page per step; executescript steps it to the end, execute would not
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+
+def _checkpoint(mode: str) -> Dict[str, Any]:
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        busy, wal_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        conn.close()
+    return {"busy": bool(busy), "wal_pages": wal_pages, "checkpointed": checkpointed}
+
+def _analyze() -> int:
+    # analysis_limit samples big indexes instead of reading them whole, so this stays
+    # cheap as tables grow; the statistics it gathers are still good enough for the planner
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+        conn.commit()
+        return conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+    finally:
+        conn.close()
+
+def run(checkpoint: str = "PASSIVE", vacuum_pages: int = MAINTENANCE_VACUUM_PAGES,
+        run_id: Optional[int] = None) -> Dict[str, Any]:
+    """One maintenance pass; returns file stats before and after and each task's result and time.
+
+    ``checkpoint`` is the ``wal_checkpoint`` mode: PASSIVE never waits for
+    readers or writers, TRUNCATE also shrinks the WAL file but waits for them.
+    ``vacuum_pages`` bounds the free pages returned per run (0: all).
+    ``run_id`` is the ``maintenance_runs`` row a scheduled run claimed.
+    """
+    DatabaseManager.init_db()
+    start = time.perf_counter()
+    report: Dict[str, Any] = {"started_at": DatabaseManager._utc_stamp(datetime.now(timezone.utc)),
+                              "before": file_stats(), "tasks": {}}
+    _timed(report, "purge_orphans", purge_orphans)
+    _timed(report, "compact_change_log", DatabaseManager.compact_change_log)
+    _timed(report, "compact_inventory_history", DatabaseManager.compact_inventory_history)
+    _timed(report, "analyze", _analyze)
+    _timed(report, "optimize", _pragma, "PRAGMA optimize")
+    if report["before"]["auto_vacuum"] == "incremental":
+        _timed(report, "incremental_vacuum", _incremental_vacuum, vacuum_pages)
+    _timed(report, "wal_checkpoint", _checkpoint, checkpoint)
+    report["after"] = file_stats()
+    report["seconds"] = time.perf_counter() - start
+    _record(report, run_id)
+    logger.info(f"maintenance: {report['before']['bytes']} -> {report['after']['bytes']} bytes, "
+                f"fragmentation {report['before']['fragmentation']:.1%} -> {report['after']['fragmentation']:.1%} "
+                f"in {report['seconds'] * 1000:.0f} ms")
+    return report
+
+def convert_to_incremental() -> Dict[str, Any]:
+    """Switch an existing file to ``auto_vacuum = INCREMENTAL`` with a full VACUUM."""
+    before = file_stats()
+    start = time.perf_counter()
+    conn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    report = {"before": before, "after": file_stats(), "seconds": time.perf_counter() - start}
+    logger.info(f"maintenance: converted to incremental auto_vacuum: {report}")
+    return report
+
+@retry_on_locked
+def _record(report: Dict[str, Any], run_id: Optional[int] = None) -> None:
+    with DatabaseManager.get_db_conn(write=True) as conn:
+        conn.execute("INSERT INTO maintenance_runs (id, started_at, seconds, report) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT (id) DO UPDATE SET seconds = excluded.seconds, report = excluded.report",
+                     (run_id, report["started_at"], report["seconds"], json.dumps(report)))
+        conn.execute("DELETE FROM maintenance_runs WHERE id <= (SELECT MAX(id) FROM maintenance_runs) - ?",
+                     (RUNS_KEPT,))
+        conn.commit()
+
+def last_run() -> Optional[Dict[str, Any]]:
+    """The newest recorded report, from any process."""
+    with DatabaseManager.get_db_conn() as conn:
+        row = conn.execute("SELECT report FROM maintenance_runs WHERE report IS NOT NULL "
+                           "ORDER BY id DESC LIMIT 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+@retry_on_locked
+def _claim(interval_hours: float) -> Optional[int]:
+    """Record a run as started unless one started within ``interval_hours``; processes
+    sharing the file race on the write lock, so only one of them claims each run."""
+    due = DatabaseManager._utc_stamp(datetime.now(timezone.utc) - timedelta(hours=interval_hours))
+    with DatabaseManager.get_db_conn(write=True) as conn:
+        latest = conn.execute("SELECT MAX(started_at) FROM maintenance_runs").fetchone()[0]
+        if latest is not None and latest > due:
+            return None
+        cur = conn.execute("INSERT INTO maintenance_runs (started_at) VALUES (?)",
+                           (DatabaseManager._utc_stamp(datetime.now(timezone.utc)),))
+        conn.commit()
+        return cur.lastrowid
+
+def run_if_due(interval_hours: float = MAINTENANCE_INTERVAL_HOURS) -> Optional[Dict[str, Any]]:
+    run_id = _claim(interval_hours)
+    return run(run_id=run_id) if run_id is not None else None
+
+def start_scheduler(interval_hours: float = MAINTENANCE_INTERVAL_HOURS,
+                    idle_seconds: float = MAINTENANCE_IDLE_SECONDS) -> Optional[threading.Thread]:
+    """Run maintenance from a daemon thread when this process opened no connection for
+    ``idle_seconds`` and no run started within ``interval_hours``. 0 hours disables it."""
+    if interval_hours <= 0:
+        return None
+
+    def loop() -> None:
+        seen = None
+        while True:
+            time.sleep(idle_seconds)
+            connections = metrics.snapshot().get("db.connections", 0)
+            if connections == seen:
+                try:
+                    run_if_due(interval_hours)
+                except Exception:
+                    logger.exception("maintenance: scheduled run failed")
+                # Our own connections do not count as activity
+                connections = metrics.snapshot().get("db.connections", 0)
+            seen = connections
+
+    thread = threading.Thread(target=loop, name="maintenance", daemon=True)
+    thread.start()
+    return thread
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rua Den database maintenance")
+    parser.add_argument("--report", action="store_true", help="print file stats and the last run, change nothing")
+    parser.add_argument("--convert", action="store_true",
+                        help="switch the file to incremental auto_vacuum (full VACUUM, blocks writers)")
+    parser.add_argument("--checkpoint", default="PASSIVE", choices=["PASSIVE", "FULL", "RESTART", "TRUNCATE"])
+    args = parser.parse_args()
+    from bootstrap import bootstrap
+    bootstrap(warm=False, maintain=False)
+    if args.report:
+        result = {"file": file_stats(), "last_run": last_run()}
+    elif args.convert:
+        result = convert_to_incremental()
+    else:
+        result = run(checkpoint=args.checkpoint)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
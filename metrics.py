@@ -0,0 +1,19 @@
+"""Process-wide work counters, for checking how much a UI interaction costs."""
+import threading
+from collections import Counter
+from typing import Dict
+
+_counts: Counter = Counter()
+_lock = threading.Lock()
+
+def incr(name: str, amount: int = 1) -> None:
+    with _lock:
+        _counts[name] += amount
+
+def snapshot() -> Dict[str, int]:
+    with _lock:
+        return dict(_counts)
+
+def delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    """Counters that moved between two snapshots."""
+    return {k: v - before.get(k, 0) for k, v in sorted(after.items()) if v != before.get(k, 0)}
@@ -0,0 +1,68 @@
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator
+
+class Record(Mapping):
+    """Read-only row with slots instead of a per-instance ``__dict__``.
+
+    Reads like the dicts it replaces (``r["name"]``, ``r.get(...)``, ``dict(r)``,
+    ``{**r}``), so callers are unchanged, but rows cannot be modified: the same
+    objects are shared by every session of a user.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values: Any):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)})"
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Plain (JSON-serializable) copy, nested records included."""
+        return {k: [v.as_dict() for v in value] if isinstance(value, tuple) else value
+                for k, value in ((k, getattr(self, k)) for k in self.__slots__)}
+
+def _intern(text):
+    # Ingredient names and units repeat across recipes and inventory
+    return sys.intern(text) if isinstance(text, str) else text
+
+class Ingredient(Record):
+    __slots__ = ("name", "quantity", "unit", "sub_recipe_id")
+
+    @classmethod
+    def from_row(cls, row) -> "Ingredient":
+        return cls(_intern(row["name"]), row["quantity"], _intern(row["unit"]), row["sub_recipe_id"])
+
+class Recipe(Record):
+    __slots__ = ("id", "title", "category", "instructions", "servings", "version", "ingredients")
+
+    @classmethod
+    def from_row(cls, row, ingredients) -> "Recipe":
+        return cls(row["id"], row["title"], _intern(row["category"]), row["instructions"],
+                   row["servings"], row["version"], tuple(ingredients))
+
+class InventoryItem(Record):
+    __slots__ = ("id", "name", "quantity", "unit", "next_expires_at", "version")
+
+    @classmethod
+    def from_row(cls, row) -> "InventoryItem":
+        return cls(row["id"], _intern(row["name"]), row["quantity"], _intern(row["unit"]),
+                   _intern(row["next_expires_at"]), row["version"])
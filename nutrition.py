@@ -0,0 +1,159 @@
+"""Calories and macros per recipe and per meal plan from a local nutrient table.
+
+The table (``NUTRITION_CSV``) gives nutrients for a quantity of a canonical
+ingredient, and aliases map other spellings (Vietnamese names, plurals) onto
+it. Values are converted to amounts per base unit, so they multiply directly
+with the base-unit requirements of ``business_logic.recipe_vector``.
+"""
+import csv
+import logging
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import metrics
+from business_logic import RecipeVector, recipe_vector
+from config import NUTRITION_CSV
+from database import DatabaseManager
+from utils import to_base
+
+logger = logging.getLogger(__name__)
+
+NUTRIENTS = ("kcal", "protein_g", "fat_g", "carbs_g")
+
+class NutrientTable(NamedTuple):
+    per_base: Dict[Tuple[str, str], Tuple[float, ...]]  # (canonical name, base unit) -> NUTRIENTS per base unit
+    aliases: Dict[str, str]  # normalized name -> canonical name
+
+    def lookup(self, key: Tuple[str, str]) -> Optional[Tuple[float, ...]]:
+        name, unit = key
+        return self.per_base.get((self.aliases.get(name, name), unit))
+
+class Nutrition(NamedTuple):
+    values: Dict[str, float]  # per serving for a recipe, in total for a plan
+    unknown: Tuple[str, ...]  # ingredients without an entry for their unit, not counted
+
+def load_table(path: str = NUTRITION_CSV) -> NutrientTable:
+    """Read a nutrient CSV: name, aliases (``|``-separated), per_quantity, per_unit, then NUTRIENTS."""
+    per_base: Dict[Tuple[str, str], Tuple[float, ...]] = {}
+    aliases: Dict[str, str] = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for line, row in enumerate(csv.DictReader(f), 2):
+            try:
+                base_qty, base_unit = to_base(float(row["per_quantity"]), row["per_unit"])
+                values = tuple(float(row[n]) / base_qty for n in NUTRIENTS)
+            except (KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+                logger.warning(f"load_table: skipping {path} line {line}: {e}")
+                continue
+            name = DatabaseManager.normalize_name(row["name"])
+            per_base[(name, base_unit)] = values
+            for alias in (row.get("aliases") or "").split("|"):
+                if alias.strip():
+                    aliases[DatabaseManager.normalize_name(alias)] = name
+    logger.info(f"load_table: {len(per_base)} entries, {len(aliases)} aliases from {path}")
+    return NutrientTable(per_base, aliases)
+
+_table: Optional[NutrientTable] = None
+# recipe id -> (vector the result was computed from, result). recipe_vector hands
+# back the same object until the recipe or one of its sub-recipes gets a new
+# version, so an identity check is a per-version cache.
+_results: Dict[int, Tuple[RecipeVector, Nutrition]] = {}
+# Ingredient name as written in recipes -> cached recipes using it (sub-recipes
+# expanded), so a table change drops only the recipes it can affect
+_postings: Dict[str, Set[int]] = {}
+_lock = threading.Lock()
+
+def table() -> NutrientTable:
+    global _table
+    with _lock:
+        if _table is None:
+            _table = load_table()
+        return _table
+
+def _drop(rid: int) -> None:
+    cached = _results.pop(rid, None)
+    if cached is None:
+        return
+    for name, _ in cached[0].per_serving:
+        posting = _postings.get(name)
+        if posting is not None:
+            posting.discard(rid)
+            if not posting:
+                del _postings[name]
+
+def _changed_names(old: NutrientTable, new: NutrientTable) -> Set[str]:
+    canonical = {key[0] for key in old.per_base.keys() | new.per_base.keys()
+                 if old.per_base.get(key) != new.per_base.get(key)}
+    names = {a for a in old.aliases.keys() | new.aliases.keys() if old.aliases.get(a) != new.aliases.get(a)}
+    names.update(canonical)
+    for aliases in (old.aliases, new.aliases):
+        names.update(a for a, name in aliases.items() if name in canonical)
+    return names
+
+def reload_table(path: str = NUTRITION_CSV) -> int:
+    """Swap in a freshly read table; returns how many cached recipes it invalidated.
+
+    Only recipes using an ingredient whose values or aliases changed are
+    dropped, so the next cookbook pass recomputes just those.
+    """
+    global _table
+    new = load_table(path)
+    with _lock:
+        if _table is None:
+            stale = set(_results)
+        else:
+            stale = set()
+            for name in _changed_names(_table, new):
+                stale.update(_postings.get(name, ()))
+        for rid in stale:
+            _drop(rid)
+        _table = new
+    logger.info(f"reload_table: {len(stale)} recipes invalidated")
+    return len(stale)
+
+def recipe_nutrition(recipe: Dict, by_id: Optional[Dict[int, Dict]] = None,
+                     _memo: Optional[Dict[int, tuple]] = None) -> Nutrition:
+    """Nutrients per serving, sub-recipes included; cached until the recipe tree or its table entries change."""
+    vector = recipe_vector(recipe, by_id, _memo)
+    rid = recipe["id"]
+    cached = _results.get(rid)
+    if cached is not None and cached[0] is vector:
+        return cached[1]
+    current = table()
+    totals = [0.0] * len(NUTRIENTS)
+    unknown: List[str] = []
+    for key, qty in vector.per_serving.items():
+        values = current.lookup(key)
+        if values is None:
+            unknown.append(vector.labels[key][0])
+            continue
+        for i, value in enumerate(values):
+            totals[i] += qty * value
+    result = Nutrition(dict(zip(NUTRIENTS, totals)), tuple(unknown))
+    metrics.incr("nutrition.recipes")
+    with _lock:
+        # A reload while computing means these values may be stale: return them, but don't cache
+        if _table is current:
+            _drop(rid)
+            _results[rid] = (vector, result)
+            for name, _ in vector.per_serving:
+                _postings.setdefault(name, set()).add(rid)
+    return result
+
+def cookbook_nutrition(recipes: Iterable[Dict]) -> Dict[int, Nutrition]:
+    """Per-serving nutrition of every recipe; unchanged recipes come from the cache."""
+    recipes = list(recipes)
+    by_id = {r["id"]: r for r in recipes}
+    memo: Dict[int, tuple] = {}
+    return {r["id"]: recipe_nutrition(r, by_id, memo) for r in recipes}
+
+def plan_nutrition(plan: Iterable[Tuple[Dict, float]], recipes: Iterable[Dict]) -> Nutrition:
+    """Total nutrients of ``(recipe, portions)`` pairs, e.g. a week of meals."""
+    by_id = {r["id"]: r for r in recipes}
+    memo: Dict[int, tuple] = {}
+    totals = dict.fromkeys(NUTRIENTS, 0.0)
+    unknown: Dict[str, None] = {}
+    for recipe, portions in plan:
+        per_serving = recipe_nutrition(recipe, by_id, memo)
+        for name in NUTRIENTS:
+            totals[name] += per_serving.values[name] * portions
+        unknown.update(dict.fromkeys(per_serving.unknown))
+    return Nutrition(totals, tuple(unknown))
@@ -0,0 +1,136 @@
+"""Parse pasted shopping lists and receipts into inventory lots.
+
+Lines (or comma/semicolon separated items) like ``2kg gạo``, ``3 chén nước
+mắm``, ``6 trứng``, ``Gạo ST25 2 x 5kg 250.000đ`` become ``{name, quantity,
+unit, price}``. Units are matched by one regex compiled from
+``utils.UNIT_ALIASES``; a missing unit means pieces. Names are resolved
+against the pantry's catalog (inventory, recipe ingredients and the nutrient
+table aliases), accents optional, so a purchase lands on the existing row.
+"""
+import re
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from config import CURRENCY
+from database import DatabaseManager
+from utils import UNIT_ALIASES
+
+# Alias -> canonical alias spelling, and longest first so "kg" wins over "g"
+UNITS: Dict[str, str] = {alias: alias for category in UNIT_ALIASES.values() for alias in category}
+_UNIT = "|".join(re.escape(u) for u in sorted(UNITS, key=len, reverse=True))
+_NUMBER = r"\d+(?:[.,]\d+)*(?:/\d+)?"
+_QTY = rf"(?:(?P<mult>\d+)\s*[x×]\s*)?(?P<qty>{_NUMBER})\s*(?:(?P<unit>{_UNIT})(?!\w))?"
+_SUFFIXES = sorted({"đ", "₫", "vnd", "vnđ", CURRENCY.strip().lower()} - {""}, key=len, reverse=True)
+_PRICE = (rf"(?:[$€£]\s*(?P<price_a>{_NUMBER})|(?P<price_b>{_NUMBER})\s*(?:{'|'.join(map(re.escape, _SUFFIXES))})"
+          rf"|(?P<price_k>\d+(?:[.,]\d+)?)k)(?!\w)")
+_LEADING = re.compile(rf"^{_QTY}\s*(?:of\s+)?(?P<name>.*?\D.*?)(?:\s+{_PRICE})?$", re.IGNORECASE)
+_TRAILING = re.compile(rf"^(?P<name>.*?\D.*?)\s+{_QTY}(?:\s+{_PRICE})?$", re.IGNORECASE)
+_SPLIT = re.compile(r"[\n;]|(?<!\d),|,(?!\d)")  # but not a decimal comma
+_NAME_JUNK = re.compile(r"^[\s\-*•.:]+|[\s\-*•.:]+$")  # bullets and trailing punctuation
+
+class ParsedLine(NamedTuple):
+    text: str
+    name: str
+    quantity: float
+    unit: str
+    price: Optional[float]
+    matched: bool  # name found in the catalog rather than kept as typed
+
+def _number(text: str, grouped: bool = False) -> float:
+    if "/" in text:
+        num, den = text.split("/", 1)
+        return _number(num) / float(den) if float(den) else float("nan")
+    # Prices like 250.000 are grouped thousands, as on Vietnamese receipts; 1,5 is a decimal comma
+    if grouped and re.fullmatch(r"[1-9]\d{0,2}(?:[.,]\d{3})+", text):
+        return float(re.sub(r"[.,]", "", text))
+    return float(text.replace(",", ".", 1)) if text.count(",") + text.count(".") <= 1 else float("nan")
+
+def fold(text: str) -> str:
+    """Lower-case without diacritics, so ``nuoc mam`` matches ``nước mắm``."""
+    text = unicodedata.normalize("NFD", DatabaseManager.normalize_name(text).replace("đ", "d"))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+class Catalog:
+    """Ingredient names a pantry already uses, looked up exactly, then without accents,
+    then by nutrient-table alias, trying shorter prefixes for receipt suffixes (``Gạo ST25``)."""
+
+    def __init__(self, names: Iterable[str], aliases: Optional[Dict[str, str]] = None):
+        self.exact: Dict[str, str] = {}
+        self.folded: Dict[str, str] = {}
+        self.canonical: Dict[str, str] = {}
+        self.aliases = {fold(a): c for a, c in (aliases or {}).items()}
+        for name in names:  # earlier names win, so pass inventory before recipes
+            key = DatabaseManager.normalize_name(name)
+            if not key:
+                continue
+            self.exact.setdefault(key, name)
+            self.folded.setdefault(fold(name), name)
+            canonical = self.aliases.get(fold(name))
+            if canonical:
+                self.canonical.setdefault(canonical, name)
+
+    def resolve(self, name: str) -> Tuple[str, bool]:
+        words = name.split()
+        for end in range(len(words), 0, -1):
+            candidate = " ".join(words[:end])
+            key = DatabaseManager.normalize_name(candidate)
+            found = self.exact.get(key) or self.folded.get(fold(candidate))
+            if found is None:
+                canonical = self.aliases.get(fold(candidate))
+                found = canonical and self.canonical.get(canonical)
+            if found:
+                return found, True
+        return name, False
+
+def pantry_catalog(pantry_id: int) -> Catalog:
+    from nutrition import table
+    from snapshots import user_inventory, user_recipes
+    version = DatabaseManager.data_version(pantry_id)
+    names = [i["name"] for i in user_inventory(pantry_id, version)]
+    names.extend(ing["name"] for r in user_recipes(pantry_id, version) for ing in r["ingredients"]
+                 if not ing.get("sub_recipe_id"))
+    current = table()
+    aliases = dict(current.aliases)
+    aliases.update((name, name) for name, _ in current.per_base)
+    return Catalog(names, aliases)
+
+def parse_line(text: str, catalog: Optional[Catalog] = None) -> Optional[ParsedLine]:
+    """One item, or None if no quantity and name can be told apart."""
+    text = _NAME_JUNK.sub("", text)
+    match = _LEADING.match(text) or _TRAILING.match(text)
+    if match is None:
+        return None
+    name = _NAME_JUNK.sub("", match["name"])
+    if not name or name.lower() in UNITS:  # "2kg" is a quantity of nothing
+        return None
+    quantity = _number(match["qty"]) * int(match["mult"] or 1)
+    if not quantity > 0:  # also rejects NaN from malformed numbers
+        return None
+    unit = UNITS[match["unit"].lower()] if match["unit"] else "piece"
+    price = None
+    if match["price_a"] or match["price_b"]:
+        price = _number(match["price_a"] or match["price_b"], grouped=True)
+    elif match["price_k"]:
+        price = _number(match["price_k"]) * 1000
+    if price is not None and not price >= 0:
+        price = None
+    matched = False
+    if catalog is not None:
+        name, matched = catalog.resolve(name)
+    return ParsedLine(text, name, quantity, unit, price, matched)
+
+def parse_text(text: str, catalog: Optional[Catalog] = None) -> Tuple[List[ParsedLine], List[str]]:
+    """All items in ``text``, and the non-blank pieces that could not be parsed."""
+    parsed, unparsed = [], []
+    for piece in _SPLIT.split(text):
+        if not piece.strip():
+            continue
+        line = parse_line(piece, catalog)
+        if line is None:
+            unparsed.append(piece.strip())
+        else:
+            parsed.append(line)
+    return parsed, unparsed
+
+def lots(lines: Iterable[ParsedLine]) -> List[Dict]:
+    """``DatabaseManager.add_inventory_lots`` input for parsed lines."""
+    return [{"name": l.name, "quantity": l.quantity, "unit": l.unit, "price": l.price} for l in lines]
@@ -0,0 +1,174 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from database import DatabaseManager
+from business_logic import recipe_vector
+from config import RECIPE_INDEX_CACHE
+from journal import ChangeFeed, affected_recipe_ids
+
+logger = logging.getLogger(__name__)
+
+class IngredientIndex:
+    """Inverted index from canonical ingredient names to one user's recipes.
+
+    Recipes are indexed on their base ingredients (sub-recipes expanded), so
+    queries only look at recipes sharing at least one ingredient with the
+    question instead of scanning the cookbook. Updates arrive through the
+    change journal and touch only the edited recipes and the recipes that
+    use them as sub-recipes. ``refresh`` runs on job threads and edits the
+    structures in place, so queries hold the same lock.
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.recipes: Dict[int, Dict] = {}
+        self.keys: Dict[int, Dict[str, Tuple[float, str]]] = {}  # id -> name -> (per-serving base qty, base unit)
+        self.postings: Dict[str, Set[int]] = {}
+        self.parents: Dict[int, Set[int]] = {}
+        self.children: Dict[int, Set[int]] = {}
+        self._lock = threading.Lock()
+        self._feed = ChangeFeed(user_id=user_id, entities=["recipes", "ingredients"])
+        self._load(DatabaseManager.list_recipes(user_id))
+
+    def _load(self, recipes: List[Dict]) -> None:
+        self.recipes = {r["id"]: r for r in recipes}
+        self.keys, self.postings, self.parents, self.children = {}, {}, {}, {}
+        for rid in self.recipes:
+            self._link(rid)
+        for rid in self.recipes:
+            self._index(rid)
+
+    def _link(self, rid: int) -> None:
+        subs = {ing["sub_recipe_id"] for ing in self.recipes[rid]["ingredients"] if ing.get("sub_recipe_id")}
+        self.children[rid] = subs
+        for sub in subs:
+            self.parents.setdefault(sub, set()).add(rid)
+
+    def _unlink(self, rid: int) -> None:
+        for sub in self.children.pop(rid, ()):
+            self.parents.get(sub, set()).discard(rid)
+
+    def _index(self, rid: int) -> None:
+        self._unindex(rid)
+        vector = recipe_vector(self.recipes[rid], self.recipes)
+        keys: Dict[str, Tuple[float, str]] = {}
+        for (name, unit), qty in vector.per_serving.items():
+            if name not in keys or qty > keys[name][0]:
+                keys[name] = (qty, unit)
+        self.keys[rid] = keys
+        for name in keys:
+            self.postings.setdefault(name, set()).add(rid)
+
+    def _unindex(self, rid: int) -> None:
+        for name in self.keys.pop(rid, {}):
+            posting = self.postings.get(name)
+            if posting is not None:
+                posting.discard(rid)
+                if not posting:
+                    del self.postings[name]
+
+    def _ancestors(self, ids: Iterable[int]) -> Set[int]:
+        seen: Set[int] = set()
+        stack = list(ids)
+        while stack:
+            rid = stack.pop()
+            for parent in self.parents.get(rid, ()):
+                if parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
+        return seen
+
+    def refresh(self) -> int:
+        """Apply journal changes since the last refresh; returns the number of recipes re-indexed."""
+        with self._lock:
+            changes, needs_reload = self._feed.poll()
+            if needs_reload:
+                self._load(DatabaseManager.list_recipes(self.user_id))
+                return len(self.recipes)
+            changed = affected_recipe_ids(changes)
+            if not changed:
+                return 0
+            fresh = {r["id"]: r for r in DatabaseManager.get_recipes(self.user_id, sorted(changed))}
+            stale_ancestors = self._ancestors(changed)
+            for rid in changed:
+                self._unlink(rid)
+                if rid in fresh:
+                    self.recipes[rid] = fresh[rid]
+                    self._link(rid)
+                else:
+                    self.recipes.pop(rid, None)
+                    self._unindex(rid)
+            touched = (set(fresh) | stale_ancestors | self._ancestors(fresh)) & set(self.recipes)
+            for rid in touched:
+                self._index(rid)
+            logger.debug(f"IngredientIndex user_id={self.user_id}: re-indexed {len(touched)} recipes")
+            return len(touched)
+
+    def similar(self, recipe_id: int, k: int = 5) -> List[Tuple[int, float]]:
+        """Recipes with the highest Jaccard similarity of ingredient sets to ``recipe_id``."""
+        with self._lock:
+            mine = self.keys.get(recipe_id)
+            if not mine:
+                return []
+            overlap: Dict[int, int] = {}
+            for name in mine:
+                for rid in self.postings.get(name, ()):
+                    if rid != recipe_id:
+                        overlap[rid] = overlap.get(rid, 0) + 1
+            scored = [(rid, shared / (len(mine) + len(self.keys[rid]) - shared)) for rid, shared in overlap.items()]
+            scored.sort(key=lambda x: (-x[1], self.recipes[x[0]]["title"].lower()))
+        return scored[:k]
+
+    def best_coverage(self, names: Iterable[str], k: int = 5) -> List[Tuple[int, float, int]]:
+        """Recipes using most of the given ingredients (e.g. leftovers or stock about to expire).
+
+        Returns ``(recipe_id, share of the recipe covered, number of given ingredients used)``.
+        """
+        wanted = {DatabaseManager.normalize_name(n) for n in names}
+        used: Dict[int, int] = {}
+        with self._lock:
+            for name in wanted:
+                for rid in self.postings.get(name, ()):
+                    used[rid] = used.get(rid, 0) + 1
+            scored = [(rid, count / len(self.keys[rid]), count) for rid, count in used.items()]
+            scored.sort(key=lambda x: (-x[2], -x[1], self.recipes[x[0]]["title"].lower()))
+        return scored[:k]
+
+    def most_of(self, name: str, k: int = 5) -> List[Tuple[int, float, str]]:
+        """Recipes that use the largest amount per serving of one ingredient."""
+        key = DatabaseManager.normalize_name(name)
+        with self._lock:
+            rows = [(rid, *self.keys[rid][key]) for rid in self.postings.get(key, ())]
+        rows.sort(key=lambda x: -x[1])
+        return rows[:k]
+
+# Least recently used first; at most RECIPE_INDEX_CACHE users
+_indexes: "OrderedDict[int, IngredientIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_index(user_id: int, refresh: bool = True) -> IngredientIndex:
+    """The process-wide index for ``user_id``, built on first use and refreshed from the journal.
+
+    Pass ``refresh=False`` when a background job keeps the index current.
+    """
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+    if index is None:
+        # Built outside the lock so loading one cookbook does not hold up every other user
+        built = IngredientIndex(user_id)
+        with _indexes_lock:
+            index = _indexes.setdefault(user_id, built)
+            _indexes.move_to_end(user_id)
+            while len(_indexes) > RECIPE_INDEX_CACHE:
+                _indexes.popitem(last=False)
+        return index
+    if refresh:
+        index.refresh()
+    return index
+
+def recipe_titles(index: IngredientIndex, ids: Iterable[int]) -> List[str]:
+    with index._lock:
+        return [index.recipes[rid]["title"] for rid in ids if rid in index.recipes]
@@ -0,0 +1,208 @@
+import base64
+import functools
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from config import (SCRYPT_N, SCRYPT_R, SCRYPT_P, SESSION_SECRET, SESSION_TTL_SECONDS,
+                    AUTH_MAX_ATTEMPTS, AUTH_WINDOW_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+HASH_PREFIX = "scrypt"
+_DKLEN = 32
+_SALT_BYTES = 16
+
+def _b64e(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _b64d(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _scrypt(secret: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # maxmem must cover 128 * n * r bytes plus some slack, or OpenSSL refuses the call
+    return hashlib.scrypt(secret.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * n * r * 2 + 1024 * 1024, dklen=_DKLEN)
+
+def hash_secret(secret: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    """Return a self-describing ``scrypt$n$r$p$salt$hash`` string for storage."""
+    salt = os.urandom(_SALT_BYTES)
+    digest = _scrypt(secret, salt, n, r, p)
+    return f"{HASH_PREFIX}${n}${r}${p}${_b64e(salt)}${_b64e(digest)}"
+
+def is_hashed(stored: Optional[str]) -> bool:
+    return bool(stored) and stored.startswith(HASH_PREFIX + "$")
+
+def verify_secret(secret: str, stored: Optional[str]) -> Tuple[bool, bool]:
+    """Check ``secret`` against a stored value in constant time.
+
+    Returns ``(ok, needs_upgrade)``. Legacy plaintext rows and hashes made with
+    other cost parameters report ``needs_upgrade`` so callers can rehash them.
+    """
+    if stored is None:
+        return False, False
+    if not is_hashed(stored):
+        ok = hmac.compare_digest(secret.encode("utf-8"), stored.encode("utf-8"))
+        return ok, ok
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        expected = _b64d(digest)
+        actual = _scrypt(secret, _b64d(salt), n, r, p)
+    except (ValueError, TypeError) as e:
+        logger.error(f"verify_secret: malformed hash: {e}")
+        return False, False
+    ok = hmac.compare_digest(actual, expected)
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+# Hash of a random secret, verified against when a username does not exist so the
+# response time does not reveal which usernames are registered. Made on first use
+# (or by the app bootstrap) rather than at import, since scrypt is deliberately slow.
+@functools.lru_cache(maxsize=1)
+def dummy_hash() -> str:
+    return hash_secret(secrets.token_hex(8))
+
+def burn_verify(secret: str) -> None:
+    verify_secret(secret, dummy_hash())
+
+class RateLimiter:
+    """Sliding-window attempt counter keyed by an arbitrary string (e.g. username)."""
+
+    def __init__(self, max_attempts: int, window_seconds: float):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self._attempts: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+
+    def _prune(self, key: str, now: float) -> Deque[float]:
+        hits = self._attempts.setdefault(key, deque())
+        while hits and now - hits[0] > self.window_seconds:
+            hits.popleft()
+        return hits
+
+    def _sweep(self, now: float) -> None:
+        # Once per window, forget keys with no attempt left in it, so usernames tried
+        # once (or made up by an attacker) are not kept for the life of the process
+        if now - self._swept < self.window_seconds:
+            return
+        self._swept = now
+        for stale in [k for k, hits in self._attempts.items() if not hits or now - hits[-1] > self.window_seconds]:
+            del self._attempts[stale]
+
+    def allow(self, key: str) -> bool:
+        """Record an attempt for ``key``; False once the window budget is used up."""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            hits = self._prune(key, now)
+            if len(hits) >= self.max_attempts:
+                logger.warning(f"Rate limit hit for '{key}'")
+                return False
+            hits.append(now)
+            return True
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._attempts.pop(key, None)
+
+login_limiter = RateLimiter(AUTH_MAX_ATTEMPTS, AUTH_WINDOW_SECONDS)
+reset_limiter = RateLimiter(AUTH_MAX_ATTEMPTS, AUTH_WINDOW_SECONDS)
+invite_limiter = RateLimiter(AUTH_MAX_ATTEMPTS, AUTH_WINDOW_SECONDS)
+
+_session_key = SESSION_SECRET.encode("utf-8") if SESSION_SECRET else secrets.token_bytes(32)
+_verified_sessions: Dict[str, Tuple[int, float]] = {}
+_revoked_sessions: Dict[str, float] = {}
+_sessions_lock = threading.Lock()
+_SESSION_SWEEP_SECONDS = 60
+_sessions_swept = 0.0
+
+def _sign(payload: str) -> str:
+    return _b64e(hmac.new(_session_key, payload.encode("ascii"), hashlib.sha256).digest())
+
+def _sweep_sessions(now: float) -> None:
+    """Drop expired tokens from both caches, at most once a minute; tokens that are
+    never presented again would otherwise stay for the life of the process."""
+    global _sessions_swept
+    if now - _sessions_swept < _SESSION_SWEEP_SECONDS:
+        return
+    with _sessions_lock:
+        _sessions_swept = now
+        for stale in [t for t, (_, exp) in _verified_sessions.items() if exp <= now]:
+            del _verified_sessions[stale]
+        for stale in [t for t, exp in _revoked_sessions.items() if exp <= now]:
+            del _revoked_sessions[stale]
+
+def issue_session_token(user_id: int, ttl: int = SESSION_TTL_SECONDS) -> str:
+    expires = int(time.time()) + ttl
+    payload = f"{user_id}.{expires}"
+    token = f"{payload}.{_sign(payload)}"
+    with _sessions_lock:
+        _verified_sessions[token] = (user_id, float(expires))
+    return token
+
+def verify_session_token(token: Optional[str]) -> Optional[int]:
+    """Return the user id of a valid, unexpired token, or None.
+
+    Tokens seen before are answered from an in-memory cache, so a rerun does not
+    touch the database or recompute the signature.
+    """
+    if not token:
+        return None
+    now = time.time()
+    _sweep_sessions(now)
+    cached = _verified_sessions.get(token)
+    if cached is not None:
+        if cached[1] > now:
+            return cached[0]
+        with _sessions_lock:
+            _verified_sessions.pop(token, None)
+        return None
+    if token in _revoked_sessions:
+        return None
+    try:
+        user_id, expires, signature = token.split(".")
+        payload = f"{user_id}.{expires}"
+        if not hmac.compare_digest(signature, _sign(payload)) or int(expires) <= now:
+            return None
+        with _sessions_lock:
+            _verified_sessions[token] = (int(user_id), float(expires))
+        return int(user_id)
+    except ValueError:
+        return None
+
+def revoke_session_token(token: Optional[str]) -> None:
+    if not token:
+        return
+    now = time.time()
+    with _sessions_lock:
+        _verified_sessions.pop(token, None)
+        try:
+            _revoked_sessions[token] = float(token.split(".")[1])
+        except (IndexError, ValueError):
+            return
+        for stale in [t for t, exp in _revoked_sessions.items() if exp <= now]:
+            del _revoked_sessions[stale]
+
+def benchmark_scrypt(params: List[Tuple[int, int, int]], rounds: int = 5) -> List[Dict[str, float]]:
+    """Time ``hash_secret`` for each ``(n, r, p)``; used by ``bench.py hash``."""
+    results = []
+    for n, r, p in params:
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            hash_secret("benchmark-password", n=n, r=r, p=p)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        results.append({
+            "n": n, "r": r, "p": p,
+            "memory_mb": 128 * n * r / (1024 * 1024),
+            "median_ms": timings[len(timings) // 2] * 1000,
+            "max_ms": timings[-1] * 1000,
+        })
+    return results
@@ -0,0 +1,92 @@
+"""Per-user recipe and inventory snapshots, shared read-only by the user's sessions.
+
+A snapshot is a tuple of slotted records (see ``models``) tagged with the
+user's data version, so any number of sessions of one user hold a single copy.
+Pantry members pass the pantry id (the owning account's user id), so a whole
+household shares one snapshot, and jobs keyed the same way share results.
+Display rows derived from a snapshot are built once per snapshot instead of
+on every render.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from config import SNAPSHOT_CACHE
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+class _Entry:
+    __slots__ = ("version", "items", "views")
+
+    def __init__(self, version: int, items: Any):
+        self.version = version
+        self.items = items
+        self.views: Dict[Hashable, Any] = {}
+
+def _load_inventory(user_id: int) -> tuple:
+    # Sorted once here so editors can show rows in snapshot order
+    return tuple(sorted(DatabaseManager.list_inventory(user_id), key=lambda i: i["name"].lower()))
+
+def _load_recipes(user_id: int) -> tuple:
+    return tuple(DatabaseManager.list_recipes(user_id))
+
+_LOADERS: Dict[str, Callable[[int], Any]] = {"inventory": _load_inventory, "recipes": _load_recipes,
+                                             "prices": DatabaseManager.current_prices}
+_entries: "OrderedDict[Tuple[int, str], _Entry]" = OrderedDict()
+_by_items: Dict[int, _Entry] = {}
+_lock = threading.Lock()
+
+def _snapshot(user_id: int, kind: str, version: Optional[int]) -> Any:
+    if version is None:
+        version = DatabaseManager.data_version(user_id)
+    key = (user_id, kind)
+    with _lock:
+        entry = _entries.get(key)
+        # A newer snapshot than the caller asked for is fine: it only has more recent data
+        if entry is not None and entry.version >= version:
+            _entries.move_to_end(key)
+            return entry.items
+    items = _LOADERS[kind](user_id)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry.version >= version:
+            return entry.items
+        if entry is not None:
+            _by_items.pop(id(entry.items), None)
+        entry = _entries[key] = _Entry(version, items)
+        _by_items[id(items)] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > SNAPSHOT_CACHE:
+            _, evicted = _entries.popitem(last=False)
+            _by_items.pop(id(evicted.items), None)
+    return items
+
+def user_inventory(user_id: int, version: Optional[int] = None) -> tuple:
+    """The user's inventory at ``version`` or later (current version if not given), sorted by name."""
+    return _snapshot(user_id, "inventory", version)
+
+def user_recipes(user_id: int, version: Optional[int] = None) -> tuple:
+    """The user's recipes at ``version`` or later (current version if not given)."""
+    return _snapshot(user_id, "recipes", version)
+
+def user_prices(user_id: int, version: Optional[int] = None) -> Dict[tuple, float]:
+    """Latest price per base unit for each ingredient, keyed like recipe vectors; do not modify."""
+    return _snapshot(user_id, "prices", version)
+
+def view(items: tuple, name: Hashable, build: Callable[[], Any]) -> Any:
+    """``build()`` memoized on a shared snapshot; computed afresh for any other sequence.
+
+    Views are shared between sessions, so callers must not modify them.
+    """
+    with _lock:
+        entry = _by_items.get(id(items))
+        if entry is None or entry.items is not items:
+            entry = None
+        elif name in entry.views:
+            return entry.views[name]
+    value = build()
+    if entry is not None:
+        with _lock:
+            entry.views[name] = value
+    return value
@@ -1,16 +1,25 @@
 import streamlit as st
 import html
 from datetime import datetime, date
-import csv
-import io
 from typing import Optional
 from database import DatabaseManager
-from utils import VALID_UNITS, validate_unit
-from config import APP_TITLE_EN, APP_TITLE_VI
+from async_database import fetch_all
+from config import (CURRENCY_DECIMALS, FORECAST_COVER_DAYS, FORECAST_RESTOCK_DAYS, JOB_WAIT_SECONDS,
+                    PANTRY_INVITE_HOURS)
+from security import login_limiter, reset_limiter, invite_limiter, issue_session_token, revoke_session_token
+from utils import VALID_UNITS, validate_unit, fmt_qty, fmt_money, to_base
+from i18n import translator, DEFAULT_LANGUAGE, LANGUAGES
+from snapshots import user_inventory, user_prices, user_recipes, view
+import metrics
 import logging
 
-# Logging setup
-logging.basicConfig(level=logging.INFO)
+# Modules only the signed-in pages use (jobs, backup, recommend, business_logic)
+# are imported inside those pages, so the login screen renders without them.
+
+SCALE_OPTIONS = [0.5, 1.0, 2.0, 3.0, 4.0]
+MISSING_COLUMNS = ("Name", "Need", "Have", "Unit", "Missing")
+
+# Logging is configured once by bootstrap.configure_logging
 logger = logging.getLogger(__name__)
 
 def inject_css():
@@ -89,137 +98,99 @@ def inject_css():
         unsafe_allow_html=True,
     )
 
-TEXT = {
-    "English": {
-        "app_title": APP_TITLE_EN,
-        "login": "🔐 Login",
-        "username": "Username",
-        "password": "Password",
-        "login_button": "Login",
-        "register": "🆕 Register",
-        "sec_question": "Security Question (for password reset)",
-        "sec_answer": "Security Answer",
-        "create_account": "Create Account",
-        "reset_password": "♻️ Reset Password",
-        "new_password": "New Password",
-        "reset_button": "Reset Password",
-        "inventory": "📦 Inventory",
-        "your_stock": "Your Stock",
-        "no_ingredients": "No ingredients yet.",
-        "recipes": "📖 Recipes",
-        "your_recipes": "Your Recipes",
-        "no_recipes": "No recipes yet.",
-        "feasibility": "✅ Feasibility & Shopping",
-        "create_recipes_first": "Create recipes first.",
-        "you_can_cook": "Recipe Feasibility and Shopping List",
-        "none_yet": "None yet.",
-        "all_available": "All ingredients available.",
-        "cook": "Cook",
-        "missing_something": "Missing Ingredients",
-        "all_feasible": "All recipes are feasible 🎉",
-        "add_to_shopping": "Add missing to Shopping List for",
-        "shopping_list": "🛒 Shopping List",
-        "empty_list": "Your shopping list is empty.",
-        "update_inventory": "Update Inventory from Shopping List",
-        "logout": "Logout",
-        "unit_tips": "Unit tips: use g, kg, ml, l, tsp, tbsp, cup, piece, cái, pcs, lạng, chén, bát.",
-        "language": "Language",
-        "error_title_required": "Recipe title is required.",
-        "error_ingredients_required": "At least one ingredient is required.",
-        "duplicate_recipe": "A recipe with this title already exists.",
-        "error_invalid_name": "Invalid ingredient name",
-        "error_invalid_unit": "Invalid unit",
-        "error_negative_qty": "Quantity must be positive.",
-        "save_recipe": "Save Recipe",
-        "update_recipe": "Update Recipe",
-        "delete_recipe": "Delete Recipe",
-        "update_success": "Recipe '{title}' updated successfully.",
-        "delete_success": "Recipe '{title}' deleted successfully.",
-        "update_failed": "Failed to update recipe '{title}'.",
-        "delete_failed": "Failed to delete recipe '{title}'.",
-        "deleting": "Deleting recipe '{title}'",
-        "purchased": "Inventory updated with purchased items.",
-        "not_logged_in": "You must be logged in to access this page.",
-    },
-    "Vietnamese": {
-        "app_title": APP_TITLE_VI,
-        "login": "🔐 Đăng nhập",
-        "username": "Tên người dùng",
-        "password": "Mật khẩu",
-        "login_button": "Đăng nhập",
-        "register": "🆕 Đăng ký",
-        "sec_question": "Câu hỏi bảo mật (để đặt lại mật khẩu)",
-        "sec_answer": "Câu trả lời bảo mật",
-        "create_account": "Tạo tài khoản",
-        "reset_password": "♻️ Đặt lại mật khẩu",
-        "new_password": "Mật khẩu mới",
-        "reset_button": "Đặt lại mật khẩu",
-        "inventory": "📦 Kho hàng",
-        "your_stock": "Kho của bạn",
-        "no_ingredients": "Chưa có nguyên liệu.",
-        "recipes": "📖 Công thức",
-        "your_recipes": "Công thức của bạn",
-        "no_recipes": "Chưa có công thức.",
-        "feasibility": "✅ Tính khả thi & Mua sắm",
-        "create_recipes_first": "Hãy tạo công thức trước.",
-        "you_can_cook": "Tính khả thi công thức và Danh sách mua sắm",
-        "none_yet": "Chưa có.",
-        "all_available": "Tất cả nguyên liệu đều có sẵn.",
-        "cook": "Nấu ăn",
-        "missing_something": "Thiếu nguyên liệu",
-        "all_feasible": "Tất cả công thức đều khả thi 🎉",
-        "add_to_shopping": "Thêm nguyên liệu thiếu vào Danh sách mua sắm cho",
-        "shopping_list": "🛒 Danh sách mua sắm",
-        "empty_list": "Danh sách mua sắm của bạn trống.",
-        "update_inventory": "Cập nhật kho từ Danh sách mua sắm",
-        "logout": "Đăng xuất",
-        "unit_tips": "Mẹo đơn vị: sử dụng g, kg, ml, l, tsp, tbsp, cup, piece, cái, pcs, lạng, chén, bát.",
-        "language": "Ngôn ngữ",
-        "error_title_required": "Tiêu đề công thức là bắt buộc.",
-        "error_ingredients_required": "Cần ít nhất một nguyên liệu.",
-        "duplicate_recipe": "Công thức với tiêu đề này đã tồn tại.",
-        "error_invalid_name": "Tên nguyên liệu không hợp lệ",
-        "error_invalid_unit": "Đơn vị không hợp lệ",
-        "error_negative_qty": "Số lượng phải dương.",
-        "save_recipe": "Lưu công thức",
-        "update_recipe": "Cập nhật công thức",
-        "delete_recipe": "Xóa công thức",
-        "update_success": "Công thức '{title}' được cập nhật thành công.",
-        "delete_success": "Công thức '{title}' đã xóa thành công.",
-        "update_failed": "Không thể cập nhật công thức '{title}'.",
-        "delete_failed": "Không thể xóa công thức '{title}'.",
-        "deleting": "Đang xóa công thức '{title}'",
-        "purchased": "Kho được cập nhật với các mặt hàng đã mua.",
-        "not_logged_in": "Bạn phải đăng nhập để truy cập trang này.",
-    }
-}
-
 def get_text(key):
-    lang = st.session_state.get("language", "English")
-    logger.debug(f"Retrieving text for key '{key}' in language '{lang}'")
-    if lang not in TEXT:
-        logger.warning(f"Language '{lang}' not found, falling back to English")
-        lang = "English"
-    text = TEXT[lang].get(key, key)
-    if text == key:
-        logger.warning(f"Text key '{key}' not found in language '{lang}'")
-    return text
+    return translator(st.session_state.get("language", DEFAULT_LANGUAGE))(key)
+
+def session_translator():
+    """Bind the current session's lookup once, for render loops calling it many times."""
+    return translator(st.session_state.get("language", DEFAULT_LANGUAGE))
+
+@st.cache_resource
+def job_executor():
+    """Process-wide background job pool shared by all sessions."""
+    from jobs import JobExecutor
+    return JobExecutor()
+
+def job_placeholder(key):
+    """Shown where a job's result is not there yet: still running, or failed (run again on a later rerun)."""
+    from jobs import FAILED
+    if job_executor().status(key) == FAILED:
+        st.error(get_text("job_failed"))
+    else:
+        st.info(get_text("preparing"))
 
 def current_user_id():
     return st.session_state.get("user_id")
 
+def current_pantry_id():
+    """Whose recipes and inventory this session works on; set on every full run by main."""
+    return st.session_state.get("pantry_id") or current_user_id()
+
+def sync_data_version(pantry_id, version=None):
+    """Drop this session's cached lists if the pantry's data changed since the last rerun.
+
+    Other sessions (including other members of the pantry) and other app
+    processes write to the same database, so the per-session copies are
+    checked against the change journal once per rerun.
+    """
+    if version is None:
+        version = DatabaseManager.data_version(pantry_id)
+    key = f"data_version_{pantry_id}"
+    if st.session_state.get(key) != version:
+        st.session_state.pop(f"inventory_data_{pantry_id}", None)
+        st.session_state.pop(f"recipes_data_{pantry_id}", None)
+        st.session_state[key] = version
+    return version
+
+def current_data_version(pantry_id):
+    key = f"data_version_{pantry_id}"
+    return st.session_state[key] if key in st.session_state else sync_data_version(pantry_id)
+
+def load_user_data(pantry_id, inventory=False, recipes=False):
+    """Fill the missing inventory/recipes session caches, issuing their reads concurrently.
+
+    Sessions hold references to the pantry's shared snapshots, not copies.
+    """
+    wanted = {}
+    if inventory:
+        wanted[f"inventory_data_{pantry_id}"] = ("inventory", user_inventory)
+    if recipes:
+        wanted[f"recipes_data_{pantry_id}"] = ("recipes", user_recipes)
+    version = current_data_version(pantry_id)
+    calls = {key: (func, pantry_id, version) for key, (_, func) in wanted.items() if key not in st.session_state}
+    if not calls:
+        return
+    results = fetch_all(calls, return_exceptions=True)
+    for key, result in results.items():
+        if isinstance(result, Exception):
+            label = wanted[key][0]
+            logger.error(f"Error loading {label}: {result}")
+            st.error(f"Failed to load {label}.")
+            result = []
+        st.session_state[key] = result
+
+def recipe_changed(pantry_id, recipe):
+    """After a failed save: True if someone else edited or deleted ``recipe`` since it was loaded.
+
+    The session's recipes are refreshed so the next render shows the stored version.
+    """
+    latest = user_recipes(pantry_id)
+    st.session_state[f"recipes_data_{pantry_id}"] = latest
+    stored = next((x for x in latest if x["id"] == recipe["id"]), None)
+    return stored is None or stored["version"] != recipe["version"]
+
 def auth_gate_tabs():
     # Ensure language is initialized
     if "language" not in st.session_state:
-        st.session_state.language = "English"
+        st.session_state.language = DEFAULT_LANGUAGE
         logger.debug("Initialized language to 'English' in auth_gate_tabs")
 
     # Language selection dropdown
     current_lang = st.session_state.language
     lang = st.selectbox(
         get_text("language"),
-        ["English", "Vietnamese"],
-        index=["English", "Vietnamese"].index(current_lang) if current_lang in ["English", "Vietnamese"] else 0,
+        LANGUAGES,
+        index=LANGUAGES.index(current_lang) if current_lang in LANGUAGES else 0,
         key="language_select_login"
     )
     if lang != st.session_state.language:
@@ -240,10 +211,15 @@ def auth_gate_tabs():
             username = st.text_input(get_text("username"))
             password = st.text_input(get_text("password"), type="password")
             if st.form_submit_button(get_text("login_button")):
+                if not login_limiter.allow(username):
+                    st.error(get_text("too_many_attempts"))
+                    return
                 user_id = DatabaseManager.verify_login(username, password)
                 if user_id:
+                    login_limiter.reset(username)
                     st.session_state.user_id = user_id
                     st.session_state.username = username
+                    st.session_state.session_token = issue_session_token(user_id)
                     st.success(get_text("login_button") + " successful!")
                     logger.info(f"User '{username}' logged in with user_id={user_id}")
                     st.rerun()
@@ -273,7 +249,11 @@ def auth_gate_tabs():
             sec_answer = st.text_input(get_text("sec_answer"), type="password")
             new_password = st.text_input(get_text("new_password"), type="password")
             if st.form_submit_button(get_text("reset_button")):
+                if not reset_limiter.allow(username):
+                    st.error(get_text("too_many_attempts"))
+                    return
                 if DatabaseManager.reset_password(username, sec_answer, new_password):
+                    reset_limiter.reset(username)
                     st.success("Password reset successfully!")
                     logger.info(f"Password reset for user '{username}'")
                     st.rerun()
@@ -290,8 +270,10 @@ def topbar_account():
         with col2:
             if st.button(get_text("logout")):
                 logger.info(f"User {st.session_state.username} logged out, clearing session state.")
+                revoke_session_token(st.session_state.get("session_token"))
                 keys_to_clear = [
-                    "user_id", "username", "inventory_data", "recipes_data", "shopping_list_data"
+                    "user_id", "pantry_id", "username", "session_token", "inventory_data", "recipes_data",
+                    "shopping_list_data"
                 ]
                 for key in keys_to_clear:
                     if key in st.session_state:
@@ -300,13 +282,15 @@ def topbar_account():
                 st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
+@st.fragment
 def inventory_page():
-    user_id = current_user_id()
-    if not user_id:
+    metrics.incr("page.inventory")
+    pantry_id = current_pantry_id()
+    if not pantry_id:
         st.error("You must be logged in to access the inventory. Please log in.")
         return
 
-    inventory_key = f"inventory_data_{user_id}"
+    inventory_key = f"inventory_data_{pantry_id}"
     st.header(get_text("inventory"))
     st.subheader(get_text("your_stock"))
 
@@ -316,6 +300,8 @@ def inventory_page():
             name = st.text_input(get_text("ingredient_name"), placeholder="e.g., chicken")
             quantity = st.number_input(get_text("quantity"), min_value=0.0, step=0.1, value=0.0)
             unit = st.selectbox(get_text("unit"), options=VALID_UNITS)
+            expires_on = st.date_input(get_text("expires_on"), value=None, min_value=date.today())
+            price = st.number_input(get_text("price_paid"), min_value=0.0, step=1.0, value=0.0)
             st.markdown(get_text("unit_tips"))
             submitted = st.form_submit_button(get_text("add_ingredient"))
             if submitted:
@@ -323,152 +309,272 @@ def inventory_page():
                     st.error(f"{get_text('error_invalid_name')} or {get_text('error_invalid_unit')}")
                 elif quantity <= 0:
                     st.error(get_text("error_negative_qty"))
+                elif expires_on:
+                    # A dated purchase is stored as a new lot on top of existing stock
+                    if DatabaseManager.add_inventory_lot(pantry_id, name, quantity, unit, expires_on.isoformat()):
+                        if price:
+                            DatabaseManager.record_price(pantry_id, name, price, quantity, unit)
+                        st.success(f"Added {name} (expires {expires_on.isoformat()}) to inventory.")
+                        st.session_state[inventory_key] = user_inventory(pantry_id)
+                        st.rerun(scope="fragment")
+                    else:
+                        st.error(f"Failed to add {name} to inventory.")
                 else:
                     # Check for duplicate ingredient
-                    existing = DatabaseManager.list_inventory(user_id)
+                    existing = user_inventory(pantry_id)
                     new_name_norm = DatabaseManager.normalize_name(name)
                     match = next((item for item in existing if DatabaseManager.normalize_name(item["name"]) == new_name_norm), None)
                     if match:
                         # Update existing ingredient
-                        if DatabaseManager.update_inventory_item(match["id"], name, quantity, unit):
+                        if DatabaseManager.update_inventory_item(match["id"], name, quantity, unit,
+                                                                 expected_version=match["version"]):
+                            if price:
+                                DatabaseManager.record_price(pantry_id, name, price, quantity, unit)
                             st.success(f"Updated {name} in inventory.")
-                            st.session_state[inventory_key] = DatabaseManager.list_inventory(user_id)
-                            st.rerun()
+                            st.session_state[inventory_key] = user_inventory(pantry_id)
+                            st.rerun(scope="fragment")
                         else:
                             st.error(f"Failed to update {name} in inventory.")
                     else:
-                        if DatabaseManager.upsert_inventory(user_id, name, quantity, unit):
+                        if DatabaseManager.upsert_inventory(pantry_id, name, quantity, unit):
+                            if price:
+                                DatabaseManager.record_price(pantry_id, name, price, quantity, unit)
                             st.success(f"Added {name} to inventory.")
-                            st.session_state[inventory_key] = DatabaseManager.list_inventory(user_id)
-                            st.rerun()
+                            st.session_state[inventory_key] = user_inventory(pantry_id)
+                            st.rerun(scope="fragment")
                         else:
                             st.error(f"Failed to add {name} to inventory.")
 
+    # A pasted list or receipt becomes one batch of lots, written in a single transaction
+    with st.expander(get_text("paste_receipt"), expanded=False):
+        with st.form("receipt_form"):
+            text = st.text_area(get_text("receipt_text"), height=150)
+            if st.form_submit_button(get_text("parse_receipt")):
+                from receipts import pantry_catalog, parse_text
+                parsed, unparsed = parse_text(text, pantry_catalog(pantry_id))
+                st.session_state.receipt_rows = [
+                    {"Name": l.name, "Quantity": l.quantity, "Unit": l.unit, "Price": l.price, "Known": l.matched}
+                    for l in parsed
+                ]
+                st.session_state.receipt_unparsed = unparsed
+        if st.session_state.get("receipt_unparsed"):
+            st.caption(get_text("receipt_unparsed").format(lines="; ".join(st.session_state.receipt_unparsed)))
+        if st.session_state.get("receipt_rows"):
+            st.caption(get_text("receipt_preview"))
+            rows = st.data_editor(
+                st.session_state.receipt_rows,
+                column_config={
+                    "Name": st.column_config.TextColumn(required=True),
+                    "Quantity": st.column_config.NumberColumn(min_value=0.0, step=0.1, required=True),
+                    "Unit": st.column_config.SelectboxColumn(options=VALID_UNITS, required=True),
+                    "Price": st.column_config.NumberColumn(label=get_text("price_paid"), min_value=0.0),
+                    "Known": st.column_config.CheckboxColumn(disabled=True),
+                },
+                num_rows="dynamic",
+                key="receipt_editor",
+            )
+            if st.button(get_text("receipt_add_all").format(count=len(rows)), type="primary"):
+                invalid = [r for r in rows if not (r.get("Name") or "").strip() or not validate_unit(r.get("Unit") or "")
+                           or not DatabaseManager.validate_name(r["Name"]) or not (r.get("Quantity") or 0) > 0]
+                if invalid:
+                    st.error(f"{get_text('error_invalid_name')} or {get_text('error_invalid_unit')}")
+                else:
+                    try:
+                        count = DatabaseManager.add_inventory_lots(pantry_id, [
+                            {"name": r["Name"].strip(), "quantity": r["Quantity"], "unit": r["Unit"],
+                             "price": r.get("Price") or None} for r in rows])
+                    except Exception as e:
+                        st.error(get_text("receipt_failed").format(error=e))
+                    else:
+                        st.session_state.pop("receipt_rows", None)
+                        st.session_state.pop("receipt_unparsed", None)
+                        st.session_state[inventory_key] = user_inventory(pantry_id)
+                        st.success(get_text("receipt_added").format(count=count))
+                        st.rerun(scope="fragment")
+
     # Load and display inventory
-    inventory_key = f"inventory_data_{user_id}"
-    if inventory_key not in st.session_state:
-        st.session_state[inventory_key] = DatabaseManager.list_inventory(user_id)
+    inventory_key = f"inventory_data_{pantry_id}"
+    load_user_data(pantry_id, inventory=True)
     inv = st.session_state[inventory_key]
     if not inv:
         st.info(get_text("no_ingredients"))
         st.warning("Your inventory is empty. Add ingredients using the form above or the table below (click '+' to add a new row). Examples: 'chicken', 'eggs'.")
     else:
-        # Create editor_data with index for tracking
-        editor_data = [
-            {
-                "_index": idx,  # Temporary index to track original rows
-                "Name": r["name"],
-                "Quantity": r["quantity"],
-                "Unit": r["unit"],
-            }
-            for idx, r in enumerate(inv)
-        ]
-        # Sort editor_data by Name in ascending order (case-insensitive)
-        editor_data = sorted(editor_data, key=lambda x: x["Name"].lower())
-        # Display data editor without _index
-        display_data = [{"Name": r["Name"], "Quantity": r["Quantity"], "Unit": r["Unit"]} for r in editor_data]
-        edited_data = st.data_editor(
+        # The snapshot is already sorted by name, so row positions index into inv.
+        # The rows are built once per snapshot and shared by the pantry's sessions.
+        display_data = view(inv, "editor_rows", lambda: [
+            {"Name": r["name"], "Quantity": r["quantity"], "Unit": r["unit"], "Expires": r.get("next_expires_at") or ""}
+            for r in inv
+        ])
+        # A new key after each save starts the next edit from a clean diff
+        editor_key = f"inventory_editor_{pantry_id}_{st.session_state.get('inventory_editor_round', 0)}"
+        st.data_editor(
             display_data,
             column_config={
                 "Name": st.column_config.TextColumn(required=True),
                 "Quantity": st.column_config.NumberColumn(min_value=0.0, step=0.1, required=True),
                 "Unit": st.column_config.SelectboxColumn(options=VALID_UNITS, required=True),
+                "Expires": st.column_config.TextColumn(label=get_text("next_expiry"), disabled=True),
             },
             num_rows="dynamic",
-            key=f"inventory_editor_{user_id}",
+            key=editor_key,
         )
-        if edited_data != display_data:
-            # Track processed indices to detect deletions
-            processed_indices = set()
-            for edited_row in edited_data:
-                if not edited_row.get("Name", "").strip() or not validate_unit(edited_row.get("Unit", "")) or not DatabaseManager.validate_name(edited_row.get("Name", "")):
-                    st.error(f"Invalid data in row: {get_text('error_invalid_name')} or {get_text('error_invalid_unit')}")
-                    continue
-                # Check for duplicate ingredient
-                existing = [item for item in inv if DatabaseManager.normalize_name(item["name"]) == DatabaseManager.normalize_name(edited_row["Name"])]
-                if existing and not any(r["Name"] == edited_row["Name"] for r in editor_data):
-                    st.error(f"{get_text('duplicate_ingredient')} for {edited_row['Name']}")
-                    continue
-                # Try to match with original editor_data by index
-                matching_rows = [r for r in editor_data if r["Name"] == edited_row["Name"]]
-                if matching_rows:
-                    # Update existing item
-                    original_idx = matching_rows[0]["_index"]
-                    row_id = inv[original_idx]["id"]
-                    processed_indices.add(original_idx)
-                    if DatabaseManager.update_inventory_item(
-                        row_id,
-                        edited_row["Name"],
-                        edited_row["Quantity"],
-                        edited_row["Unit"]
-                    ):
-                        st.success(f"Updated {edited_row['Name']}.")
-                    else:
-                        st.error(f"Failed to update inventory item {edited_row['Name']}.")
-                else:
-                    # New item
-                    if DatabaseManager.upsert_inventory(
-                        user_id,
-                        edited_row["Name"],
-                        edited_row["Quantity"],
-                        edited_row["Unit"]
-                    ):
-                        st.success(f"Added {edited_row['Name']} to inventory.")
-                    else:
-                        st.error(f"Failed to add {edited_row['Name']} to inventory.")
-            # Detect and delete removed rows
-            for idx, original_row in enumerate(editor_data):
-                if idx not in processed_indices:
-                    row_id = inv[idx]["id"]
-                    if DatabaseManager.delete_inventory(row_id):
-                        st.success(f"Deleted {original_row['Name']} from inventory.")
-                    else:
-                        st.error(f"Failed to delete {original_row['Name']} from inventory.")
-            # Removed refresh inventory data logic
-            st.session_state[inventory_key] = DatabaseManager.list_inventory(user_id)
-            st.rerun()
+        # Only the rows this session touched are written, each checked against the version
+        # it was shown at, so members of a pantry editing different rows don't overwrite each other
+        diff = st.session_state.get(editor_key) or {}
+        edits = []
+        for idx, patch in diff.get("edited_rows", {}).items():
+            item, row = inv[int(idx)], {**display_data[int(idx)], **patch}
+            edits.append({"id": item["id"], "version": item["version"], "name": row["Name"],
+                          "quantity": row["Quantity"], "unit": row["Unit"]})
+        for row in diff.get("added_rows", []):
+            edits.append({"id": None, "name": row.get("Name") or "", "quantity": row.get("Quantity"),
+                          "unit": row.get("Unit") or ""})
+        for idx in diff.get("deleted_rows", []):
+            item = inv[int(idx)]
+            edits.append({"id": item["id"], "version": item["version"], "name": item["name"], "delete": True})
+        valid_edits = []
+        for edit in edits:
+            if not edit.get("delete") and (not edit["name"].strip() or not validate_unit(edit["unit"])
+                                           or not DatabaseManager.validate_name(edit["name"])):
+                st.error(f"Invalid data in row: {get_text('error_invalid_name')} or {get_text('error_invalid_unit')}")
+            elif not edit.get("delete") and (edit["quantity"] is None or edit["quantity"] < 0):
+                st.error(get_text("error_negative_qty"))
+            else:
+                valid_edits.append(edit)
+        if valid_edits and len(valid_edits) == len(edits):
+            result = DatabaseManager.apply_inventory_edits(pantry_id, valid_edits)
+            st.session_state.inventory_editor_round = st.session_state.get("inventory_editor_round", 0) + 1
+            st.session_state[inventory_key] = user_inventory(pantry_id)
+            # Reported after the rerun, next to the rows as they are now
+            st.session_state.inventory_conflicts = result["conflicts"]
+            st.rerun(scope="fragment")
+        for conflict in st.session_state.pop("inventory_conflicts", []):
+            current = conflict["current"]
+            st.warning(get_text(f"conflict_{conflict['reason']}").format(
+                name=conflict["name"],
+                current=f"{fmt_qty(current['quantity'])} {current['unit']}" if current else ""))
+
+    # Every stock change is kept as a history batch: undo the latest (e.g. a data-editor
+    # save that matched the wrong rows), see what changed, and how fast stock is used
+    # The reads run as background jobs keyed by the data version, since the expander's
+    # body runs on every render even when it is collapsed
+    from jobs import inventory_as_of_job, inventory_history_job
+    with st.expander(get_text("inventory_history"), expanded=False):
+        if st.button(get_text("undo_last_change"), key="undo_inventory_batch"):
+            result = DatabaseManager.undo_last_inventory_batch(pantry_id)
+            if result["batch"] is None:
+                st.info(get_text("nothing_to_undo"))
+            elif result["conflicts"]:
+                st.warning(get_text("undo_conflict").format(names=", ".join(c["name"] for c in result["conflicts"])))
+            else:
+                st.session_state.inventory_editor_round = st.session_state.get("inventory_editor_round", 0) + 1
+                st.session_state[inventory_key] = user_inventory(pantry_id)
+                st.session_state.inventory_undone = get_text("undo_done").format(source=result["source"],
+                                                                                 count=result["restored"])
+                st.rerun(scope="fragment")
+        if "inventory_undone" in st.session_state:
+            st.success(st.session_state.pop("inventory_undone"))
+
+        version = current_data_version(pantry_id)
+        history_key = ("inventory_history", pantry_id, version, date.today().isoformat())
+        history = job_executor().run(history_key, inventory_history_job, pantry_id, wait=JOB_WAIT_SECONDS)
+
+        def state(name, quantity, unit):
+            return f"{name}: {fmt_qty(quantity)} {unit}" if name is not None else "—"
+        if history is None:
+            job_placeholder(history_key)
+        else:
+            st.caption(get_text("recent_changes"))
+            st.dataframe([
+                {"When": batch["created_at"][:16].replace("T", " "), "Source": batch["source"],
+                 "Before": state(c["old_name"], c["old_quantity"], c["old_unit"]),
+                 "After": state(c["new_name"], c["new_quantity"], c["new_unit"]),
+                 "Undone": batch["undone_by"] is not None}
+                for batch in history["batches"] for c in batch["changes"]
+            ], hide_index=True)
+            st.caption(get_text("consumption_rates").format(days=30))
+            st.dataframe([{"Name": r["name"], "Per day": f"{fmt_qty(r['per_day'])} {r['base_unit']}",
+                           "Total": f"{fmt_qty(r['consumed'])} {r['base_unit']}"}
+                          for r in history["rates"]], hide_index=True)
+        # Today's stock is the table above, so nothing is read until a past day is picked
+        day = st.date_input(get_text("stock_as_of"), value=None, max_value=date.today(),
+                            key="inventory_as_of_day")
+        if day is not None and day < date.today():
+            as_of_key = ("inventory_as_of", pantry_id, version, day.isoformat())
+            past = job_executor().run(as_of_key, inventory_as_of_job, pantry_id, f"{day.isoformat()}T23:59:59.999Z",
+                                      wait=JOB_WAIT_SECONDS)
+            if past is None:
+                job_placeholder(as_of_key)
+            elif past["rows"] is None:
+                st.info(get_text("history_unavailable"))
+            else:
+                st.dataframe([{"Name": r["name"], "Quantity": fmt_qty(r["quantity"]), "Unit": r["unit"]}
+                              for r in sorted(past["rows"], key=lambda r: r["name"].lower())], hide_index=True)
 
+@st.fragment
 def recipes_page():
-    user_id = current_user_id()
-    if not user_id:
+    metrics.incr("page.recipes")
+    pantry_id = current_pantry_id()
+    if not pantry_id:
         st.error("You must be logged in to access recipes. Please log in.")
         return
+    from backup import import_user_data
+    from business_logic import resolve_sub_recipes
+    from jobs import FAILED, recipes_csv_job, backup_export_job, index_refresh_job
+    from nutrition import cookbook_nutrition
+    from recommend import get_index, recipe_titles
     st.header(get_text("recipes"))
     st.subheader(get_text("your_recipes"))
 
     # Load recipes
-    recipes_key = f"recipes_data_{user_id}"
-    if recipes_key not in st.session_state:
-        st.session_state[recipes_key] = DatabaseManager.list_recipes(user_id)
+    recipes_key = f"recipes_data_{pantry_id}"
+    load_user_data(pantry_id, recipes=True)
     recipes = st.session_state[recipes_key]
 
+    # Exports and the recommendation index are prepared by background jobs keyed
+    # by the user's data version, so they are rebuilt only after a change
+    jobs = job_executor()
+    version = current_data_version(pantry_id)
+    jobs.submit(("index", pantry_id, version), index_refresh_job, pantry_id)
+
     # Download all recipes as CSV
     if recipes:
-        output = io.StringIO()
-        writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL)
-        writer.writerow(["Recipe ID", "Title", "Category", "Instructions", "Ingredient Name", "Quantity", "Unit"])
-        for r in sorted(recipes, key=lambda x: x["title"].lower()):
-            for ing in r["ingredients"]:
-                writer.writerow([
-                    r["id"],
-                    r["title"],
-                    r["category"] or "",
-                    r["instructions"] or "",
-                    ing["name"],
-                    ing["quantity"],
-                    ing["unit"]
-                ])
-            if r["ingredients"]:
-                writer.writerow([])
-        csv_data = output.getvalue()
+        csv_data = jobs.run(("recipes_csv", pantry_id, version), recipes_csv_job, pantry_id, wait=JOB_WAIT_SECONDS)
         st.download_button(
             label=get_text("download_all_csv"),
-            data=csv_data,
+            data=csv_data or "",
             file_name=f"all_recipes_{date.today().isoformat()}.csv",
             mime="text/csv",
-            key="download_all_recipes"
+            key="download_all_recipes",
+            disabled=csv_data is None,
         )
 
+    # Per-user backup in the compact binary format, and restore from one
+    with st.expander(get_text("backup_restore"), expanded=False):
+        backup_blob = jobs.run(("backup", pantry_id, version), backup_export_job, pantry_id, wait=JOB_WAIT_SECONDS)
+        if backup_blob is None and jobs.status(("backup", pantry_id, version)) == FAILED:
+            st.error(get_text("job_failed"))
+        st.download_button(
+            label=get_text("download_backup") if backup_blob is not None else get_text("preparing"),
+            data=backup_blob or b"",
+            file_name=f"ruaden_backup_{date.today().isoformat()}.rdb",
+            mime="application/octet-stream",
+            key="download_user_backup",
+            disabled=backup_blob is None,
+        )
+        uploaded = st.file_uploader(get_text("restore_backup"), type=["rdb"], key="restore_backup_file")
+        if uploaded is not None and st.button(get_text("restore_backup"), key="restore_backup_btn"):
+            try:
+                counts = import_user_data(pantry_id, uploaded.getvalue())
+            except ValueError as e:
+                st.error(f"{get_text('restore_failed')}: {e}")
+            else:
+                st.success(get_text("restore_success").format(**counts))
+                st.session_state.pop(recipes_key, None)
+                st.session_state.pop(f"inventory_data_{pantry_id}", None)
+                st.rerun(scope="fragment")
+
     # Form for adding new recipe in an expandable frame
     with st.expander(get_text('add_recipe'), expanded=False):
         with st.form("new_recipe_form", clear_on_submit=True):
@@ -494,6 +600,13 @@ def recipes_page():
                 placeholder="e.g., Main Dish",
                 key="new_recipe_category_input"
             )
+            servings = st.number_input(
+                get_text("servings"),
+                min_value=0.5,
+                step=1.0,
+                value=2.0,
+                key="new_recipe_servings_input"
+            )
             instructions = st.text_area(
                 get_text("instructions"),
                 value=st.session_state.new_recipe_instructions,
@@ -501,6 +614,7 @@ def recipes_page():
                 key="new_recipe_instructions_input"
             )
             st.markdown(get_text("unit_tips"))
+            st.caption(get_text("sub_recipe_tip"))
 
             # Update session state with form inputs
             if title != st.session_state.new_recipe_title:
@@ -550,74 +664,88 @@ def recipes_page():
                 elif not ingredients:
                     st.error(get_text("error_ingredients_required"))
                 else:
-                    # Check for duplicate recipe title
-                    existing_recipes = DatabaseManager.list_recipes(user_id)
-                    if any(DatabaseManager.normalize_name(r["title"]) == DatabaseManager.normalize_name(title) for r in existing_recipes):
-                        st.error(get_text("duplicate_recipe"))
-                    else:
-                        valid = True
-                        for ing in ingredients:
-                            if not ing["name"].strip() or not validate_unit(ing["unit"]) or not DatabaseManager.validate_name(ing["name"]):
-                                st.error(get_text("error_invalid_name") + f" ({ing['name']})" if not ing["name"].strip() else get_text("error_invalid_unit"))
-                                valid = False
-                            if ing["quantity"] <= 0:
-                                st.error(get_text("error_negative_qty"))
-                                valid = False
+                    valid = True
+                    for ing in ingredients:
+                        if not ing["name"].strip() or not validate_unit(ing["unit"]) or not DatabaseManager.validate_name(ing["name"]):
+                            st.error(get_text("error_invalid_name") + f" ({ing['name']})" if not ing["name"].strip() else get_text("error_invalid_unit"))
+                            valid = False
+                        if ing["quantity"] <= 0:
+                            st.error(get_text("error_negative_qty"))
+                            valid = False
                     if valid:
-                        if DatabaseManager.create_recipe_from_table(user_id, title, category, instructions, ingredients):
+                        ingredients = resolve_sub_recipes(ingredients, recipes)
+                        # Duplicate titles are caught by the unique title index
+                        outcome = DatabaseManager.upsert_recipes(pantry_id, [{
+                            "title": title, "category": category, "instructions": instructions,
+                            "servings": servings, "ingredients": ingredients,
+                        }])[0]
+                        if outcome["status"] == "duplicate":
+                            st.error(get_text("duplicate_recipe"))
+                        elif outcome["status"] == "created":
                             st.success(f"Added recipe '{title}'.")
                             # Clear session state after successful save
                             st.session_state.pop("new_recipe_title", None)
                             st.session_state.pop("new_recipe_category", None)
                             st.session_state.pop("new_recipe_instructions", None)
                             st.session_state.pop("new_recipe_data", None)
-                            # Add the new recipe to session state
-                            new_recipe = DatabaseManager.get_recipe_by_title(user_id, title)
-                            if new_recipe:
-                                if recipes_key not in st.session_state:
-                                    st.session_state[recipes_key] = []
-                                st.session_state[recipes_key].append(new_recipe)
-                                st.rerun()
+                            st.session_state[recipes_key] = user_recipes(pantry_id)
+                            st.rerun(scope="fragment")
                         else:
                             st.error(f"Failed to add recipe '{title}'.")
-                            logger.error(f"Failed to add recipe '{title}' for user_id={user_id}")
+                            logger.error(f"Failed to add recipe '{title}' for pantry_id={pantry_id}")
 
     # Display existing recipes
     if not recipes:
         st.info(get_text("no_recipes"))
         st.warning("No recipes yet. Use the form above to add a new recipe (e.g., 'Chicken Curry' with ingredients like 'chicken', 'curry powder').")
     else:
-        for r in sorted(recipes, key=lambda x: x["title"].lower()):
+        t = session_translator()
+        index = get_index(pantry_id, refresh=False)
+        # Cached per recipe version, so this only computes recipes edited since the last render
+        nutrition = cookbook_nutrition(recipes)
+        for r in view(recipes, "by_title", lambda: sorted(recipes, key=lambda x: x["title"].lower())):
             with st.expander(f"{r['title']} ({r['category'] or 'No Category'}) - Editable"):
+                similar = recipe_titles(index, (rid for rid, score in index.similar(r["id"], k=3) if score > 0))
+                if similar:
+                    st.caption(t("similar_recipes").format(titles=", ".join(similar)))
+                st.caption(nutrition_caption(nutrition[r["id"]], "nutrition_per_serving"))
                 # Editable fields mirroring the form
                 with st.form(key=f"edit_recipe_form_{r['id']}"):
                     edit_title = st.text_input(
-                        get_text("recipe_title"),
+                        t("recipe_title"),
                         value=r["title"],
                         key=f"edit_title_{r['id']}"
                     )
                     edit_category = st.text_input(
-                        get_text("category"),
+                        t("category"),
                         value=r["category"] or "",
                         key=f"edit_category_{r['id']}"
                     )
+                    edit_servings = st.number_input(
+                        t("servings"),
+                        min_value=0.5,
+                        step=1.0,
+                        value=float(r.get("servings") or 1),
+                        key=f"edit_servings_{r['id']}"
+                    )
                     edit_instructions = st.text_area(
-                        get_text("instructions"),
+                        t("instructions"),
                         value=r["instructions"] or "",
                         key=f"edit_instructions_{r['id']}"
                     )
-                    st.markdown(get_text("unit_tips"))
+                    st.markdown(t("unit_tips"))
+                    st.caption(t("sub_recipe_tip"))
 
                     # Convert ingredients to data editor format
-                    edit_ingredients = [
+                    edit_ingredients = view(recipes, ("ingredient_rows", r["id"]), lambda: [
                         {"Name": ing["name"], "Quantity": ing["quantity"], "Unit": ing["unit"]}
                         for ing in r["ingredients"]
-                    ]
+                    ])
                     edited_data = st.data_editor(
                         edit_ingredients,
                         column_config={
                             "Name": st.column_config.TextColumn(
-                                label=get_text("ingredient_name"),
+                                label=t("ingredient_name"),
                                 required=True
                             ),
                             "Quantity": st.column_config.NumberColumn(
@@ -644,120 +772,155 @@ def recipes_page():
                     # Buttons side by side
                     col1, col2 = st.columns([1, 1])
                     with col1:
-                        if st.form_submit_button(get_text("update_recipe")):
+                        if st.form_submit_button(t("update_recipe")):
                             if not edit_title.strip():
-                                st.error(get_text("error_title_required"))
+                                st.error(t("error_title_required"))
                             elif not ingredients:
-                                st.error(get_text("error_ingredients_required"))
+                                st.error(t("error_ingredients_required"))
                             else:
                                 valid = True
                                 for ing in ingredients:
                                     if not ing["name"].strip() or not validate_unit(ing["unit"]) or not DatabaseManager.validate_name(ing["name"]):
-                                        st.error(f"Invalid ingredient: {get_text('error_invalid_name')} or {get_text('error_invalid_unit')}")
+                                        st.error(f"Invalid ingredient: {t('error_invalid_name')} or {t('error_invalid_unit')}")
                                         valid = False
                                     if ing["quantity"] <= 0:
-                                        st.error(get_text("error_negative_qty"))
+                                        st.error(t("error_negative_qty"))
                                         valid = False
+                                ingredients = resolve_sub_recipes(ingredients, recipes, exclude_id=r["id"])
+                                sub_ids = [ing["sub_recipe_id"] for ing in ingredients if ing["sub_recipe_id"]]
+                                if valid and DatabaseManager.would_create_cycle(r["id"], sub_ids):
+                                    st.error(t("sub_recipe_cycle"))
+                                    valid = False
                                 if valid:
-                                    if DatabaseManager.create_recipe_from_table(user_id, edit_title, edit_category, edit_instructions, ingredients, recipe_id=r["id"]):
-                                        st.success(get_text("update_success").format(title=edit_title))
-                                        # Update session state with the modified recipe
-                                        updated_recipe = DatabaseManager.get_recipe_by_title(user_id, edit_title)
-                                        if updated_recipe:
-                                            recipes[recipes.index(r)] = updated_recipe
-                                            st.session_state.recipes_data = recipes
-                                        st.rerun()
+                                    if DatabaseManager.create_recipe_from_table(pantry_id, edit_title, edit_category, edit_instructions, ingredients, recipe_id=r["id"], servings=edit_servings, expected_version=r["version"]):
+                                        st.success(t("update_success").format(title=edit_title))
+                                        st.session_state[recipes_key] = user_recipes(pantry_id)
+                                        st.rerun(scope="fragment")
+                                    elif recipe_changed(pantry_id, r):
+                                        st.warning(t("recipe_conflict").format(title=r["title"]))
                                     else:
-                                        st.error(get_text("update_failed").format(title=edit_title))
-                                        logger.error(f"Failed to update recipe '{edit_title}' (id={r['id']}) for user_id={user_id}")
+                                        st.error(t("update_failed").format(title=edit_title))
+                                        logger.error(f"Failed to update recipe '{edit_title}' (id={r['id']}) for pantry_id={pantry_id}")
                     with col2:
-                        if st.form_submit_button(get_text("delete_recipe")):
-                            st.info(get_text("deleting").format(title=r["title"]))
-                            logger.info(f"Attempting to delete recipe '{r['title']}' (id={r['id']}) for user_id={user_id}")
-                            if DatabaseManager.delete_recipe(r["id"]):
-                                st.success(get_text("delete_success").format(title=r["title"]))
+                        if st.form_submit_button(t("delete_recipe")):
+                            st.info(t("deleting").format(title=r["title"]))
+                            logger.info(f"Attempting to delete recipe '{r['title']}' (id={r['id']}) for pantry_id={pantry_id}")
+                            if DatabaseManager.delete_recipe(r["id"], expected_version=r["version"]):
+                                st.success(t("delete_success").format(title=r["title"]))
                                 logger.info(f"Successfully deleted recipe '{r['title']}' (id={r['id']})")
-                                st.session_state[recipes_key] = DatabaseManager.list_recipes(user_id)
-                                st.rerun()
+                                st.session_state[recipes_key] = user_recipes(pantry_id)
+                                st.rerun(scope="fragment")
+                            elif recipe_changed(pantry_id, r):
+                                st.warning(t("recipe_conflict").format(title=r["title"]))
                             else:
-                                st.error(get_text("delete_failed").format(title=r["title"]))
+                                st.error(t("delete_failed").format(title=r["title"]))
                                 logger.error(f"Failed to delete recipe '{r['title']}' (id={r['id']})")
 
+@st.fragment
 def feasibility_page():
-    user_id = current_user_id()
-    if not user_id:
+    metrics.incr("page.feasibility")
+    pantry_id = current_pantry_id()
+    if not pantry_id:
         st.error(get_text("not_logged_in"))
         return
+    from business_logic import consume_ingredients_for_recipe, expiring_soon
+    from jobs import cheapest_week_job, feasibility_job, forecast_job
+    from nutrition import plan_nutrition
+    from recommend import get_index, recipe_titles
     st.header(get_text("feasibility"))
     st.subheader(get_text("you_can_cook"))
-    inventory_key = f"inventory_data_{user_id}"
-    recipes_key = f"recipes_data_{user_id}"
-    if inventory_key not in st.session_state:
-        try:
-            st.session_state[inventory_key] = DatabaseManager.list_inventory(user_id)
-        except Exception as e:
-            logger.error(f"Error loading inventory: {e}")
-            st.error("Failed to load inventory.")
-            st.session_state[inventory_key] = []
+    inventory_key = f"inventory_data_{pantry_id}"
+    recipes_key = f"recipes_data_{pantry_id}"
+    load_user_data(pantry_id, inventory=True, recipes=True)
     inventory = st.session_state[inventory_key]
-    if recipes_key not in st.session_state:
-        try:
-            st.session_state[recipes_key] = DatabaseManager.list_recipes(user_id)
-        except Exception as e:
-            logger.error(f"Error loading recipes: {e}")
-            st.error("Failed to load recipes.")
-            st.session_state[recipes_key] = []
     recipes = st.session_state[recipes_key]
-    def norm_name(name):
-        return DatabaseManager.normalize_name(name).strip().lower()
-    def norm_unit(unit):
-        return unit.strip().lower()
-    inventory_dict = {}
-    for ing in inventory:
-        if ing.get('name') and ing.get('unit'):
-            key = (norm_name(ing['name']), norm_unit(ing['unit']))
-            inventory_dict[key] = ing
-    recipe_results = []
+    scale = st.select_slider(
+        get_text("scale"),
+        options=SCALE_OPTIONS,
+        value=1.0,
+        format_func=lambda f: f"{fmt_qty(f)}×",
+        key="feasibility_scale",
+    )
+    valid_recipes = []
     for recipe in recipes:
         if 'id' not in recipe or 'title' not in recipe or 'ingredients' not in recipe:
             logger.warning(f"Skipping invalid recipe: {recipe}")
             continue
-        missing = []
-        matched = []
-        for req_ing in recipe['ingredients']:
-            req_name = norm_name(req_ing['name'])
-            req_qty = req_ing.get('quantity', 0.0)
-            req_unit = norm_unit(req_ing.get('unit', ''))
-            inv = inventory_dict.get((req_name, req_unit))
-            have_qty = inv['quantity'] if inv else 0.0
-            if have_qty >= req_qty:
-                matched.append({
-                    "Name": req_ing['name'],
-                    "Need": req_qty,
-                    "Have": have_qty,
-                    "Unit": req_unit,
-                    "Missing": 0
-                })
+        valid_recipes.append(recipe)
+    # Quantities are compared in base units, so g/kg, ml/l/cup etc. match each other.
+    # The table is computed by a background job and shared by reruns until the data changes.
+    version = current_data_version(pantry_id)
+    feasibility_key = ("feasibility", pantry_id, version, scale)
+    shared_results = job_executor().run(feasibility_key, feasibility_job, pantry_id, scale, wait=JOB_WAIT_SECONDS)
+    if shared_results is None:
+        job_placeholder(feasibility_key)
+        if st.button(get_text("refresh"), key="feasibility_refresh"):
+            st.rerun(scope="fragment")
+        return
+    recipe_results = [dict(r) for r in shared_results]
+    prices = user_prices(pantry_id, version)
+    prefer_expiring = st.checkbox(get_text("prefer_expiring"), value=True, key="prefer_expiring")
+    soon = expiring_soon(inventory) if prefer_expiring else {}
+    for r in recipe_results:
+        dates = [soon[m["key"]] for m in r["matched"] if m["key"] in soon]
+        r["expires_first"] = min(dates) if dates else None
+    # Least missing first; among equals, recipes using stock that expires soonest
+    recipe_results.sort(key=lambda x: (x["missing_count"], x["expires_first"] is None,
+                                       x["expires_first"] or "", -len(x["matched"])))
+    if prices:
+        sort_by = st.radio(get_text("sort_by"), ["least_missing", "cheapest"], horizontal=True,
+                           format_func=lambda o: get_text(f"sort_{o}"), key="feasibility_sort")
+        if sort_by == "cheapest":
+            # Missing ingredients without a price make the shopping cost unknown, so those go last
+            recipe_results.sort(key=lambda x: (sum(m["missing_cost"] is None for m in x["missing"]),
+                                               x["shopping_cost"], x["missing_count"]))
+        with st.expander(get_text("cheapest_week"), expanded=False):
+            meals = int(st.number_input(get_text("meals"), min_value=1, max_value=21, value=7, step=1,
+                                        key="week_meals"))
+            week_key = ("week", pantry_id, version, meals, scale)
+            week = job_executor().run(week_key, cheapest_week_job, pantry_id, meals, scale, wait=JOB_WAIT_SECONDS)
+            if week is None:
+                job_placeholder(week_key)
             else:
-                missing.append({
-                    "Name": req_ing['name'],
-                    "Need": req_qty,
-                    "Have": have_qty,
-                    "Unit": req_unit,
-                    "Missing": req_qty - have_qty
-                })
-        recipe_results.append({
-            "recipe": recipe,
-            "matched": matched,
-            "missing": missing,
-            "missing_count": len(missing)
-        })
-    recipe_results.sort(key=lambda x: (x["missing_count"], -len(x["matched"])))
+                for i, p in enumerate(week["plan"], 1):
+                    st.markdown(f"{i}. {p['recipe']['title']} — {fmt_money(p['shopping_cost'])}")
+                st.caption(get_text("week_total").format(total=fmt_money(week["total"])))
+                st.caption(nutrition_caption(plan_nutrition(((p["recipe"], p["portions"]) for p in week["plan"]),
+                                                            recipes), "nutrition_plan"))
+                if week["unpriced"]:
+                    st.caption(get_text("unpriced").format(count=week["unpriced"]))
+                if week["shopping"] and st.button(get_text("send_week_to_shopping"), key="week_to_shopping"):
+                    st.session_state['shopping_list_data'] = [
+                        {"Name": item["Name"], "Quantity": item["Quantity"], "Unit": item["Unit"]}
+                        for item in week["shopping"]]
+                    st.success("Missing ingredients sent to Shopping List tab.")
+    # Usage rates are smoothed by a background job that only reads history added since its last run
+    with st.expander(get_text("restock"), expanded=False):
+        forecast_key = ("forecast", pantry_id, version, date.today().isoformat())
+        outlook = job_executor().run(forecast_key, forecast_job, pantry_id, wait=JOB_WAIT_SECONDS)
+        if outlook is None:
+            job_placeholder(forecast_key)
+        elif not outlook["ingredients"]:
+            st.info(get_text("restock_empty"))
+        else:
+            st.caption(get_text("restock_caption").format(days=FORECAST_RESTOCK_DAYS, cover=FORECAST_COVER_DAYS))
+            st.dataframe([{"Name": i["name"], "Stock": f"{fmt_qty(i['stock'])} {i['unit']}",
+                           "Per day": f"{fmt_qty(i['per_day'])} {i['unit']}", "Runs out": i["runs_out"] or "—"}
+                          for i in outlook["ingredients"]], hide_index=True)
+            if outlook["restock"] and st.button(get_text("send_restock_to_shopping"), key="restock_to_shopping"):
+                st.session_state['shopping_list_data'] = list(outlook["restock"])
+                st.success("Missing ingredients sent to Shopping List tab.")
+    if soon:
+        index = get_index(pantry_id, refresh=False)
+        use_up = [(recipe_titles(index, [rid]), count) for rid, _, count in index.best_coverage({k[0] for k in soon}, k=3)]
+        if use_up:
+            st.info(get_text("use_expiring").format(
+                titles=", ".join(f"{titles[0]} ({count})" for titles, count in use_up if titles)))
     st.markdown("#### Select recipes to cook (least missing on top)")
-    recipe_titles = [r["recipe"]["title"] for r in recipe_results]
+    result_titles = [r["recipe"]["title"] for r in recipe_results]
     selected_titles = st.multiselect(
         "Select recipes to cook:",
-        options=recipe_titles,
+        options=result_titles,
         default=[]
     )
     for r in recipe_results:
@@ -765,12 +928,27 @@ def feasibility_page():
         matched = r["matched"]
         missing = r["missing"]
         st.markdown(f"#### {recipe['title']}")
+        if scale != 1.0:
+            st.caption(get_text("scaled_servings").format(servings=fmt_qty(r["portions"])))
+        if r["expires_first"]:
+            st.caption(get_text("uses_expiring").format(date=r["expires_first"]))
+        if prices:
+            st.caption(get_text("recipe_cost").format(cost=fmt_money(r["cost"]), shopping=fmt_money(r["shopping_cost"])))
+            if r["unpriced"]:
+                st.caption(get_text("unpriced").format(count=r["unpriced"]))
         if not missing:
             st.success(get_text("all_available"))
+            if st.button(get_text("cook"), key=f"cook_{recipe['id']}"):
+                if consume_ingredients_for_recipe(recipe, pantry_id, scale, by_id={v["id"]: v for v in valid_recipes}):
+                    st.session_state[inventory_key] = user_inventory(pantry_id)
+                    st.success(get_text("cooked").format(title=recipe["title"]))
+                    st.rerun(scope="fragment")
+                else:
+                    st.error(get_text("cook_failed").format(title=recipe["title"]))
         else:
             st.warning(get_text("missing_something"))
             try:
-                st.data_editor(missing, column_config={
+                st.data_editor([{k: m[k] for k in MISSING_COLUMNS} for m in missing], column_config={
                     "Name": st.column_config.TextColumn(required=True),
                     "Need": st.column_config.NumberColumn(min_value=0.0, step=0.1, required=True),
                     "Have": st.column_config.NumberColumn(min_value=0.0, step=0.1, required=True),
@@ -788,45 +966,46 @@ def feasibility_page():
     if selected_titles and selected_missing and st.button("Send missing ingredients to Shopping List"):
         st.session_state['shopping_list_data'] = selected_missing
         st.success("Missing ingredients sent to Shopping List tab.")
-        st.rerun()
+        st.rerun(scope="fragment")
 
+@st.fragment
 def shopping_list_page():
-    user_id = current_user_id()
-    if not user_id:
+    metrics.incr("page.shopping_list")
+    pantry_id = current_pantry_id()
+    if not pantry_id:
         st.error(get_text("not_logged_in"))
         return
-    inventory_key = f"inventory_data_{user_id}"
-    if inventory_key not in st.session_state:
-        try:
-            st.session_state[inventory_key] = DatabaseManager.list_inventory(user_id)
-        except Exception as e:
-            logger.error(f"Error loading inventory: {e}")
-            st.error("Failed to load inventory.")
-            st.session_state[inventory_key] = []
-    inventory = st.session_state[inventory_key]
+    inventory_key = f"inventory_data_{pantry_id}"
     def norm_name(name):
         return DatabaseManager.normalize_name(name).strip().lower()
-    def norm_unit(unit):
-        return unit.strip().lower()
-    inventory_dict = {}
-    for ing in inventory:
-        if ing.get('name') and ing.get('unit'):
-            key = (norm_name(ing['name']), norm_unit(ing['unit']))
-            inventory_dict[key] = ing
     shopping_list = st.session_state.get('shopping_list_data', [])
+    prices = user_prices(pantry_id, current_data_version(pantry_id))
+    def estimate(item):
+        if not item.get("Name") or not item.get("Unit") or item.get("Quantity") is None:
+            return None
+        base_qty, base_unit = to_base(item["Quantity"], item["Unit"])
+        price = prices.get((norm_name(item["Name"]), base_unit))
+        return round(base_qty * price, CURRENCY_DECIMALS) if price is not None else None
     st.header(get_text("shopping_list"))
     if shopping_list:
-        shopping_list = sorted(shopping_list, key=lambda x: x["Name"].lower())
+        shopping_list = sorted(({"Name": item["Name"], "Quantity": item["Quantity"], "Unit": item["Unit"],
+                                 "Estimate": estimate(item), "Price paid": item.get("Price paid")}
+                                for item in shopping_list), key=lambda x: x["Name"].lower())
         shopping_data = st.data_editor(
             shopping_list,
             column_config={
                 "Name": st.column_config.TextColumn(required=True),
                 "Quantity": st.column_config.NumberColumn(min_value=0.0, step=0.1, required=True),
                 "Unit": st.column_config.SelectboxColumn(options=VALID_UNITS, required=True),
+                "Estimate": st.column_config.NumberColumn(disabled=True),
+                "Price paid": st.column_config.NumberColumn(label=get_text("price_paid"), min_value=0.0),
             },
             num_rows="dynamic",
             key="shopping_list_editor",
         )
+        estimates = [estimate(item) for item in shopping_data]
+        if any(e is not None for e in estimates):
+            st.caption(get_text("estimated_total").format(total=fmt_money(sum(e or 0.0 for e in estimates))))
         purchased_names = st.multiselect(
             "Select purchased ingredients:",
             options=[f"{item['Name']} ({item['Unit']})" for item in shopping_data],
@@ -836,14 +1015,87 @@ def shopping_list_page():
             for item in shopping_data:
                 item_label = f"{item['Name']} ({item['Unit']})"
                 if item_label in purchased_names:
-                    inv = inventory_dict.get((norm_name(item["Name"]), norm_unit(item["Unit"])))
-                    if inv:
-                        new_qty = inv["quantity"] + item["Quantity"]
-                        DatabaseManager.update_inventory_item(inv["id"], inv["name"], new_qty, inv["unit"])
-                    else:
-                        DatabaseManager.upsert_inventory(user_id, item["Name"], item["Quantity"], item["Unit"])
-            st.session_state[inventory_key] = DatabaseManager.list_inventory(user_id)
+                    # Added as a lot in the database rather than as "old total + bought", so a
+                    # pantry member's concurrent change to the same row is not overwritten
+                    DatabaseManager.add_inventory_lot(pantry_id, item["Name"], item["Quantity"], item["Unit"])
+                    if item.get("Price paid"):
+                        DatabaseManager.record_price(pantry_id, item["Name"], item["Price paid"], item["Quantity"],
+                                                     item["Unit"])
+            st.session_state[inventory_key] = user_inventory(pantry_id)
             st.success(get_text("purchased"))
-            st.rerun()
+            st.rerun(scope="fragment")
     else:
-        st.info(get_text("empty_list"))
\ No newline at end of file
+        st.info(get_text("empty_list"))
+@st.fragment
+def household_page():
+    metrics.incr("page.household")
+    user_id = current_user_id()
+    if not user_id:
+        st.error(get_text("not_logged_in"))
+        return
+    pantry_id = current_pantry_id()
+    st.header(get_text("household"))
+    if pantry_id != user_id:
+        st.info(get_text("pantry_member_of").format(owner=DatabaseManager.get_username(pantry_id)))
+        if st.button(get_text("leave_pantry")):
+            DatabaseManager.leave_pantry(user_id)
+            # A full rerun, so main switches this session back to the user's own pantry
+            st.rerun()
+        return
+    members = DatabaseManager.pantry_members(user_id)
+    st.subheader(get_text("pantry_members"))
+    if not members:
+        st.caption(get_text("no_pantry_members"))
+    for member in members:
+        col1, col2 = st.columns([3, 1])
+        col1.write(member["username"])
+        if col2.button(get_text("remove_member"), key=f"remove_member_{member['user_id']}"):
+            DatabaseManager.leave_pantry(member["user_id"], pantry_id=user_id)
+            st.rerun(scope="fragment")
+    if st.button(get_text("create_invite")):
+        code = DatabaseManager.create_pantry_invite(user_id)
+        st.success(get_text("invite_code").format(code=code, hours=PANTRY_INVITE_HOURS))
+    if not members:
+        with st.form("join_pantry_form", clear_on_submit=True):
+            code = st.text_input(get_text("join_pantry"))
+            if st.form_submit_button(get_text("join_button")):
+                if not invite_limiter.allow(str(user_id)):
+                    st.error(get_text("too_many_attempts"))
+                else:
+                    joined, message = DatabaseManager.join_pantry(user_id, code)
+                    if joined:
+                        invite_limiter.reset(str(user_id))
+                        logger.info(f"user_id={user_id} joined pantry via invite")
+                        st.rerun()
+                    else:
+                        st.error(message)
+
+# Each page is a fragment, so its widgets and writes rerun only that page. Only
+# the selected page renders: the others (feasibility over every recipe, say) cost
+# nothing until opened, and opening one is a full rerun that syncs the data version.
+PAGES = (
+    ("Inventory", inventory_page),
+    ("Recipes", recipes_page),
+    ("Shopping List", shopping_list_page),
+    ("Feasibility & Shopping", feasibility_page),
+    ("Household", household_page),
+)
+
+def nutrition_caption(nutrition, key):
+    text = get_text(key).format(**{k: fmt_qty(round(v)) for k, v in nutrition.values.items()})
+    if nutrition.unknown:
+        text += "  \n" + get_text("nutrition_unknown").format(names=", ".join(nutrition.unknown))
+    return text
+
+def page_nav():
+    choice = st.radio("Page", [label for label, _ in PAGES], horizontal=True, key="active_page",
+                      label_visibility="collapsed")
+    dict(PAGES)[choice]()
+
+def metrics_panel():
+    """Process work counters, and how much they moved since this session's previous full run."""
+    current = metrics.snapshot()
+    previous = st.session_state.get("metrics_snapshot", {})
+    st.session_state.metrics_snapshot = current
+    with st.sidebar.expander("Metrics", expanded=False):
+        st.json({"since_last_run": metrics.delta(previous, current), "total": current})
@@ -1,5 +1,6 @@
 import math
 import logging
+from config import CURRENCY, CURRENCY_DECIMALS
 
 logger = logging.getLogger(__name__)
 
@@ -20,10 +21,15 @@ UNIT_ALIASES = {
         "piece": ("piece", 1.0), "pieces": ("piece", 1.0),
         "pc": ("piece", 1.0), "pcs": ("piece", 1.0),
         "cai": ("piece", 1.0), "cái": ("piece", 1.0), "cai.": ("piece", 1.0),
+    },
+    # Portions of another recipe, used for sub-recipe lines
+    "portion": {
+        "serving": ("serving", 1.0), "servings": ("serving", 1.0),
+        "portion": ("serving", 1.0), "phần": ("serving", 1.0),
     }
 }
 
-PRETTY_UNIT = {"g": "g", "ml": "ml", "piece": "piece"}
+PRETTY_UNIT = {"g": "g", "ml": "ml", "piece": "piece", "serving": "serving"}
 VALID_UNITS = sorted([k for cat in UNIT_ALIASES for k in UNIT_ALIASES[cat]])
 
 def normalize_unit(unit: str) -> tuple[str, float]:
@@ -54,4 +60,17 @@ def same_dimension(u1: str, u2: str) -> bool:
 def fmt_qty(q: float) -> str:
     if math.isclose(q, round(q), rel_tol=1e-6):
         return str(int(round(q)))
-    return f"{q:.2f}".rstrip("0").rstrip(".")
\ No newline at end of file
+    return f"{q:.2f}".rstrip("0").rstrip(".")
+
+def fmt_money(amount: float) -> str:
+    return f"{amount:,.{CURRENCY_DECIMALS}f} {CURRENCY}"
+
+def round_for_unit(q: float, unit: str) -> float:
+    """Round a computed quantity to something you could measure in ``unit``."""
+    if normalize_unit(unit)[0] == "piece":
+        return float(math.ceil(q - 1e-6))
+    if q >= 100:
+        return float(round(q))
+    if q >= 10:
+        return round(q, 1)
+    return round(q, 2)